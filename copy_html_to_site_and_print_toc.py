@@ -4,6 +4,7 @@ from collections import namedtuple
 from pathlib import Path
 import json
 from lxml import html
+from lxml.cssselect import CSSSelector
 import subprocess
 
 DEST = Path('/home/harry/workspace/www.obeythetestinggoat.com/content/book')
@@ -22,6 +23,17 @@ CHAPTERS.remove('ix.html')
 CHAPTERS.remove('author_bio.html')
 CHAPTERS.remove('colo.html')
 
+# compiled once, rather than re-translating the css on every chapter
+ELEMENTS_WITH_ID = CSSSelector('*[id]', translator='html')
+INTERNAL_LINKS = CSSSelector('a[href^="#"]', translator='html')
+HEAD = CSSSelector('head', translator='html')
+BODY = CSSSelector('body', translator='html')
+HEADER = CSSSelector('#header', translator='html')
+TOC = CSSSelector('#toc', translator='html')
+H1 = CSSSelector('h1', translator='html')
+H2 = CSSSelector('h2', translator='html')
+H3 = CSSSelector('h3', translator='html')
+
 ChapterInfo = namedtuple('ChapterInfo', 'href_id chapter_title subheaders xrefs')
 
 
@@ -39,7 +51,7 @@ def parse_chapters():
 def get_anchor_targets(parsed_html):
     ignores = {'header', 'content', 'footnotes', 'footer', 'footer-text'}
     all_ids = [
-        a.get('id') for a in parsed_html.cssselect('*[id]')
+        a.get('id') for a in ELEMENTS_WITH_ID(parsed_html)
     ]
     return [i for i in all_ids if not i.startswith('_') and i not in ignores]
 
@@ -52,14 +64,14 @@ def get_chapter_info():
     for chapter, parsed_html in parse_chapters():
         print('getting info from', chapter)
 
-        if not parsed_html.cssselect('h2'):
-            header = parsed_html.cssselect('h1')[0]
+        if not H2(parsed_html):
+            header = H1(parsed_html)[0]
         else:
-            header = parsed_html.cssselect('h2')[0]
+            header = H2(parsed_html)[0]
         href_id = header.get('id')
         if href_id is None:
-            href_id = parsed_html.cssselect('body')[0].get('id')
-        subheaders = [h.get('id') for h in parsed_html.cssselect('h3')]
+            href_id = BODY(parsed_html)[0].get('id')
+        subheaders = [h.get('id') for h in H3(parsed_html)]
 
         chapter_title = header.text_content()
         chapter_title = chapter_title.replace('Appendix A: ', '')
@@ -88,7 +100,7 @@ def get_chapter_info():
 
 def fix_xrefs(contents, chapter, chapter_info):
     parsed = html.fromstring(contents)
-    links = parsed.cssselect('a[href^=\#]')
+    links = INTERNAL_LINKS(parsed)
     for link in links:
         for other_chap in CHAPTERS:
             if other_chap == chapter:
@@ -106,7 +118,7 @@ def fix_xrefs(contents, chapter, chapter_info):
 
 def fix_title(contents, chapter, chapter_info):
     parsed = html.fromstring(contents)
-    titles = parsed.cssselect('h2')
+    titles = H2(parsed)
     if titles and titles[0].text.startswith('Appendix A'):
         title = titles[0]
         title.text = title.text.replace('Appendix A', chapter_info[chapter].chapter_title)
@@ -123,9 +135,9 @@ def copy_chapters_across_with_fixes(chapter_info, fixed_toc):
         new_contents = fix_xrefs(old_contents, chapter, chapter_info)
         new_contents = fix_title(new_contents, chapter, chapter_info)
         parsed = html.fromstring(new_contents)
-        body = parsed.cssselect('body')[0]
-        if parsed.cssselect('#header'):
-            head = parsed.cssselect('head')[0]
+        body = BODY(parsed)[0]
+        if HEADER(parsed):
+            head = HEAD(parsed)[0]
             head.append(html.fragment_fromstring('<script>' + load_toc_script + '</script>'))
             body.set('class', 'article toc2 toc-left')
         body.insert(0, buy_book_div)
@@ -144,7 +156,7 @@ def copy_chapters_across_with_fixes(chapter_info, fixed_toc):
 def extract_toc_from_book():
     subprocess.check_call(['make', 'book.html'], stdout=subprocess.PIPE)
     parsed = html.fromstring(open('book.html').read())
-    return parsed.cssselect('#toc')[0]
+    return TOC(parsed)[0]
 
 
 
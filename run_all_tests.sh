@@ -1,3 +1,4 @@
 export PYTHONHASHSEED=0
+python3 tests/commit_refs.py || exit 1
 py.test -s tests/test_chapter*.py
 export PYTHONHASHSEED=
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Reads listings straight out of a chapter's .asciidoc source, so a chapter
+test doesn't have to wait for a full asciidoctor + coderay build.
+
+Each listing block is rendered to the few lines of HTML that asciidoctor
+would produce for it, and handed to book_parser.parse_listing, so the
+CodeListing/Command/Output objects are the same ones the HTML path gives.
+
+    python tests/asciidoc_parser.py chapter_01 [chapter_02_unittest ...]
+
+compares the two paths for the chapters given (they need a built .html).
+"""
+from html import escape
+import os
+import re
+import sys
+
+from book_parser import get_listing_nodes, listing_to_dict, parse_listing
+
+
+BASE_DIR = os.path.split(os.path.abspath(os.path.dirname(__file__)))[0]
+
+VERBATIM_SUBS = ['specialcharacters', 'callouts']
+NORMAL_SUBS = ['specialcharacters', 'quotes', 'macros']
+SUBS_ALIASES = {
+    'none': [],
+    'normal': NORMAL_SUBS,
+    'verbatim': VERBATIM_SUBS,
+    'specialchars': ['specialcharacters'],
+    'c': ['specialcharacters'],
+    'q': ['quotes'],
+    'm': ['macros'],
+}
+
+# worked out from a listing rather than read from the book, like the
+# normalised text the listings cache keeps on each Output
+DERIVED_ATTRIBUTES = ['normalised']
+
+COMPOUND_DELIMITERS = {'====': 'example', '****': 'sidebar', '____': 'quote', '--': 'open'}
+OPAQUE_DELIMITERS = {'////': 'comment', '++++': 'pass', '|===': 'table'}
+VERBATIM_DELIMITERS = {'----': 'listing', '....': 'literal'}
+
+ATTRIBUTE_LINE = re.compile(r'^\[(?:|[\w"\'.#%{,][^\]]*)\]$')
+ANCHOR_LINE = re.compile(r'^\[\[[^\]]+\]\]$')
+BLOCK_TITLE_LINE = re.compile(r'^\.([^\s.].*)$')
+SECTION_UNDERLINE = re.compile(r'^(=+|-+|~+|\^+|\++)$')
+
+CALLOUT = re.compile(
+    r'(?:(?://|#|--|;;) ?)?(\\)?(?:&lt;|<)!?(|--)(\d+|\.)\2(?:&gt;|>)'
+    r'(?=(?: ?\\?(?:&lt;|<)!?\2(?:\d+|\.)\2(?:&gt;|>))*$)',
+    re.MULTILINE,
+)
+PASSTHROUGH = re.compile(
+    r'(\\?)pass:([a-z,]*)\[((?:\\\]|[^\]])*)\]|\+\+\+(.*?)\+\+\+|\$\$(.*?)\$\$',
+    re.DOTALL,
+)
+PASSTHROUGH_PLACEHOLDER = re.compile('\x96(\\d+)\x97')
+
+
+def _constrained(mark):
+    return re.compile(
+        r'(^|[^\w;:}])(?:\[([^\]]+)\])?' + mark[0] +
+        r'(\S|\S.*?\S)' + mark[1] + r'(?!\w)',
+        re.MULTILINE | re.DOTALL,
+    )
+
+
+def _unconstrained(mark, content=r'(.+?)'):
+    return re.compile(
+        r'\\?(?:\[([^\]]+)\])?' + mark + content + mark,
+        re.DOTALL,
+    )
+
+
+# asciidoctor's quote substitutions, in compat-mode (see the Makefile)
+QUOTE_SUBS = [
+    ('strong', False, _unconstrained(r'\*\*')),
+    ('strong', True, _constrained((r'\*', r'\*'))),
+    ('double', True, _constrained(('``', "''"))),
+    ('emphasis', True, _constrained(("'", "'"))),
+    ('single', True, _constrained(('`', "'"))),
+    ('monospaced', False, _unconstrained(r'\+\+')),
+    ('monospaced', True, _constrained((r'\+', r'\+'))),
+    ('emphasis', False, _unconstrained('__')),
+    ('emphasis', True, _constrained(('_', '_'))),
+    ('mark', False, _unconstrained('##')),
+    ('mark', True, _constrained(('#', '#'))),
+    ('superscript', False, _unconstrained(r'\^', r'(\S+?)')),
+    ('subscript', False, _unconstrained('~', r'(\S+?)')),
+]
+QUOTE_TAGS = {
+    'strong': ('<strong>', '</strong>'),
+    'emphasis': ('<em>', '</em>'),
+    'monospaced': ('<code>', '</code>'),
+    'superscript': ('<sup>', '</sup>'),
+    'subscript': ('<sub>', '</sub>'),
+    'double': ('&#8220;', '&#8221;'),
+    'single': ('&#8216;', '&#8217;'),
+}
+
+
+
+class Block(object):
+
+    def __init__(self, context, attributes, title, lines=None, blocks=None):
+        self.context = context
+        self.attributes = attributes
+        self.title = title
+        self.lines = lines or []
+        self.blocks = blocks or []
+
+    @property
+    def style(self):
+        return self.attributes.get(1)
+
+    @property
+    def roles(self):
+        return self.attributes.get('role', '').split()
+
+    def __repr__(self):
+        return '<Block %s %r>' % (self.context, self.attributes)
+
+
+
+def parse_attribute_list(text, attributes):
+    parts = re.findall(r'''(?:[^,"']|"[^"]*"|'[^']*')+''', text)
+    positional = 0
+    for part in parts:
+        part = part.strip()
+        if '=' in part and re.match(r'^[\w-]+=', part):
+            key, value = part.split('=', 1)
+            attributes[key] = value.strip().strip('"\'')
+            continue
+        positional += 1
+        value = part.strip('"\'')
+        if positional == 1 and re.search(r'[.#%]', value):
+            # shorthand, eg [source.some-role]
+            shorthand = re.split(r'([.#%])', value)
+            value = shorthand[0]
+            for marker, name in zip(shorthand[1::2], shorthand[2::2]):
+                if marker == '.':
+                    attributes['role'] = (attributes.get('role', '') + ' ' + name).strip()
+        attributes[positional] = value
+    return attributes
+
+
+def _is_delimiter(line):
+    for delimiters in (COMPOUND_DELIMITERS, OPAQUE_DELIMITERS, VERBATIM_DELIMITERS):
+        for delimiter, context in delimiters.items():
+            if line == delimiter or (
+                len(delimiter) == 4 and len(line) > 4 and
+                line == delimiter[0] * len(line) and delimiter[0] != '|'
+            ):
+                return context
+    return None
+
+
+def _is_section_underline(title, underline):
+    return (
+        SECTION_UNDERLINE.match(underline) and
+        re.match(r'^\w', title) and
+        abs(len(title) - len(underline)) < 2
+    )
+
+
+def parse_blocks(lines, pos=0, closing_delimiter=None):
+    blocks = []
+    attributes = {}
+    title = None
+    while pos < len(lines):
+        line = lines[pos]
+        if closing_delimiter is not None and line == closing_delimiter:
+            return blocks, pos + 1
+
+        if not line.strip():
+            pos += 1
+            continue
+        if line.startswith('//') and not line.startswith('////'):
+            pos += 1
+            continue
+        if ATTRIBUTE_LINE.match(line) and line != '[...]':
+            parse_attribute_list(line[1:-1], attributes)
+            pos += 1
+            continue
+        if ANCHOR_LINE.match(line):
+            pos += 1
+            continue
+        if BLOCK_TITLE_LINE.match(line) and not _is_delimiter(line):
+            title = BLOCK_TITLE_LINE.match(line).group(1)
+            pos += 1
+            continue
+
+        context = _is_delimiter(line)
+        if context in COMPOUND_DELIMITERS.values():
+            children, pos = parse_blocks(lines, pos + 1, closing_delimiter=line)
+            blocks.append(Block(context, attributes, title, blocks=children))
+        elif context is not None:
+            end = pos + 1
+            while end < len(lines) and lines[end] != line:
+                end += 1
+            if context in VERBATIM_DELIMITERS.values():
+                if attributes.get(1) in ('source', 'listing'):
+                    context = 'listing'
+                blocks.append(Block(context, attributes, title, lines=lines[pos + 1:end]))
+            pos = end + 1
+        elif pos + 1 < len(lines) and _is_section_underline(line, lines[pos + 1]):
+            pos += 2
+        else:
+            end = pos + 1
+            while end < len(lines) and lines[end].strip() and not (
+                _is_delimiter(lines[end]) or
+                (ATTRIBUTE_LINE.match(lines[end]) and lines[end] != '[...]') or
+                lines[end] == closing_delimiter
+            ):
+                end += 1
+            context = 'listing' if attributes.get(1) in ('source', 'listing') else 'paragraph'
+            blocks.append(Block(context, attributes, title, lines=lines[pos:end]))
+            pos = end
+        attributes = {}
+        title = None
+    return blocks, pos
+
+
+
+def resolve_subs(block, default):
+    if 'subs' not in block.attributes:
+        return list(default)
+    subs = []
+    for name in block.attributes['subs'].split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name.startswith('+') or name.endswith('+') or name.startswith('-'):
+            if not subs:
+                subs = list(default)
+            if name.startswith('-'):
+                for sub in SUBS_ALIASES.get(name[1:], [name[1:]]):
+                    if sub in subs:
+                        subs.remove(sub)
+            else:
+                subs.extend(SUBS_ALIASES.get(name.strip('+'), [name.strip('+')]))
+            continue
+        subs.extend(SUBS_ALIASES.get(name, [name]))
+    return subs
+
+
+def _convert_quote(kind, constrained, match):
+    if constrained:
+        prefix, attrs, text = match.group(1), match.group(2), match.group(3)
+        if prefix.endswith('\\'):
+            return prefix[:-1] + match.group(0)[len(prefix):]
+    else:
+        prefix = ''
+        attrs, text = match.group(1), match.group(2)
+        if match.group(0).startswith('\\'):
+            return match.group(0)[1:]
+    if kind == 'mark' and attrs:
+        start, end = '<span class="{}">'.format(attrs), '</span>'
+    elif kind == 'mark':
+        start, end = '<mark>', '</mark>'
+    else:
+        start, end = QUOTE_TAGS[kind]
+    return prefix + start + text + end
+
+
+def sub_quotes(text):
+    for kind, constrained, regex in QUOTE_SUBS:
+        text = regex.sub(
+            lambda m, kind=kind, constrained=constrained: _convert_quote(kind, constrained, m),
+            text,
+        )
+    return text
+
+
+def sub_callouts(text):
+    autonumber = [0]
+
+    def convert(match):
+        if match.group(1):
+            return match.group(0).replace('\\', '', 1)
+        number = match.group(3)
+        if number == '.':
+            autonumber[0] += 1
+            number = str(autonumber[0])
+        return '<i class="conum" data-value="{0}"></i><b>({0})</b>'.format(number)
+
+    return CALLOUT.sub(convert, text)
+
+
+def apply_subs(text, subs):
+    passthroughs = []
+    if 'macros' in subs:
+        def extract(match):
+            if match.group(1):
+                return match.group(0)[1:]
+            if match.group(3) is not None:
+                passthroughs.append((match.group(3).replace('\\]', ']'), match.group(2)))
+            else:
+                passthroughs.append((match.group(4) or match.group(5), ''))
+            return '\x96{}\x97'.format(len(passthroughs) - 1)
+        text = PASSTHROUGH.sub(extract, text)
+
+    for sub in subs:
+        if sub == 'specialcharacters':
+            text = escape(text, quote=False)
+        elif sub == 'quotes':
+            text = sub_quotes(text)
+        elif sub == 'callouts':
+            text = sub_callouts(text)
+
+    def restore(match):
+        content, pass_subs = passthroughs[int(match.group(1))]
+        return apply_subs(content, resolve_subs(Block(None, {'subs': pass_subs}, None), []))
+    return PASSTHROUGH_PLACEHOLDER.sub(restore, text)
+
+
+
+def _class_attribute(base, block):
+    return ' '.join([base] + ([block.attributes['role']] if block.attributes.get('role') else []))
+
+
+def _title_div(block):
+    if block.title is None:
+        return ''
+    return '<div class="title">{}</div>\n'.format(apply_subs(block.title, NORMAL_SUBS))
+
+
+def render_block(block):
+    if block.context == 'listing':
+        content = apply_subs('\n'.join(block.lines), resolve_subs(block, VERBATIM_SUBS))
+        if block.style == 'source':
+            language = block.attributes.get(2)
+            pre = '<pre class="CodeRay highlight"><code{}>{}</code></pre>'.format(
+                ' data-lang="{}"'.format(language) if language else '', content
+            )
+        else:
+            pre = '<pre>{}</pre>'.format(content)
+        return '<div class="{}">\n{}<div class="content">\n{}\n</div>\n</div>'.format(
+            _class_attribute('listingblock', block), _title_div(block), pre
+        )
+    if block.context == 'literal':
+        content = apply_subs('\n'.join(block.lines), resolve_subs(block, VERBATIM_SUBS))
+        return '<div class="literalblock">\n{}<div class="content">\n<pre>{}</pre>\n</div>\n</div>'.format(
+            _title_div(block), content
+        )
+    if block.context == 'paragraph':
+        content = apply_subs('\n'.join(block.lines), resolve_subs(block, NORMAL_SUBS))
+        return '<div class="paragraph">\n{}<p>{}</p>\n</div>'.format(_title_div(block), content)
+    if block.context in COMPOUND_DELIMITERS.values():
+        return '<div class="{}">\n{}<div class="content">\n{}\n</div>\n</div>'.format(
+            _class_attribute(block.context + 'block', block),
+            _title_div(block),
+            '\n'.join(render_block(b) for b in block.blocks),
+        )
+    return ''
+
+
+
+def _is_listing_block(block):
+    if block.context == 'listing':
+        return True
+    return block.context == 'example' and 'sourcecode' in block.roles
+
+
+def _walk_listing_blocks(blocks, ancestors=()):
+    for block in blocks:
+        if _is_listing_block(block):
+            yield block, ancestors
+            yield from _walk_listing_blocks(block.blocks, ancestors + (block,))
+        else:
+            yield from _walk_listing_blocks(block.blocks, ancestors)
+
+
+def get_listing_blocks(blocks):
+    # same rule as book_parser.get_listing_nodes: drop anything nested
+    # inside the listing block that came just before it
+    listing_blocks = []
+    prev = None
+    for block, ancestors in _walk_listing_blocks(blocks):
+        if prev is None or prev not in ancestors:
+            listing_blocks.append(block)
+        prev = block
+    return listing_blocks
+
+
+def parse_asciidoc(source):
+    from lxml import html
+    lines = [l.rstrip() for l in source.replace('\r\n', '\n').split('\n')]
+    blocks, _ = parse_blocks(lines)
+    return [
+        listing
+        for block in get_listing_blocks(blocks)
+        for listing in parse_listing(html.fragment_fromstring(render_block(block)))
+    ]
+
+
+def parse_asciidoc_listings(chapter_name):
+    with open(os.path.join(BASE_DIR, chapter_name + '.asciidoc'), encoding='utf-8') as f:
+        return parse_asciidoc(f.read())
+
+
+
+def parse_html_listings(chapter_name):
+    from lxml import html
+    with open(os.path.join(BASE_DIR, chapter_name + '.html'), encoding='utf-8') as f:
+        parsed_html = html.fromstring(f.read())
+    return [p for n in get_listing_nodes(parsed_html) for p in parse_listing(n)]
+
+
+def comparable(listing):
+    data = listing_to_dict(listing)
+    for name in DERIVED_ATTRIBUTES:
+        data['attributes'].pop(name, None)
+    return data
+
+
+def compare_with_html(chapter_name, html_listings=None):
+    """
+    returns a list of (position, html listing, asciidoc listing) for every
+    place where the two paths disagree. html_listings saves parsing the
+    html again, if they've been read already.
+    """
+    if html_listings is None:
+        html_listings = parse_html_listings(chapter_name)
+    from_html = [comparable(l) for l in html_listings]
+    from_asciidoc = [comparable(l) for l in parse_asciidoc_listings(chapter_name)]
+    differences = [
+        (pos, html_listing, asciidoc_listing)
+        for pos, (html_listing, asciidoc_listing) in enumerate(zip(from_html, from_asciidoc))
+        if html_listing != asciidoc_listing
+    ]
+    if len(from_html) != len(from_asciidoc):
+        pos = min(len(from_html), len(from_asciidoc))
+        differences.append((
+            pos,
+            from_html[pos] if pos < len(from_html) else None,
+            from_asciidoc[pos] if pos < len(from_asciidoc) else None,
+        ))
+    return differences
+
+
+def report_differences(differences_by_chapter):
+    """prints {chapter_name: differences}, and returns whether any differ"""
+    failed = False
+    for chapter_name, differences in differences_by_chapter.items():
+        print(chapter_name, 'OK' if not differences else 'DIFFERS')
+        for pos, html_listing, asciidoc_listing in differences:
+            failed = True
+            print('  listing {}:\n    html:     {!r}\n    asciidoc: {!r}'.format(
+                pos, html_listing, asciidoc_listing
+            ))
+    return failed
+
+
+def main(chapter_names):
+    failed = report_differences({c: compare_with_html(c) for c in chapter_names})
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Standalone performance checks for the book-testing harness.
+
+    python tests/benchmarks.py [name ...] [--save-baseline] [--check]
+
+Each benchmark prints its best-of-N timing. The comparison benchmark also
+gives the throughput of each stage of checking output, as a multiple of a
+fixed calibration workload on the same machine. --save-baseline stores
+those in comparison_baseline.json, and --check exits with an error if any
+stage has dropped more than REGRESSION_THRESHOLD below it. The calibration
+evens out the machine but not the interpreter, so baselines are kept per
+python, and --check fails if there isn't one for the python running it.
+"""
+from contextlib import redirect_stdout
+import json
+import os
+import re
+import sys
+import textwrap
+import time
+from unittest.mock import patch
+
+from lxml import html
+
+from book_listings import read_book_listings
+from book_parser import Output, get_listing_nodes, parse_listing
+from book_tester import ChapterTest
+from chapter_fixtures import get_listing_nodes_with_cssselect, make_synthetic_chapter
+from output_normaliser import (
+    ACTUAL,
+    EXPECTED,
+    RULES,
+    normalise_actual,
+    normalise_expected,
+    wrap_long_lines,
+)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(BASE_DIR, 'tests', 'comparison_baseline.json')
+# how far (as a fraction) a stage can fall below its baseline before --check fails
+REGRESSION_THRESHOLD = 0.25
+# stands in for the machine's speed, so baselines carry over between
+# machines running the same python
+CALIBRATION = re.compile(r'\d+')
+# what comparison_baseline.json keys each python's baseline by
+INTERPRETER = '{}-{}.{}'.format(sys.implementation.name, *sys.version_info[:2])
+
+
+def get_built_chapters():
+    chapters = [
+        f.replace('.asciidoc', '.html')
+        for f in json.load(open(os.path.join(BASE_DIR, 'atlas.json')))['files']
+        if f.endswith('.asciidoc')
+    ]
+    return [c for c in chapters if os.path.exists(os.path.join(BASE_DIR, c))]
+
+
+def uncompiled_selectors():
+    # what the parser did before book_selectors: a fresh css translation per call
+    return [
+        patch('book_selectors.' + name, lambda el, expr=expr: el.cssselect(expr))
+        for name, expr in [
+            ('TITLE', '.title'),
+            ('CONTENT', '.content'),
+            ('DIV_CONTENT', 'div.content'),
+            ('COMMANDS', 'pre strong'),
+            ('CODE_COMMANDS', 'pre code strong'),
+        ]
+    ]
+
+
+def best_time(fn, repeat=3):
+    return best_times(fn, repeat=repeat)[0]
+
+
+def best_times(*fns, repeat=3):
+    # best of repeat runs of each function, taking turns
+    timings = [[] for _ in fns]
+    for _ in range(repeat):
+        for fn, fn_timings in zip(fns, timings):
+            start = time.perf_counter()
+            fn()
+            fn_timings.append(time.perf_counter() - start)
+    return [min(fn_timings) for fn_timings in timings]
+
+
+
+def bench_listing_selection():
+    parsed_html = html.fromstring(make_synthetic_chapter(3000))
+    old = best_time(lambda: get_listing_nodes_with_cssselect(parsed_html))
+    new = best_time(lambda: get_listing_nodes(parsed_html))
+    print('listing selection, 3000 listings: cssselect {:.3f}s, get_listing_nodes {:.3f}s'.format(
+        old, new
+    ))
+
+
+def bench_listing_parsing():
+    chapters = get_built_chapters()
+    if chapters:
+        sources = [
+            (c, open(os.path.join(BASE_DIR, c), encoding='utf-8').read())
+            for c in chapters
+        ]
+    else:
+        sources = [('synthetic (no chapters built)', make_synthetic_chapter(1000))]
+
+    for name, raw_html in sources:
+        nodes = get_listing_nodes(html.fromstring(raw_html))
+        if not nodes:
+            continue
+        parse_all = lambda: [parse_listing(n) for n in nodes]
+        new = best_time(parse_all)
+        patchers = uncompiled_selectors()
+        for p in patchers:
+            p.start()
+        try:
+            old = best_time(parse_all)
+        finally:
+            for p in patchers:
+                p.stop()
+        print('{}: {} listings, per listing: cssselect {:.1f}us, precompiled {:.1f}us'.format(
+            name, len(nodes), old / len(nodes) * 1e6, new / len(nodes) * 1e6
+        ))
+
+
+def bench_output_normalisation():
+    with open(os.path.join(BASE_DIR, 'tests', 'actual_manage_py_test.output')) as f:
+        captured = f.read()
+    for copies in (1, 10):
+        text = captured * copies
+        megabytes = len(text.encode('utf8')) / 1e6
+        for name, normaliser, sample in [
+            # the rules, without the line wrapping they both have to wait on
+            ('actual', normalise_actual.steps[-1], wrap_long_lines(text)),
+            ('expected', normalise_expected, text),
+        ]:
+            assert normaliser(sample) == normaliser.sequentially(sample)
+            old = best_time(lambda: normaliser.sequentially(sample))
+            new = best_time(lambda: normaliser(sample))
+            print('{} output, {:.1f}MB: one pass per rule {:.3f}s, single scan {:.3f}s'.format(
+                name, megabytes, old, new
+            ))
+
+
+def bench_line_wrapping():
+    with open(os.path.join(BASE_DIR, 'tests', 'actual_manage_py_test.output')) as f:
+        captured = f.read()
+    for name, text in [
+        ('captured output x10', captured * 10),
+        ('unbroken html, 1MB', '<div>' * 200000),
+        ('unbroken html, 2MB', '<div>' * 400000),
+    ]:
+        def with_textwrap():
+            return '\n'.join(
+                '\n'.join(textwrap.wrap(p, 79, break_long_words=True, break_on_hyphens=False))
+                for p in text.split('\n')
+            )
+        assert wrap_long_lines(text) == with_textwrap()
+        old = best_time(with_textwrap, repeat=1)
+        new = best_time(lambda: wrap_long_lines(text))
+        print('{}: textwrap {:.3f}s, wrap_long_lines {:.3f}s'.format(name, old, new))
+
+
+def load_comparison_corpus():
+    # the captured manage.py test run, and every Output listing in the book,
+    # each checked against its own text
+    with open(os.path.join(BASE_DIR, 'tests', 'actual_manage_py_test.output')) as f:
+        captured = f.read()
+    pairs = [(captured, Output(captured))]
+    for _, listing in read_book_listings():
+        if isinstance(listing, Output):
+            pairs.append((str(listing), listing))
+    return pairs
+
+
+def bench_comparison():
+    corpus = load_comparison_corpus()
+    actuals = [actual for actual, _ in corpus]
+    actual_megabytes = sum(len(a.encode('utf8')) for a in actuals) / 1e6
+    expected_megabytes = sum(len(e.encode('utf8')) for _, e in corpus) / 1e6
+
+    tester = ChapterTest('assert_console_output_correct')
+    tester.tempdir = '/no/such/tempdir'
+    mismatches = []
+
+    def compare_all():
+        mismatches.clear()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for actual, expected in corpus:
+                expected.normalised = None
+                try:
+                    tester.assert_console_output_correct(actual, expected)
+                except AssertionError:
+                    mismatches.append(expected)
+
+    def calibrate():
+        return [CALIBRATION.sub('X', a).split('\n') for a in actuals]
+
+    stages = [
+        ('wrap_long_lines', actual_megabytes, lambda: [wrap_long_lines(a) for a in actuals]),
+        ('normalise actual', actual_megabytes, lambda: [
+            RULES.normalise(ACTUAL, a, e.type) for a, e in corpus
+        ]),
+        ('normalise expected', expected_megabytes, lambda: [
+            RULES.normalise(EXPECTED, e, e.type) for _, e in corpus
+        ]),
+        ('assert_console_output_correct', actual_megabytes + expected_megabytes, compare_all),
+    ]
+    print('comparison corpus: {} pairs, {:.2f}MB actual, {:.2f}MB expected'.format(
+        len(corpus), actual_megabytes, expected_megabytes
+    ))
+    # each stage takes turns with the calibration, so the machine getting
+    # busier or quieter part way through slows both sides alike. best of more
+    # runs than usual, since --check compares these
+    results = {}
+    for name, megabytes, fn in stages:
+        stage_time, calibration_time = best_times(fn, calibrate, repeat=10)
+        megabytes_per_second = megabytes / stage_time
+        results[name] = round(megabytes_per_second / (actual_megabytes / calibration_time), 3)
+        print('{:<32} {:>8.2f} MB/s {:>8.3f}x calibration'.format(
+            name, megabytes_per_second, results[name]
+        ))
+    print('{} of {} pairs didn\'t match their own text'.format(len(mismatches), len(corpus)))
+    return results
+
+
+def regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    return [
+        '{}: {:.3f}x calibration, baseline {:.3f}x'.format(name, results[name], expected)
+        for name, expected in sorted(baseline.items())
+        if name in results and results[name] < expected * (1 - threshold)
+    ]
+
+
+BENCHMARKS = {
+    'listing_selection': bench_listing_selection,
+    'listing_parsing': bench_listing_parsing,
+    'output_normalisation': bench_output_normalisation,
+    'line_wrapping': bench_line_wrapping,
+    'comparison': bench_comparison,
+}
+
+
+def main(args):
+    names = [a for a in args if not a.startswith('--')]
+    results = {}
+    for name in names or BENCHMARKS:
+        result = BENCHMARKS[name]()
+        if result is not None:
+            results[name] = result
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+    baseline = baselines.setdefault(INTERPRETER, {})
+    if '--save-baseline' in args:
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    if '--check' in args:
+        missing = sorted(name for name in results if name not in baseline)
+        if missing:
+            print('no {} baseline for {}, save one with --save-baseline'.format(
+                ', '.join(missing), INTERPRETER
+            ))
+            return 1
+        failures = [
+            '{} {}'.format(name, regression)
+            for name, result in results.items()
+            for regression in regressions(result, baseline[name])
+        ]
+        for failure in failures:
+            print('REGRESSION:', failure)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Finding the book's chapters, and reading the listings for any one of them,
+or for all of them at once on a process pool.
+
+    python tests/book_listings.py [--write-manifests] [chapter_name ...]
+"""
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+import time
+
+from asciidoc_parser import parse_asciidoc_listings
+from book_parser import get_listing_nodes, iter_listings, parse_listing
+from listing_table import ListingTable
+from listings_cache import load_cached_listings, save_cached_listings
+from listings_manifest import read_listings_manifest, write_listings_manifest
+
+BASE_DIR = os.path.split(os.path.abspath(os.path.dirname(__file__)))[0]
+
+
+def get_chapter_names():
+    with open(os.path.join(BASE_DIR, 'atlas.json')) as f:
+        files = json.load(f)['files']
+    return [f.replace('.asciidoc', '') for f in files if f.endswith('.asciidoc')]
+
+
+def get_available_source(chapter_name):
+    # the built html if there is one, otherwise the asciidoc it's built from
+    if os.path.exists(os.path.join(BASE_DIR, chapter_name + '.html')):
+        return 'html'
+    return 'asciidoc'
+
+
+def read_chapter_listings(chapter_name, source='html'):
+    # source is one of the ChapterTest.listings_source options
+    if source == 'stream':
+        return iter_listings(os.path.join(BASE_DIR, chapter_name + '.html'))
+    if source == 'asciidoc':
+        return parse_asciidoc_listings(chapter_name)
+    if source == 'manifest':
+        return read_listings_manifest(chapter_name)
+
+    with open(os.path.join(BASE_DIR, chapter_name + '.html'), encoding='utf-8') as f:
+        raw_html = f.read()
+    listings = load_cached_listings(raw_html)
+    if listings is not None:
+        return listings
+
+    from lxml import html
+    parsed_html = html.fromstring(raw_html)
+    listings = [p for n in get_listing_nodes(parsed_html) for p in parse_listing(n)]
+    save_cached_listings(raw_html, listings)
+    return listings
+
+
+
+class BookListings(object):
+    """
+    every chapter's listings in one ListingTable, with the range of
+    positions each chapter occupies. picklable, like the table itself.
+    """
+
+    def __init__(self):
+        self.table = ListingTable()
+        self.chapter_ranges = {}
+
+
+    def add_chapter(self, chapter_name, listings):
+        start = len(self.table)
+        for listing in listings:
+            self.table.append(listing)
+        self.chapter_ranges[chapter_name] = range(start, len(self.table))
+
+
+    @property
+    def chapter_names(self):
+        return list(self.chapter_ranges)
+
+
+    def chapter(self, chapter_name):
+        chapter_range = self.chapter_ranges[chapter_name]
+        return self.table[chapter_range.start:chapter_range.stop]
+
+
+    def chapter_of(self, pos):
+        for chapter_name, chapter_range in self.chapter_ranges.items():
+            if pos in chapter_range:
+                return chapter_name
+        raise IndexError('listing index out of range')
+
+
+    def __len__(self):
+        return len(self.table)
+
+
+    def __iter__(self):
+        for chapter_name, chapter_range in self.chapter_ranges.items():
+            for pos in chapter_range:
+                yield chapter_name, self.table[pos]
+
+
+
+def _read_all(chapter_name_and_source):
+    chapter_name, source = chapter_name_and_source
+    return list(read_chapter_listings(chapter_name, source or get_available_source(chapter_name)))
+
+
+def read_book_listings(chapter_names=None, source=None, processes=None):
+    """
+    parses each chapter (all of atlas.json by default) in its own process.
+    source=None means whatever get_available_source finds for each chapter.
+    """
+    if chapter_names is None:
+        chapter_names = get_chapter_names()
+    book = BookListings()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        all_listings = executor.map(_read_all, [(c, source) for c in chapter_names])
+        for chapter_name, listings in zip(chapter_names, all_listings):
+            book.add_chapter(chapter_name, listings)
+    return book
+
+
+def main(args):
+    write_manifests = '--write-manifests' in args
+    chapter_names = [a for a in args if a != '--write-manifests']
+    start = time.perf_counter()
+    book = read_book_listings(chapter_names or None)
+    for chapter_name in book.chapter_names:
+        print(chapter_name, len(book.chapter_ranges[chapter_name]))
+        if write_manifests:
+            write_listings_manifest(chapter_name, book.chapter(chapter_name))
+    print('{} listings from {} chapters in {:.2f}s'.format(
+        len(book), len(book.chapter_names), time.perf_counter() - start
+    ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
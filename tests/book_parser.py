@@ -2,6 +2,10 @@
 # -*- coding: utf-8 -*-
 import re
 
+# lxml (and book_selectors, which compiles with it) is only imported inside
+# the functions that parse html, so reading listings back from a manifest
+# doesn't need it
+
 
 COMMIT_REF_FINDER = r'ch\d\dl\d\d\d-?\d?'
 
@@ -113,9 +117,10 @@ def fix_newlines(text):
     return text.replace('\r\n', '\n').replace('\\\n', '').strip('\n')
 
 def parse_output(listing):
+    from book_selectors import COMMANDS
     text = fix_newlines(listing.text_content().strip())
 
-    commands = listing.cssselect('pre strong')
+    commands = COMMANDS(listing)
     if not commands:
         return [Output(text)]
 
@@ -157,7 +162,22 @@ def _strip_callouts(content):
     return content
 
 
+def get_listing_nodes(parsed_html):
+    from book_selectors import LISTING_NODES
+    all_nodes = LISTING_NODES(parsed_html)
+    listing_nodes = []
+    prev = all_nodes[-1] if all_nodes else None
+    for node in all_nodes:
+        # drop nodes nested inside the previous match. walking up from the
+        # node is O(depth), rather than materialising the previous subtree
+        if prev not in node.iterancestors():
+            listing_nodes.append(node)
+        prev = node
+    return listing_nodes
+
+
 def parse_listing(listing):
+    from book_selectors import CONTENT, DIV_CONTENT, TITLE
     classes = listing.get('class').split()
     skip = 'skipme' in classes
     dofirst_classes = [c for c in classes if c.startswith('dofirst')]
@@ -168,10 +188,10 @@ def parse_listing(listing):
 
     if 'sourcecode' in classes:
         try:
-            filename = listing.cssselect('.title')[0].text_content().strip()
+            filename = TITLE(listing)[0].text_content().strip()
         except IndexError:
             raise Exception('could not find title for listing {}'.format(listing.text_content()))
-        contents = listing.cssselect('.content')[0].text_content().replace('\r\n', '\n').strip('\n')
+        contents = CONTENT(listing)[0].text_content().replace('\r\n', '\n').strip('\n')
         contents = _strip_callouts(contents)
         listing = CodeListing(filename, contents)
         listing.skip = skip
@@ -181,7 +201,7 @@ def parse_listing(listing):
         return [listing]
 
     elif 'qunit-output' in classes:
-        contents = listing.cssselect('.content')[0].text_content().replace('\r\n', '\n').strip('\n')
+        contents = CONTENT(listing)[0].text_content().replace('\r\n', '\n').strip('\n')
         output = Output(contents)
         output.qunit_output = True
         output.skip = skip
@@ -189,7 +209,7 @@ def parse_listing(listing):
         return [output]
 
     if 'server-commands' in classes:
-        listing = listing.cssselect('div.content')[0]
+        listing = DIV_CONTENT(listing)[0]
 
     outputs = parse_output(listing)
     if skip:
@@ -212,9 +232,101 @@ def parse_listing(listing):
     return outputs
 
 
+LISTING_CLASSES = {
+    cls.__name__: cls for cls in (CodeListing, Command, Output)
+}
+
+
+def listing_to_dict(listing):
+    data = {
+        'class': type(listing).__name__,
+        'attributes': dict(vars(listing)),
+    }
+    if isinstance(listing, str):
+        data['text'] = str(listing)
+    return data
+
+
+def listing_from_dict(data):
+    cls = LISTING_CLASSES[data['class']]
+    if issubclass(cls, str):
+        listing = cls(data['text'])
+    else:
+        listing = cls.__new__(cls)
+    vars(listing).update(data['attributes'])
+    return listing
+
+
+def _is_listing_node(element):
+    classes = (element.get('class') or '').split()
+    if 'exampleblock' in classes and 'sourcecode' in classes:
+        return True
+    return (
+        element.tag == 'div' and 'listingblock' in classes and
+        any(
+            a.tag == 'div' and 'sourcecode' not in (a.get('class') or '').split()
+            for a in element.iterancestors()
+        )
+    )
+
+
+def _clear_finished(element):
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _read_parser_events(source, parser, chunk_size):
+    for chunk in iter(lambda: source.read(chunk_size), ''):
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def iter_listings(path, chunk_size=64 * 1024):
+    """
+    Streaming equivalent of parse_listing over get_listing_nodes: yields
+    listings as each listing node's closing tag arrives, and throws away
+    finished parts of the tree as it goes, so the tree never grows beyond
+    the listing being parsed, even for the full single-file book.html
+    """
+    from lxml import etree, html
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    parser.set_element_class_lookup(html.HtmlElementClassLookup())
+    prev = None
+    pending = []
+    finished = set()
+    with open(path, encoding='utf-8') as f:
+        for event, element in _read_parser_events(f, parser, chunk_size):
+            if event == 'start':
+                if _is_listing_node(element):
+                    if prev is None or prev not in element.iterancestors():
+                        pending.append(element)
+                    prev = element
+                continue
+
+            if not pending:
+                _clear_finished(element)
+                continue
+            if element in pending:
+                finished.add(element)
+            # listings come out in document order, even if a nested one
+            # closes before the one that contains it
+            while pending and pending[0] in finished:
+                node = pending.pop(0)
+                finished.remove(node)
+                yield from parse_listing(node)
+            if not pending:
+                _clear_finished(element)
+
+
 def get_commands(node):
+    from book_selectors import CODE_COMMANDS
     return [
         el.text_content().replace('\\\n', '')
-        for el in node.cssselect('pre code strong')
+        for el in CODE_COMMANDS(node)
     ]
 
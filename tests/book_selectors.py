@@ -0,0 +1,35 @@
+"""
+Precompiled lxml selectors for the listing parsers, so nothing
+re-translates css into xpath inside a loop.
+"""
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+
+def css(expression):
+    # same translator HtmlElement.cssselect uses
+    return CSSSelector(expression, translator='html')
+
+
+def _has_class(class_name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(class_name)
+
+
+# same nodes as the css selector
+#   .exampleblock.sourcecode, div:not(.sourcecode) div.listingblock
+# but the cheap @class prefilter means only a handful of candidate divs
+# ever get their ancestors inspected
+LISTING_NODES = etree.XPath(
+    "descendant-or-self::*[contains(@class, 'block')]"
+    "[({exampleblock} and {sourcecode}) or "
+    "(self::div and {listingblock} and ancestor::div[not({sourcecode})])]".format(
+        exampleblock=_has_class('exampleblock'),
+        listingblock=_has_class('listingblock'),
+        sourcecode=_has_class('sourcecode'),
+    )
+)
+TITLE = css('.title')
+CONTENT = css('.content')
+DIV_CONTENT = css('div.content')
+COMMANDS = css('pre strong')
+CODE_COMMANDS = css('pre code strong')
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Per-chapter content hashes, remembered between runs, so that book-wide
+work only re-parses and re-checks the chapters whose source has changed.
+
+    python tests/book_state.py [chapter_name ...]
+
+re-runs the asciidoc/html differential check on the chapters that changed
+since the last run, and reports the stored result for the rest.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from asciidoc_parser import compare_with_html, report_differences
+from book_listings import (
+    BASE_DIR,
+    BookListings,
+    get_chapter_names,
+    read_book_listings,
+)
+import listings_cache
+
+STATE_FILENAME = 'book_state.json'
+ASCIIDOC_PARSER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'asciidoc_parser.py')
+
+
+def get_chapter_hash(chapter_name):
+    chapter_hash = hashlib.sha1(listings_cache.get_parser_version().encode('utf8'))
+    with open(ASCIIDOC_PARSER, 'rb') as f:
+        chapter_hash.update(f.read())
+    for extension in ['.asciidoc', '.html']:
+        path = os.path.join(BASE_DIR, chapter_name + extension)
+        if os.path.exists(path):
+            chapter_hash.update(extension.encode('utf8'))
+            with open(path, 'rb') as f:
+                chapter_hash.update(f.read())
+    return chapter_hash.hexdigest()
+
+
+
+class BookState(object):
+    """
+    {chapter_name: {'hash': ..., 'results': {check_name: result}}}
+    results only ever belong to the hash they were recorded against
+    """
+
+    def __init__(self, chapters=None):
+        self.chapters = chapters or {}
+
+
+    @staticmethod
+    def get_path():
+        return os.path.join(listings_cache.CACHE_DIR, STATE_FILENAME)
+
+
+    @classmethod
+    def load(cls):
+        try:
+            with open(cls.get_path(), encoding='utf-8') as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls()
+
+
+    def save(self):
+        os.makedirs(listings_cache.CACHE_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=listings_cache.CACHE_DIR, suffix='.tmp')
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.chapters, f)
+        os.replace(temp_path, self.get_path())
+
+
+    def is_unchanged(self, chapter_name, chapter_hash):
+        return self.chapters.get(chapter_name, {}).get('hash') == chapter_hash
+
+
+    def set_hash(self, chapter_name, chapter_hash):
+        if not self.is_unchanged(chapter_name, chapter_hash):
+            self.chapters[chapter_name] = {'hash': chapter_hash, 'results': {}}
+
+
+    def get_result(self, chapter_name, check_name):
+        return self.chapters.get(chapter_name, {}).get('results', {}).get(check_name)
+
+
+    def record_result(self, chapter_name, check_name, result):
+        self.chapters[chapter_name]['results'][check_name] = result
+
+
+
+def read_book_listings_incrementally(chapter_names=None, state=None):
+    """
+    like read_book_listings, but chapters whose hash matches the last run
+    come straight from the listings cache. returns the book and the names
+    of the chapters that had to be parsed.
+    """
+    if chapter_names is None:
+        chapter_names = get_chapter_names()
+    if state is None:
+        state = BookState.load()
+    hashes = {c: get_chapter_hash(c) for c in chapter_names}
+
+    reused = {}
+    for chapter_name in chapter_names:
+        if state.is_unchanged(chapter_name, hashes[chapter_name]):
+            listings = listings_cache.load_listings_by_key(hashes[chapter_name])
+            if listings is not None:
+                reused[chapter_name] = listings
+    changed = [c for c in chapter_names if c not in reused]
+    parsed = read_book_listings(changed) if changed else BookListings()
+
+    book = BookListings()
+    for chapter_name in chapter_names:
+        if chapter_name in reused:
+            book.add_chapter(chapter_name, reused[chapter_name])
+        else:
+            listings = parsed.chapter(chapter_name)
+            listings_cache.save_listings_by_key(hashes[chapter_name], listings)
+            book.add_chapter(chapter_name, listings)
+        state.set_hash(chapter_name, hashes[chapter_name])
+    state.save()
+    return book, changed
+
+
+def check_chapters(check_name, check, chapter_names=None):
+    """
+    runs check(chapter_name, listings), which must return something json
+    can store, on every chapter that changed or has no stored result yet.
+    returns {chapter_name: result} for all of them.
+    """
+    state = BookState.load()
+    book, changed = read_book_listings_incrementally(chapter_names, state)
+    results = {}
+    for chapter_name in book.chapter_names:
+        result = state.get_result(chapter_name, check_name)
+        if chapter_name in changed or result is None:
+            result = check(chapter_name, book.chapter(chapter_name))
+            state.record_result(chapter_name, check_name, result)
+        results[chapter_name] = result
+    state.save()
+    return results
+
+
+def check_asciidoc_matches_html(chapter_name, listings):
+    # with the html built, the listings were read from it
+    if not os.path.exists(os.path.join(BASE_DIR, chapter_name + '.html')):
+        return []
+    return compare_with_html(chapter_name, listings)
+
+
+def main(chapter_names):
+    results = check_chapters(
+        'asciidoc_matches_html', check_asciidoc_matches_html, chapter_names or None
+    )
+    return 1 if report_differences(results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from lxml import html
 from getpass import getuser
 import io
 import os
@@ -9,17 +8,27 @@ import re
 import subprocess
 import time
 import tempfile
-from textwrap import wrap
 import unittest
 
+from book_listings import read_chapter_listings
+from checkout_snapshots import USE_CHECKOUT_SNAPSHOTS, CheckoutSnapshots
+from commit_refs import get_listing_commit_refs
 from write_to_file import write_to_file
 from book_parser import (
     CodeListing,
     Command,
     Output,
-    parse_listing,
+)
+from listing_table import ListingTable
+from output_matching import ProgressWatcher, find_mismatch
+from output_normaliser import (
+    ACTUAL,
+    RULES,
+    normalise_expected_output,
+    wrap_long_lines,
 )
 from sourcetree import Commit, SourceTree
+from unified_diff import apply_diff
 from update_source_repo import update_sources_for_chapter
 
 PHANTOMJS_RUNNER = os.path.join(
@@ -48,14 +57,6 @@ def contains(inseq, subseq):
 
 
 
-def wrap_long_lines(text):
-    paragraphs = text.split('\n')
-    return '\n'.join(
-        '\n'.join(wrap(p, 79, break_long_words=True, break_on_hyphens=False))
-        for p in paragraphs
-    )
-
-
 def split_blocks(text):
     return [
         block.strip() for block in
@@ -63,160 +64,15 @@ def split_blocks(text):
     ]
 
 
-def fix_test_dashes(output):
-    return output.replace(' ' + '-' * 69, '-' * 70)
-
-
-def strip_mock_ids(output):
-    strip_mocks_with_names = re.sub(
-        r"Mock name='(.+)' id='(\d+)'>",
-        r"Mock name='\1' id='XX'>",
-        output,
-    )
-    strip_all_mocks = re.sub(
-        r"Mock id='(\d+)'>",
-        r"Mock id='XX'>",
-        strip_mocks_with_names,
-    )
-    return strip_all_mocks
-
-def strip_object_ids(output):
-    return re.sub('0x([0-9a-f]+)>', '0xXX>', output)
-
-
-def strip_migration_timestamps(output):
-    return re.sub(r'00(\d\d)_auto_20\d{6}_\d{4}', r'00\1_auto_20XXXXXX_XXXX', output)
-
-
-def strip_localhost_port(output):
-    return re.sub(r'localhost:\d\d\d\d\d?', r'localhost:XXXX', output)
-
-
-def strip_session_ids(output):
-    return re.sub(r'^[a-z0-9]{32}$', r'xxx_session_id_xxx', output)
-
-
-def standardise_assertionerror_none(output):
-    return output.replace("AssertionError: None", "AssertionError")
-
-
-def strip_git_hashes(output):
-    fixed_indexes = re.sub(
-        r"index .......\.\........ 100644",
-        r"index XXXXXXX\.\.XXXXXXX 100644",
-        output,
-    )
-    fixed_commit_numbers = re.sub(
-        r"^[a-f0-9]{7} ",
-        r"XXXXXXX ",
-        fixed_indexes,
-        flags=re.MULTILINE,
-    )
-    return fixed_commit_numbers
-
-
-def strip_callouts(output):
-    minus_old_callouts = re.sub(
-        r"^(.+)  <\d+>$",
-        r"\1",
-        output,
-        flags=re.MULTILINE,
-    )
-    minus_new_callouts = re.sub(
-        r"^(.+)  \(\d+\)$",
-        r"\1",
-        minus_old_callouts,
-        flags=re.MULTILINE,
-    )
-    return minus_new_callouts
-
-
-def standardise_library_paths(output):
-    return re.sub(
-        r'(File ").+packages/', r'\1.../', output, flags=re.MULTILINE,
-    )
-
-
-def strip_test_speed(output):
-    return re.sub(
-        r"Ran (\d+) tests? in \d+\.\d\d\ds",
-        r"Ran \1 tests in X.Xs",
-        output,
-    )
-
-def strip_js_test_speed(output):
-    return re.sub(
-        r"Took \d+ms to run (\d+) tests. (\d+) passed, (\d+) failed.",
-        r"Took XXms to run \1 tests. \2 passed, \3 failed.",
-        output,
-    )
-
-
-def strip_bdd_test_speed(output):
-    return re.sub(
-        r"features/steps/(\w+).py:(\d+) \d+.\d\d\ds",
-        r"features/steps/\1.py:\2 XX.XXXs",
-        output,
-    )
-
-
-def strip_screenshot_timestamps(output):
-    fixed = re.sub(
-        r"window0-(201\d-\d\d-\d\dT\d\d\.\d\d\.\d?\d?)",
-        r"window0-201X-XX-XXTXX.XX",
-        output,
-    )
-    # this last is very specific to one listing in 19...
-    fixed = re.sub(r"^\d\d\.html$", "XX.html", fixed, flags=re.MULTILINE)
-    return fixed
-
-
-SQLITE_MESSAGES = {
-    'django.db.utils.IntegrityError: lists_item.list_id may not be NULL':
-    'django.db.utils.IntegrityError: NOT NULL constraint failed: lists_item.list_id',
-
-    'django.db.utils.IntegrityError: columns list_id, text are not unique':
-    'django.db.utils.IntegrityError: UNIQUE constraint failed: lists_item.list_id,\nlists_item.text',
-
-    'sqlite3.IntegrityError: columns list_id, text are not unique':
-    'sqlite3.IntegrityError: UNIQUE constraint failed: lists_item.list_id,\nlists_item.text'
-}
-
-
-def fix_sqlite_messages(actual_text):
-    fixed_text = actual_text
-    for old_version, new_version in SQLITE_MESSAGES.items():
-        fixed_text = fixed_text.replace(old_version, new_version)
-    return fixed_text
-
-
-def fix_jenkins_pixelsize(actual_text):
-    # TODO: remove me when upgrading bootstrap
-    return actual_text.replace('107.0 != 512', '106.5 != 512')
-
-
-def fix_creating_database_line(actual_text):
-    creating_db = "Creating test database for alias 'default'..."
-    actual_lines = actual_text.split('\n')
-    if creating_db in actual_lines:
-        actual_lines.remove(creating_db)
-        actual_lines.insert(0, creating_db)
-        actual_text = '\n'.join(actual_lines)
-    return actual_text
-
-
-
-def fix_interactive_managepy_stuff(actual_text):
-    return actual_text.replace(
-        'Select an option: ', 'Select an option:\n',
-    ).replace(
-        '>>> ', '>>>\n',
-    )
-
-
-
 class ChapterTest(unittest.TestCase):
     maxDiff = None
+    # 'html' parses the whole chapter at once (and caches the result),
+    # 'stream' parses it incrementally, for very large files like book.html,
+    # 'asciidoc' reads the .asciidoc source, so no asciidoctor build is needed,
+    # 'manifest' reads the <chapter>.listings.json the build writes, so no html is needed
+    listings_source = os.environ.get('LISTINGS_SOURCE', 'html')
+    # stop test runs as soon as their progress line shows they can't match
+    stream_output_checks = 'STREAM_OUTPUT_CHECKS' in os.environ
 
     def setUp(self):
         self.sourcetree = SourceTree()
@@ -233,19 +89,9 @@ class ChapterTest(unittest.TestCase):
 
 
     def parse_listings(self):
-        base_dir = os.path.split(os.path.abspath(os.path.dirname(__file__)))[0]
-        filename = self.chapter_name + '.html'
-        with open(os.path.join(base_dir, filename), encoding='utf-8') as f:
-            raw_html = f.read()
-        parsed_html = html.fromstring(raw_html)
-        all_nodes = parsed_html.cssselect('.exampleblock.sourcecode, div:not(.sourcecode) div.listingblock')
-        listing_nodes = []
-        for ix, node in enumerate(all_nodes):
-            prev = all_nodes[ix - 1]
-            if node not in list(prev.iterdescendants()):
-                listing_nodes.append(node)
-
-        self.listings = [p for n in listing_nodes for p in parse_listing(n)]
+        self.listings = ListingTable(
+            read_chapter_listings(self.chapter_name, self.listings_source)
+        )
 
 
     def check_final_diff(self, ignore=None, diff=None):
@@ -280,11 +126,31 @@ class ChapterTest(unittest.TestCase):
             self.fail('Found divergent line in diff:\n{}'.format(line))
 
 
+    def check_commit_refs(self):
+        # the chapter's share of what commit_refs.py checks for the whole
+        # book, against the refs the checkout has just read
+        if not self.sourcetree.commit_refs or not hasattr(self, 'listings'):
+            return
+        dangling = [
+            ref for ref in get_listing_commit_refs(self.listings)
+            if ref not in self.sourcetree.commit_refs
+        ]
+        if dangling:
+            raise Exception('no commits for refs {} in {}'.format(
+                ', '.join(dangling), self.chapter_name
+            ))
+
+
     def start_with_checkout(self):
         update_sources_for_chapter(self.chapter_name, self.previous_chapter)
-        self.sourcetree.start_with_checkout(self.chapter_name, self.previous_chapter)
-        # simulate virtualenv folder
-        self.sourcetree.run_command('mkdir -p virtualenv/bin virtualenv/lib')
+        if USE_CHECKOUT_SNAPSHOTS:
+            self.sourcetree.snapshots = CheckoutSnapshots()
+        self.sourcetree.start_with_checkout(
+            self.chapter_name, self.previous_chapter,
+            # simulate virtualenv folder
+            prepare='mkdir -p virtualenv/bin virtualenv/lib',
+        )
+        self.check_commit_refs()
 
 
     def write_to_file(self, codelisting):
@@ -297,26 +163,17 @@ class ChapterTest(unittest.TestCase):
 
 
     def apply_patch(self, codelisting):
-        tf = tempfile.NamedTemporaryFile(delete=False)
-        tf.write(codelisting.contents.encode('utf8'))
-        tf.write('\n'.encode('utf8'))
-        tf.close()
         print('patch:\n', codelisting.contents)
-        patch_output = self.run_command(
-            Command('patch --fuzz=3 --no-backup-if-mismatch %s %s' % (codelisting.filename, tf.name))
-        )
-        print(patch_output)
-        self.assertNotIn('malformed', patch_output)
-        self.assertNotIn('failed', patch_output.lower())
+        result = apply_diff(codelisting.contents, self.tempdir, path=codelisting.filename)
+        print(result)
+        if not result.ok:
+            self.fail('patch for {} did not apply:\n{}'.format(codelisting.filename, result))
         codelisting.was_checked = True
-        with open(os.path.join(self.tempdir, codelisting.filename)) as f:
-            print(f.read())
-        os.remove(tf.name)
         self.pos += 1
         codelisting.was_written = True
 
 
-    def run_command(self, command, cwd=None, user_input=None, ignore_errors=False):
+    def run_command(self, command, cwd=None, user_input=None, ignore_errors=False, watch=None):
         self.assertEqual(
             type(command), Command,
             "passed a non-Command to run-command:\n%s" % (command,)
@@ -325,11 +182,25 @@ class ChapterTest(unittest.TestCase):
             command.was_run = True
             return
         print('running command', command)
-        output = self.sourcetree.run_command(command, cwd=cwd, user_input=user_input, ignore_errors=ignore_errors)
+        output = self.sourcetree.run_command(
+            command, cwd=cwd, user_input=user_input, ignore_errors=ignore_errors, watch=watch
+        )
         command.was_run = True
         return output
 
 
+    def run_test_command(self, command, expected, ignore_errors=False):
+        if not self.stream_output_checks:
+            return self.run_command(command, ignore_errors=ignore_errors)
+        watcher = ProgressWatcher(normalise_expected_output(expected).split('\n'))
+        output = self.run_command(command, ignore_errors=ignore_errors, watch=watcher)
+        if watcher.mismatch:
+            self.fail('stopped {} early: {}\noutput so far:\n{}'.format(
+                command, watcher.mismatch, output
+            ))
+        return output
+
+
     def _cleanup_runserver(self):
         self.run_server_command('pkill -f runserver', ignore_errors=True)
 
@@ -450,12 +321,6 @@ class ChapterTest(unittest.TestCase):
             print(output)
 
 
-    def assertLineIn(self, line, lines):
-        if line not in lines:
-            raise AssertionError('%s not found in:\n%s' % (
-                repr(line), '\n'.join(repr(l) for l in lines))
-            )
-
     def assert_console_output_correct(self, actual, expected, ls=False):
         print('checking expected output', expected)
         print('against actual', actual)
@@ -474,85 +339,48 @@ class ChapterTest(unittest.TestCase):
             expected.was_checked = True
             return
 
-        actual_fixed = standardise_library_paths(actual)
-        actual_fixed = wrap_long_lines(actual_fixed)
-        actual_fixed = strip_test_speed(actual_fixed)
-        actual_fixed = strip_js_test_speed(actual_fixed)
-        actual_fixed = strip_bdd_test_speed(actual_fixed)
-        actual_fixed = strip_git_hashes(actual_fixed)
-        actual_fixed = strip_mock_ids(actual_fixed)
-        actual_fixed = strip_object_ids(actual_fixed)
-        actual_fixed = strip_migration_timestamps(actual_fixed)
-        actual_fixed = strip_session_ids(actual_fixed)
-        actual_fixed = strip_localhost_port(actual_fixed)
-        actual_fixed = strip_screenshot_timestamps(actual_fixed)
-        actual_fixed = fix_sqlite_messages(actual_fixed)
-        actual_fixed = fix_jenkins_pixelsize(actual_fixed)
-        actual_fixed = fix_creating_database_line(actual_fixed)
-        actual_fixed = fix_interactive_managepy_stuff(actual_fixed)
-        actual_fixed = standardise_assertionerror_none(actual_fixed)
-
-        expected_fixed = standardise_library_paths(expected)
-        expected_fixed = fix_test_dashes(expected_fixed)
-        expected_fixed = strip_test_speed(expected_fixed)
-        expected_fixed = strip_js_test_speed(expected_fixed)
-        expected_fixed = strip_bdd_test_speed(expected_fixed)
-        expected_fixed = strip_git_hashes(expected_fixed)
-        expected_fixed = strip_mock_ids(expected_fixed)
-        expected_fixed = strip_object_ids(expected_fixed)
-        expected_fixed = strip_migration_timestamps(expected_fixed)
-        expected_fixed = strip_session_ids(expected_fixed)
-        expected_fixed = strip_localhost_port(expected_fixed)
-        expected_fixed = strip_screenshot_timestamps(expected_fixed)
-        expected_fixed = strip_callouts(expected_fixed)
-        expected_fixed = standardise_assertionerror_none(expected_fixed)
-
-        actual_fixed = actual_fixed.replace('\xa0', ' ')
-        expected_fixed = expected_fixed.replace('\xa0', ' ')
+        actual_fixed = RULES.normalise(ACTUAL, actual, expected.type)
+        expected_fixed = normalise_expected_output(expected)
         if '\t' in actual_fixed:
             actual_fixed = re.sub(r'\s+', ' ', actual_fixed)
             expected_fixed = re.sub(r'\s+', ' ', expected_fixed)
 
-        actual_lines = actual_fixed.split('\n')
-        expected_lines = expected_fixed.split('\n')
+        mismatch = find_mismatch(actual_fixed.split('\n'), expected_fixed.split('\n'))
+        if mismatch is None and len(expected_fixed.split('\n')) > 4 and '[...' not in expected_fixed and expected.type != 'qunit output':
+            # every line turning up is not enough for a full listing: the
+            # whole lot has to be the same, give or take the ends
+            mismatch = find_mismatch(
+                actual_fixed.strip().split('\n'), expected_fixed.strip().split('\n'), whole=True
+            )
+        if mismatch:
+            self.fail(str(mismatch))
 
-        for line in expected_lines:
-            if line.startswith('[...'):
-                continue
-            if line.endswith('[...]'):
-                line = line.rsplit('[...]')[0].rstrip()
-                self.assertLineIn(line, [l[:len(line)] for l in actual_lines])
-            elif line.startswith(' '):
-                self.assertLineIn(line, actual_lines)
-            else:
-                self.assertLineIn(line, [l.strip() for l in actual_lines])
+        expected.was_checked = True
 
-        if len(expected_lines) > 4 and '[...' not in expected_fixed:
-            if expected.type != 'qunit output':
-                self.assertMultiLineEqual(actual_fixed.strip(), expected_fixed.strip())
 
-        expected.was_checked = True
+    def _not_found_error(self, expected_content, pos):
+        # only built on failure, since it means formatting every listing
+        all_listings = '\n'.join(str(t) for t in enumerate(self.listings))
+        return Exception(
+            f'Could not find {expected_content} at pos {pos}: "{self.listings[pos]}". Listings were:\n{all_listings}'
+        )
 
 
     def skip_with_check(self, pos, expected_content):
         listing = self.listings[pos]
-        all_listings = '\n'.join(str(t) for t in enumerate(self.listings))
-        error = f'Could not find {expected_content} at pos {pos}: "{listing}". Listings were:\n{all_listings}'
         if hasattr(listing, 'contents'):
             if expected_content not in listing.contents:
-                raise Exception(error)
+                raise self._not_found_error(expected_content, pos)
         else:
             if expected_content not in listing:
-                raise Exception(error)
+                raise self._not_found_error(expected_content, pos)
         listing.skip = True
 
 
     def replace_command_with_check(self, pos, old, new):
         listing = self.listings[pos]
-        all_listings = '\n'.join(str(t) for t in enumerate(self.listings))
-        error = f'Could not find {old} at pos {pos}: "{listing}". Listings were:\n{all_listings}'
         if old not in listing:
-            raise Exception(error)
+            raise self._not_found_error(old, pos)
         assert type(listing) == Command
 
         new_listing = Command(listing.replace(old, new))
@@ -568,12 +396,10 @@ class ChapterTest(unittest.TestCase):
 
 
     def assert_all_listings_checked(self, listings, exceptions=[]):
-        for i, listing in enumerate(listings):
-            if i in exceptions:
-                continue
-            if listing.skip:
-                continue
-
+        if not isinstance(listings, ListingTable):
+            listings = ListingTable(listings)
+        for i in listings.unfinished(exceptions):
+            listing = listings[i]
             if type(listing) == CodeListing:
                 self.assertTrue(
                     listing.was_written,
@@ -597,12 +423,13 @@ class ChapterTest(unittest.TestCase):
         if test_command_in_listings:
             pos += 1
             self.assertIn('test', self.listings[pos])
-            test_run = self.run_command(self.listings[pos])
+            test_command = self.listings[pos]
         elif ft:
-            test_run = self.run_command(Command("python functional_tests.py"))
+            test_command = Command("python functional_tests.py")
         else:
-            test_run = self.run_command(Command("python manage.py test lists"))
+            test_command = Command("python manage.py test lists")
         pos += 1
+        test_run = self.run_test_command(test_command, self.listings[pos])
         self.assert_console_output_correct(test_run, self.listings[pos])
 
 
@@ -626,10 +453,9 @@ class ChapterTest(unittest.TestCase):
         else:
             self.assertIn('test', self.listings[self.pos])
         self._strip_out_any_pycs()
-        if bdd:
-            test_run = self.run_command(self.listings[self.pos], ignore_errors=True)
-        else:
-            test_run = self.run_command(self.listings[self.pos])
+        test_run = self.run_test_command(
+            self.listings[self.pos], self.listings[self.pos + 1], ignore_errors=bdd
+        )
         self.assert_console_output_correct(test_run, self.listings[self.pos + 1])
         self.pos += 2
 
@@ -0,0 +1,42 @@
+"""
+Upkeep for the on-disk caches (.listings_cache, .checkout_snapshots).
+Their keys change whenever the book, the source repos or the harness do,
+so instead of growing forever they keep the entries used most recently.
+"""
+import os
+import shutil
+
+
+
+def mark_used(path):
+    # an entry's mtime is when it was last saved or used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune(directory, keep):
+    """
+    removes all but the `keep` most recently used entries, leaving alone
+    the .tmp ones other test runs are still writing
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            # another test run pruned it already
+            continue
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
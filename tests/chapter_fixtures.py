@@ -0,0 +1,40 @@
+"""
+Made-up chapters, for tests and benchmarks that need more listings than
+the ones in examples.py, and the original cssselect version of picking
+out the listing nodes, to check get_listing_nodes against.
+"""
+import examples
+
+
+
+SYNTHETIC_BLOCKS = [
+    examples.CODE_LISTING_WITH_CAPTION,
+    examples.OUTPUT_WITH_CALLOUTS,
+    examples.CODE_LISTING_WITH_ASCIIDOCTOR_CALLOUTS,
+    examples.OUTPUT_WITH_COMMANDS_INLINE,
+]
+
+
+def make_synthetic_chapter(number_of_listings):
+    blocks = [
+        '<div class="paragraph"><p>Some prose about listing {}</p></div>\n{}'.format(
+            i, SYNTHETIC_BLOCKS[i % len(SYNTHETIC_BLOCKS)]
+        )
+        for i in range(number_of_listings)
+    ]
+    return (
+        '<html><body><div id="content"><div class="sect1">\n' +
+        '\n'.join(blocks) +
+        '\n</div></div></body></html>'
+    )
+
+
+def get_listing_nodes_with_cssselect(parsed_html):
+    # the original implementation, kept as a reference
+    all_nodes = parsed_html.cssselect('.exampleblock.sourcecode, div:not(.sourcecode) div.listingblock')
+    listing_nodes = []
+    for ix, node in enumerate(all_nodes):
+        prev = all_nodes[ix - 1]
+        if node not in list(prev.iterdescendants()):
+            listing_nodes.append(node)
+    return listing_nodes
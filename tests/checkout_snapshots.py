@@ -0,0 +1,99 @@
+"""
+Ready-made starting trees for chapter tests: the checkout of
+repo/<previous_chapter>, .git and all, the way start_with_checkout leaves
+it. It's saved the first time and copied back in after that. Keys cover
+every ref in the chapter's source repo, so when the submodule moves, the
+old snapshot just stops being used, and is pruned once enough newer ones
+have been saved.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from cache_dirs import mark_used, prune
+
+SNAPSHOT_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    '.checkout_snapshots'
+)
+# enough for a couple of full runs' worth of chapters
+MAX_SNAPSHOTS = 60
+CODE_FILES = [
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'sourcetree.py'),
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'checkout_snapshots.py'),
+]
+
+USE_CHECKOUT_SNAPSHOTS = True
+if 'NO_CHECKOUT_SNAPSHOTS' in os.environ:
+    USE_CHECKOUT_SNAPSHOTS = False
+
+
+
+def get_snapshot_key(repo_path, *details):
+    """
+    None if the repo can't be read, in which case there's nothing to check
+    a snapshot against
+    """
+    try:
+        refs = subprocess.check_output(
+            ['git', 'for-each-ref', '--format=%(objectname) %(refname)'],
+            cwd=repo_path, stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    key = hashlib.sha1()
+    for path in CODE_FILES:
+        with open(path, 'rb') as f:
+            key.update(f.read())
+    key.update(json.dumps([repo_path] + list(details)).encode('utf8'))
+    key.update(refs)
+    return key.hexdigest()
+
+
+
+class CheckoutSnapshots(object):
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, max_snapshots=MAX_SNAPSHOTS):
+        self.snapshot_dir = snapshot_dir
+        self.max_snapshots = max_snapshots
+
+
+    def get_path(self, key):
+        return os.path.join(self.snapshot_dir, key)
+
+
+    def restore(self, key, target):
+        """
+        copies the snapshot into target, and returns the commit refs saved
+        with it, or None if there isn't one
+        """
+        path = self.get_path(key)
+        try:
+            with open(os.path.join(path, 'commit_refs.json')) as f:
+                commit_refs = json.load(f)
+        except (OSError, ValueError):
+            return None
+        mark_used(path)
+        # target is the sourcetree's own empty tempdir, and copytree has to
+        # make the directory itself before python 3.8
+        os.rmdir(target)
+        shutil.copytree(os.path.join(path, 'tree'), target, symlinks=True)
+        return commit_refs
+
+
+    def save(self, key, source, commit_refs):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        # copy then rename, so parallel test runs never see half a snapshot
+        temp_path = tempfile.mkdtemp(dir=self.snapshot_dir, suffix='.tmp')
+        shutil.copytree(source, os.path.join(temp_path, 'tree'), symlinks=True)
+        with open(os.path.join(temp_path, 'commit_refs.json'), 'w') as f:
+            json.dump(commit_refs, f)
+        try:
+            os.rename(temp_path, self.get_path(key))
+        except OSError:
+            # someone else saved it first
+            shutil.rmtree(temp_path)
+        prune(self.snapshot_dir, self.max_snapshots)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+A book-wide index of listing commit refs (eg ch03l002) to the commits in
+each chapter's source repo, so that refs which are missing from a repo,
+or which more than one commit claims, show up before any chapter replay
+starts. run_all_tests.sh runs it first:
+
+    python tests/commit_refs.py [chapter_name ...]
+
+A single chapter test only needs its own checkout's refs, which
+SourceTree reads with read_commit_refs.
+"""
+import os
+import re
+import subprocess
+import sys
+
+from book_listings import BASE_DIR, get_chapter_names
+from book_state import read_book_listings_incrementally
+from book_parser import COMMIT_REF_FINDER
+
+# the same thing `^{/--ref--}` searches commit messages for
+COMMIT_REF_MARKER = re.compile('--(' + COMMIT_REF_FINDER + ')--')
+
+
+def get_repo_path(chapter_name):
+    return os.path.join(BASE_DIR, 'source', chapter_name, 'superlists')
+
+
+def get_listing_commit_refs(listings):
+    return [
+        listing.commit_ref for listing in listings
+        if getattr(listing, 'commit_ref', None)
+    ]
+
+
+def read_commit_refs(repo_path, branch):
+    """
+    returns {ref: [sha, ...]} for every ref marker in the branch's history,
+    youngest commit first, which is the one `^{/--ref--}` would pick
+    """
+    log = subprocess.check_output(
+        ['git', 'log', '--format=%H%x00%B%x00', branch],
+        cwd=repo_path, universal_newlines=True,
+    )
+    fields = log.split('\0')
+    commits = {}
+    for sha, message in zip(fields[0::2], fields[1::2]):
+        for ref in COMMIT_REF_MARKER.findall(message):
+            commits.setdefault(ref, []).append(sha.strip())
+    return commits
+
+
+
+class CommitRefIndex(object):
+
+    def __init__(self):
+        self.shas = {}
+        self.listing_refs = {}
+        self.problems = {}
+
+
+    def add_chapter(self, chapter_name, listing_refs):
+        repo_path = get_repo_path(chapter_name)
+        self.listing_refs[chapter_name] = listing_refs
+        commits = read_commit_refs(repo_path, chapter_name)
+
+        for key in [k for k in self.shas if k[0] == chapter_name]:
+            del self.shas[key]
+        problems = []
+        seen = set()
+        for ref in listing_refs:
+            if ref in seen:
+                problems.append('{} is used by more than one listing'.format(ref))
+            seen.add(ref)
+            if ref not in commits:
+                problems.append('{} has no commit in {}'.format(ref, repo_path))
+                continue
+            if len(commits[ref]) > 1:
+                problems.append('{} is claimed by commits {}'.format(ref, ', '.join(commits[ref])))
+            self.shas[chapter_name, ref] = commits[ref][0]
+        self.problems[chapter_name] = problems
+
+
+    def resolve(self, chapter_name, commit_ref):
+        return self.shas.get((chapter_name, commit_ref))
+
+
+    def dangling_refs(self, chapter_name):
+        return [
+            ref for ref in self.listing_refs.get(chapter_name, [])
+            if (chapter_name, ref) not in self.shas
+        ]
+
+
+
+def build_commit_ref_index(chapter_names):
+    # uninitialised submodules are just empty folders
+    chapter_names = [
+        c for c in chapter_names
+        if os.path.exists(os.path.join(get_repo_path(c), '.git'))
+    ]
+    book, _ = read_book_listings_incrementally(chapter_names)
+    index = CommitRefIndex()
+    for chapter_name in chapter_names:
+        index.add_chapter(chapter_name, get_listing_commit_refs(book.chapter(chapter_name)))
+    return index
+
+
+def main(chapter_names):
+    index = build_commit_ref_index(chapter_names or get_chapter_names())
+    failed = False
+    for chapter_name, problems in index.problems.items():
+        print(chapter_name, '{} refs'.format(len(index.listing_refs[chapter_name])))
+        for problem in problems:
+            print('  ' + problem)
+        # duplicates still resolve, like git does, to the youngest commit
+        if index.dangling_refs(chapter_name):
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
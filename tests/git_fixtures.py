@@ -0,0 +1,59 @@
+"""
+Throwaway git repos for the tests of code that reads the chapters' source
+repos: sourcetree, git_objects, commit_refs and checkout_snapshots.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from sourcetree import SourceTree
+
+
+
+def git(repo, *args):
+    return subprocess.check_output(
+        ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] + list(args),
+        cwd=repo, universal_newlines=True,
+    ).strip()
+
+
+def commit_files(repo, message, files):
+    """
+    writes (or, for None, deletes) each file and commits, returning the sha
+    """
+    for path, contents in files.items():
+        full_path = os.path.join(repo, path)
+        if contents is None:
+            os.remove(full_path)
+            continue
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(contents)
+    git(repo, 'add', '-A')
+    git(repo, 'commit', '-q', '--allow-empty', '-m', message)
+    return git(repo, 'rev-parse', 'HEAD')
+
+
+
+class SourceRepoTestCase(unittest.TestCase):
+    """
+    a source repo shaped like the book's: chapter_w, then chapter_x with a
+    ref that was committed twice and one with a suffix, and a SourceTree
+    that checks chapters out of it
+    """
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.repo)
+        git(self.repo, 'init', '-q')
+        git(self.repo, 'checkout', '-q', '-b', 'chapter_w')
+        commit_files(self.repo, 'start', {'file.txt': 'line 1\n'})
+        git(self.repo, 'checkout', '-q', '-b', 'chapter_x')
+        self.old = commit_files(self.repo, 'first go --ch02l001--', {'file.txt': 'line 2\n'})
+        self.first = commit_files(self.repo, 'first --ch02l001--', {'file.txt': 'line 3\n'})
+        self.second = commit_files(self.repo, 'second\n\nfixes --ch02l002-1--', {'file.txt': 'line 4\n'})
+        self.sourcetree = SourceTree()
+        self.addCleanup(self.sourcetree.cleanup)
+        self.sourcetree.get_local_repo_path = lambda c: self.repo
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Reading objects out of a git repo through one long-running
+`git cat-file --batch`, instead of starting a new git for every
+`git show <commit>:<path>` or `git rev-parse`, and commits' diffs through
+one long-running `git diff-tree --stdin` instead of a `git show` each.
+"""
+import locale
+import re
+import subprocess
+
+OBJECT_TYPES = (b'blob', b'tree', b'commit', b'tag')
+DIFF_HEADER = re.compile(r'^diff --git a/.+ b/(.+)$', re.MULTILINE)
+# diff-tree echoes lines that aren't commits, so this comes back after each
+# diff. no line of a diff or a commit header can start with a #
+END_OF_DIFF = b'# end of diff'
+
+
+def decode(contents):
+    # what universal_newlines would have made of it
+    text = contents.decode(locale.getpreferredencoding(False))
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def get_files_from_diff(diff):
+    # the paths `git diff-tree --name-only -r --find-renames` gives, in the
+    # same order: the new one, for a rename
+    return DIFF_HEADER.findall(diff)
+
+
+
+class GitObjectReader(object):
+    """
+    Answers lookups for any revision spec git understands, like `<sha>`,
+    `repo/chapter^{/--ch03l001--}` or `<commit>:<path>`, over a single pipe
+    to `git cat-file --batch`. git only starts the first time it's needed,
+    so the repo needn't exist yet when this is made.
+    """
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self.process = None
+
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=self.cwd,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+
+
+    def read(self, spec):
+        """
+        (sha, type, contents) of the object the spec names, or None if git
+        can't find one
+        """
+        if '\n' in spec:
+            return None
+        if self.process is None:
+            self._start()
+        self.process.stdin.write(spec.encode('utf8') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline()
+        if not header:
+            raise Exception('git cat-file --batch stopped in {}'.format(self.cwd))
+        fields = header.split()
+        if len(fields) != 3 or fields[1] not in OBJECT_TYPES:
+            # "<spec> missing" or "<spec> ambiguous"
+            return None
+        sha, object_type, size = fields
+        contents = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)  # the newline after the contents
+        return sha.decode('ascii'), object_type.decode('ascii'), contents
+
+
+    def resolve(self, spec):
+        found = self.read(spec)
+        if found is not None:
+            return found[0]
+
+
+    def show(self, spec):
+        """the text of a blob, like `git show <commit>:<path>`, or None"""
+        found = self.read(spec)
+        if found is not None and found[1] == 'blob':
+            return decode(found[2])
+
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+
+
+class GitDiffReader(object):
+    """
+    `git show -M <sha>` for each commit asked for, word for word, over a
+    single pipe to `git diff-tree --stdin`. Like GitObjectReader, git only
+    starts the first time it's needed.
+    """
+
+    def __init__(self, cwd):
+        self.cwd = cwd
+        self.process = None
+
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            [
+                'git', 'diff-tree', '--stdin', '--root', '--always',
+                '--pretty=medium', '--cc', '-M',
+            ],
+            cwd=self.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+
+
+    def show(self, sha):
+        """the commit's header, message and diff, for a full sha"""
+        if self.process is None:
+            self._start()
+        self.process.stdin.write(sha.encode('ascii') + b'\n' + END_OF_DIFF + b'\n')
+        self.process.stdin.flush()
+        lines = []
+        for line in iter(self.process.stdout.readline, b''):
+            if line == END_OF_DIFF + b'\n':
+                break
+            lines.append(line)
+        else:
+            raise Exception('git diff-tree --stdin stopped in {}'.format(self.cwd))
+        # diff-tree puts a blank line between one commit and the next
+        return decode(b''.join(lines)).lstrip('\n')
+
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+A packed, column-per-attribute store for the listings of one or more
+chapters.
+
+Kinds, flags and optional strings live in arrays, and all the text shares
+a single buffer, so a whole book's worth of listings costs a few arrays
+rather than one __dict__ per listing. Indexing still hands out the usual
+CodeListing / Command / Output objects: they are built on first access and
+then kept, so changes like `listing.was_run = True` stick, and the flag
+queries read from them from then on.
+"""
+from array import array
+
+from book_parser import CodeListing, Command, Output, listing_from_dict
+
+
+KINDS = [CodeListing, Command, Output]
+
+FLAGS = [
+    'skip',
+    'was_written',
+    'was_run',
+    'was_checked',
+    'against_server',
+    'currentcontents',
+    'is_server_listing',
+    'ignore_errors',
+    'server_command',
+    'qunit_output',
+]
+FLAG_BITS = {name: 1 << i for i, name in enumerate(FLAGS)}
+
+OPTIONAL_STRINGS = ['filename', 'commit_ref', 'dofirst', 'normalised']
+NO_STRING = -1
+
+# not every kind has every attribute (an Output has no was_run, a
+# CodeListing only gets a dofirst from the parser), so each row also
+# records which of them it actually had
+PRESENT_BITS = {name: 1 << i for i, name in enumerate(FLAGS + OPTIONAL_STRINGS)}
+
+# which flag means a listing of each kind has been dealt with
+DONE_FLAGS = {
+    CodeListing: 'was_written',
+    Command: 'was_run',
+    Output: 'was_checked',
+}
+
+
+
+class ListingTable(object):
+
+    def __init__(self, listings=()):
+        self.kinds = array('B')
+        self.flags = array('H')
+        self.present = array('H')
+        self.text_starts = array('L')
+        self.text_ends = array('L')
+        self.string_columns = {name: array('l') for name in OPTIONAL_STRINGS}
+        self.strings = []
+        self._string_ids = {}
+        self._text_parts = []
+        self._text_length = 0
+        self._text = None
+        self._extras = {}
+        self._objects = {}
+        self.positions_by_kind = {cls: [] for cls in KINDS}
+        self.positions_by_type = {}
+        self.positions_by_commit_ref = {}
+        for listing in listings:
+            self.append(listing)
+
+
+    def _intern(self, value):
+        if value is None:
+            return NO_STRING
+        if value not in self._string_ids:
+            self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self._string_ids[value]
+
+
+    def append(self, listing):
+        pos = len(self.kinds)
+        attributes = dict(vars(listing))
+        cls = type(listing)
+        self.kinds.append(KINDS.index(cls))
+
+        text = str(listing) if isinstance(listing, str) else attributes.pop('contents')
+        self._text_parts.append(text)
+        self._text = None
+        self.text_starts.append(self._text_length)
+        self._text_length += len(text)
+        self.text_ends.append(self._text_length)
+
+        flags = 0
+        present = 0
+        for name in FLAGS + OPTIONAL_STRINGS:
+            if name in attributes:
+                present |= PRESENT_BITS[name]
+        for name in FLAGS:
+            if attributes.pop(name, False):
+                flags |= FLAG_BITS[name]
+        self.flags.append(flags)
+        self.present.append(present)
+        for name in OPTIONAL_STRINGS:
+            self.string_columns[name].append(self._intern(attributes.pop(name, None)))
+        if attributes:
+            self._extras[pos] = attributes
+
+        self._index(pos, listing)
+
+
+    def _index(self, pos, listing):
+        self.positions_by_kind[type(listing)].append(pos)
+        self.positions_by_type.setdefault(listing.type, []).append(pos)
+        commit_ref = getattr(listing, 'commit_ref', None)
+        if commit_ref:
+            self.positions_by_commit_ref.setdefault(commit_ref, pos)
+
+
+    def _unindex(self, pos, listing):
+        self.positions_by_kind[type(listing)].remove(pos)
+        self.positions_by_type[listing.type].remove(pos)
+        commit_ref = getattr(listing, 'commit_ref', None)
+        if commit_ref and self.positions_by_commit_ref.get(commit_ref) == pos:
+            del self.positions_by_commit_ref[commit_ref]
+
+
+    def __len__(self):
+        return len(self.kinds)
+
+
+    def _check_pos(self, pos):
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError('listing index out of range')
+        return pos
+
+
+    def text(self, pos):
+        pos = self._check_pos(pos)
+        if pos in self._objects:
+            listing = self._objects[pos]
+            return listing.contents if type(listing) == CodeListing else str(listing)
+        if self._text is None:
+            self._text = ''.join(self._text_parts)
+            self._text_parts = [self._text]
+        return self._text[self.text_starts[pos]:self.text_ends[pos]]
+
+
+    def kind(self, pos):
+        pos = self._check_pos(pos)
+        if pos in self._objects:
+            return type(self._objects[pos])
+        return KINDS[self.kinds[pos]]
+
+
+    def flag(self, pos, name):
+        pos = self._check_pos(pos)
+        if pos in self._objects:
+            return bool(getattr(self._objects[pos], name, False))
+        return bool(self.flags[pos] & FLAG_BITS[name])
+
+
+    def _build(self, pos):
+        cls = KINDS[self.kinds[pos]]
+        present = self.present[pos]
+        attributes = {}
+        for name in FLAGS:
+            if present & PRESENT_BITS[name]:
+                attributes[name] = bool(self.flags[pos] & FLAG_BITS[name])
+        for name in OPTIONAL_STRINGS:
+            if present & PRESENT_BITS[name]:
+                string_id = self.string_columns[name][pos]
+                attributes[name] = None if string_id == NO_STRING else self.strings[string_id]
+        attributes.update(self._extras.get(pos, {}))
+        data = {'class': cls.__name__, 'attributes': attributes}
+        if cls == CodeListing:
+            attributes['contents'] = self.text(pos)
+        else:
+            data['text'] = self.text(pos)
+        return listing_from_dict(data)
+
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        pos = self._check_pos(pos)
+        if pos not in self._objects:
+            self._objects[pos] = self._build(pos)
+        return self._objects[pos]
+
+
+    def __setitem__(self, pos, listing):
+        pos = self._check_pos(pos)
+        self._unindex(pos, self[pos])
+        self._objects[pos] = listing
+        self._index(pos, listing)
+
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+
+    def position_of_commit_ref(self, commit_ref):
+        return self.positions_by_commit_ref[commit_ref]
+
+
+    def positions_of_type(self, listing_type):
+        return self.positions_by_type.get(listing_type, [])
+
+
+    def unfinished(self, exceptions=()):
+        """
+        positions of listings that are neither skipped nor written/run/checked,
+        worked out from the columns without building any objects
+        """
+        return [
+            pos for pos in range(len(self))
+            if pos not in exceptions
+            and not self.flag(pos, 'skip')
+            and not self.flag(pos, DONE_FLAGS[self.kind(pos)])
+        ]
+
+
+    def __repr__(self):
+        return '<ListingTable of {} listings>'.format(len(self))
+
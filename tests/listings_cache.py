@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from book_parser import Output, listing_from_dict, listing_to_dict
+from cache_dirs import mark_used, prune
+from output_normaliser import normalise_expected_output
+
+CACHE_DIR = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    '.listings_cache'
+)
+# a couple of entries for every chapter, from book_listings and book_state
+MAX_CACHED_CHAPTERS = 200
+PARSER_FILES = [
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'book_parser.py'),
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'book_selectors.py'),
+    # cached outputs carry their normalised text
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'output_normaliser.py'),
+]
+
+USE_LISTINGS_CACHE = True
+if 'NO_LISTINGS_CACHE' in os.environ:
+    USE_LISTINGS_CACHE = False
+
+
+
+def get_parser_version():
+    # any change to the parsing code invalidates every cached chapter
+    parser_hash = hashlib.sha1()
+    for path in PARSER_FILES:
+        with open(path, 'rb') as f:
+            parser_hash.update(f.read())
+    return parser_hash.hexdigest()
+
+
+def get_cache_key(raw_html):
+    key = hashlib.sha1(get_parser_version().encode('utf8'))
+    key.update(raw_html.encode('utf8'))
+    return key.hexdigest()
+
+
+def get_cache_path(raw_html):
+    return get_key_path(get_cache_key(raw_html))
+
+
+def get_key_path(key):
+    return os.path.join(CACHE_DIR, key + '.json')
+
+
+def load_cached_listings(raw_html):
+    return load_listings_by_key(get_cache_key(raw_html))
+
+
+def save_cached_listings(raw_html, listings):
+    save_listings_by_key(get_cache_key(raw_html), listings)
+
+
+def load_listings_by_key(key):
+    if not USE_LISTINGS_CACHE:
+        return None
+    try:
+        with open(get_key_path(key), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    mark_used(get_key_path(key))
+    return [listing_from_dict(d) for d in data]
+
+
+def save_listings_by_key(key, listings):
+    if not USE_LISTINGS_CACHE:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for listing in listings:
+        if isinstance(listing, Output):
+            normalise_expected_output(listing)
+    data = [listing_to_dict(l) for l in listings]
+    # write then rename, so parallel test runs never see a half-written file
+    fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with open(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, get_key_path(key))
+    prune(CACHE_DIR, MAX_CACHED_CHAPTERS)
@@ -0,0 +1,63 @@
+"""
+<chapter>.listings.json manifests, written by the build next to each
+<chapter>.html, so a test run can get a chapter's classified listings
+without the html.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from book_parser import listing_from_dict, listing_to_dict
+from listings_cache import get_parser_version
+
+BASE_DIR = os.path.split(os.path.abspath(os.path.dirname(__file__)))[0]
+
+
+class StaleManifestException(Exception):
+    pass
+
+
+def get_manifest_path(chapter_name):
+    return os.path.join(BASE_DIR, chapter_name + '.listings.json')
+
+
+def get_html_hash(chapter_name):
+    html_path = os.path.join(BASE_DIR, chapter_name + '.html')
+    if not os.path.exists(html_path):
+        return None
+    with open(html_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def write_listings_manifest(chapter_name, listings):
+    manifest = {
+        'chapter': chapter_name,
+        'parser_version': get_parser_version(),
+        'html_sha1': get_html_hash(chapter_name),
+        'listings': [listing_to_dict(l) for l in listings],
+    }
+    path = get_manifest_path(chapter_name)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with open(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def read_listings_manifest(chapter_name):
+    with open(get_manifest_path(chapter_name), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['parser_version'] != get_parser_version():
+        raise StaleManifestException(
+            '{} was written by a different version of the parser'.format(
+                get_manifest_path(chapter_name)
+            )
+        )
+    # test shards may only have the manifests, but if the html is here too
+    # it had better be what the manifest was made from
+    html_hash = get_html_hash(chapter_name)
+    if html_hash is not None and html_hash != manifest['html_sha1']:
+        raise StaleManifestException(
+            '{} is older than {}.html'.format(get_manifest_path(chapter_name), chapter_name)
+        )
+    return [listing_from_dict(d) for d in manifest['listings']]
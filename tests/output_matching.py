@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Matching expected lines against (normalised) actual output, and watching
+actual output for an early mismatch while the command is still running.
+"""
+from bisect import bisect_left
+
+
+
+class LineIndex(object):
+    """
+    The lines of some actual output, indexed for the three ways an expected
+    line can match one of them: as is, stripped, or as a prefix. Each index
+    is built the first time it's needed, and maps lines to the positions
+    they're at, so a lookup can ask for the first one after a given line.
+
+    The lines with a prefix sort together, so whether there are any is one
+    bisect. Their positions only get sorted out, once for each prefix, if
+    next_prefix asks for them.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._positions = None
+        self._stripped_positions = None
+        self._sorted_lines = None
+        self._prefix_positions = {}
+
+
+    def has_line(self, line):
+        return self.next_line(line, 0) is not None
+
+
+    def has_stripped_line(self, line):
+        return self.next_stripped_line(line, 0) is not None
+
+
+    def has_prefix(self, prefix):
+        sorted_lines = self._get_sorted_lines()
+        i = bisect_left(sorted_lines, (prefix,))
+        return i < len(sorted_lines) and sorted_lines[i][0].startswith(prefix)
+
+
+    def next_line(self, line, start):
+        if self._positions is None:
+            self._positions = _positions(self.lines)
+        return _first_from(self._positions.get(line, ()), start)
+
+
+    def next_stripped_line(self, line, start):
+        if self._stripped_positions is None:
+            self._stripped_positions = _positions(l.strip() for l in self.lines)
+        return _first_from(self._stripped_positions.get(line, ()), start)
+
+
+    def next_prefix(self, prefix, start):
+        if prefix not in self._prefix_positions:
+            # the lines starting with the prefix sort together, straight after it
+            sorted_lines = self._get_sorted_lines()
+            first = i = bisect_left(sorted_lines, (prefix,))
+            while i < len(sorted_lines) and sorted_lines[i][0].startswith(prefix):
+                i += 1
+            self._prefix_positions[prefix] = sorted(p for _, p in sorted_lines[first:i])
+        return _first_from(self._prefix_positions[prefix], start)
+
+
+    def _get_sorted_lines(self):
+        if self._sorted_lines is None:
+            self._sorted_lines = sorted((l, i) for i, l in enumerate(self.lines))
+        return self._sorted_lines
+
+
+
+def _positions(lines):
+    positions = {}
+    for i, line in enumerate(lines):
+        positions.setdefault(line, []).append(i)
+    return positions
+
+
+def _first_from(positions, start):
+    i = bisect_left(positions, start)
+    if i < len(positions):
+        return positions[i]
+
+
+
+class Mismatch(object):
+    """
+    Where expected output stopped matching the actual output: the expected
+    line, and the actual lines around where it should have been.
+    """
+    CONTEXT = 3
+
+    def __init__(self, actual_lines, expected_number, expected_line, actual_number, reason):
+        self.expected_number = expected_number
+        self.expected_line = expected_line
+        self.actual_number = actual_number
+        self.reason = reason
+        self.total_actual_lines = len(actual_lines)
+        first = max(actual_number - self.CONTEXT, 0)
+        self.context = list(enumerate(
+            actual_lines[first:actual_number + self.CONTEXT + 1], start=first
+        ))
+
+
+    def __str__(self):
+        report = [
+            'expected line {} {}:'.format(self.expected_number + 1, self.reason),
+            '    {!r}'.format(self.expected_line),
+            'actual output around line {} (of {}):'.format(
+                self.actual_number + 1, self.total_actual_lines
+            ),
+        ]
+        report.extend(
+            '{} {:>5} {!r}'.format('>' if i == self.actual_number else ' ', i + 1, line)
+            for i, line in self.context
+        )
+        return '\n'.join(report)
+
+
+
+def find_mismatch(actual_lines, expected_lines, whole=False):
+    """
+    Looks for each expected line in the actual ones, and returns a Mismatch
+    for the first one that can't be found, or None.
+
+    With whole=True every line has to be the same, in the same place.
+    Otherwise each expected line just has to turn up somewhere, in any
+    order, because stdout and stderr can come out interleaved differently
+    from how the book shows them. Lines starting with "[..." are skipped.
+    An expected line ending in "[...]" only has to start an actual line,
+    one that starts with a space has to match exactly, and the rest match
+    ignoring indentation. The order only matters for where a Mismatch
+    says the missing line should have been: after the lines before it.
+    """
+    if whole:
+        for i, (actual, expected) in enumerate(zip(actual_lines, expected_lines)):
+            if actual != expected:
+                return Mismatch(actual_lines, i, expected, i, 'is different')
+        if len(actual_lines) < len(expected_lines):
+            n = len(actual_lines)
+            return Mismatch(actual_lines, n, expected_lines[n], n, 'is past the end of the output')
+        if len(actual_lines) > len(expected_lines):
+            n = len(expected_lines)
+            return Mismatch(actual_lines, n - 1, expected_lines[-1], n, 'is the last, but the output goes on')
+        return None
+
+    index = LineIndex(actual_lines)
+    lookups = list(_lookups(index, expected_lines))
+    for n, (i, line, has, find) in enumerate(lookups):
+        if has(line):
+            continue
+        # a line found anywhere passes, so where the earlier ones were only
+        # matters for showing where this one should have been
+        start = 0
+        for _, earlier_line, _, earlier_find in lookups[:n]:
+            position = earlier_find(earlier_line, start)
+            if position is not None:
+                start = position + 1
+        return Mismatch(actual_lines, i, line, start, 'not found')
+    return None
+
+
+def _lookups(index, expected_lines):
+    # (number, line, has, find) for each expected line that isn't a gap
+    for i, line in enumerate(expected_lines):
+        if line.startswith('[...'):
+            continue
+        if line.endswith('[...]'):
+            line = line.rsplit('[...]')[0].rstrip()
+            yield i, line, index.has_prefix, index.next_prefix
+        elif line.startswith(' '):
+            yield i, line, index.has_line, index.next_line
+        else:
+            yield i, line, index.has_stripped_line, index.next_stripped_line
+
+
+
+# the characters unittest prints, one per test, as the tests finish
+PROGRESS_CHARACTERS = frozenset('.EFsxu')
+
+
+def is_progress(text):
+    return bool(text) and PROGRESS_CHARACTERS.issuperset(text)
+
+
+
+class ProgressWatcher(object):
+    """
+    Watches the output of a test run as it arrives, for the line of progress
+    characters unittest prints at the start (one per test: ., E, F, s...).
+    The expected output's own progress line is the anchor. Once the actual
+    one has gone a different way, no amount of further output can make the
+    two match, so there's no point waiting for the rest of the tests.
+
+    Call it with each chunk of output. It returns True when the command can
+    be stopped, and then `mismatch` says why.
+    """
+
+    def __init__(self, expected_lines):
+        # lines of 79 characters or more may be wrapped pieces of a longer one
+        self.anchor = next(
+            (l.strip() for l in expected_lines if is_progress(l.strip()) and len(l) < 79),
+            None
+        )
+        self.done = self.anchor is None
+        self.at_line_start = True
+        self.progress = None
+        self.mismatch = None
+
+
+    def __call__(self, chunk):
+        if self.done:
+            return False
+        segments = chunk.split('\n')
+        for i, segment in enumerate(segments):
+            self._read(segment, line_ended=i < len(segments) - 1)
+            if self.done:
+                break
+        return self.mismatch is not None
+
+
+    def _read(self, segment, line_ended):
+        if segment:
+            if is_progress(segment) and (self.at_line_start or self.progress is not None):
+                # unittest writes each character on its own, so a chunk of
+                # nothing else is progress, rather than the start of a word
+                self.progress = (self.progress or '') + segment
+                if not self.anchor.startswith(self.progress):
+                    self._fail()
+            else:
+                self.progress = None
+            self.at_line_start = False
+        if line_ended:
+            if self.progress is not None:
+                if self.progress == self.anchor:
+                    self.done = True
+                else:
+                    self._fail()
+            self.at_line_start = True
+
+
+    def _fail(self):
+        self.mismatch = 'expected the tests to go {!r}, but they went {!r}'.format(
+            self.anchor, self.progress
+        )
+        self.done = True
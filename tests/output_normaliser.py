@@ -0,0 +1,754 @@
+#!/usr/bin/env python3
+"""
+The fixups that get applied to actual and expected console output before
+they are compared: run times, git hashes, mock and object ids, ports and so
+on.
+
+Each regex or literal fixup is a Rule. A RuleScan compiles a run of rules
+into one alternation, to find the few lines they apply to in a single pass
+over the text, with the same result as applying them one after the other.
+A Normaliser strings scans together with the fixups that aren't simple
+substitutions, like line wrapping.
+
+RULES lists them all in the order they run, with the side of the
+comparison each one is for. Running the tests with
+NORMALISATION_STATS=<file> adds up, in that file, how often each one ran,
+how often it changed anything and how long it took, and
+
+    python tests/output_normaliser.py <file> [<file> ...]
+
+prints the totals, slowest first.
+"""
+import atexit
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+
+INLINE_FLAGS = {
+    re.IGNORECASE: 'i',
+    re.MULTILINE: 'm',
+    re.DOTALL: 's',
+}
+
+
+
+class Rule(object):
+
+    def __init__(self, name, pattern, replacement, flags=0):
+        self.name = name
+        self.pattern = pattern
+        self.replacement = replacement
+        self.flags = flags
+        self.regex = re.compile(pattern, flags)
+
+
+    def __call__(self, text):
+        return self.regex.sub(self.replacement, text)
+
+
+    def __repr__(self):
+        return '<Rule %s>' % (self.name,)
+
+
+    @property
+    def starts_a_line(self):
+        return self.pattern.startswith('^')
+
+
+    @property
+    def ends_a_line(self):
+        return self.pattern.endswith('$') and not self.pattern.endswith(r'\$')
+
+
+    def scan_pattern(self):
+        # for a RuleScan: the rule's own flags scoped to it, and a leading ^
+        # turned into the newline before it (see RuleScan)
+        pattern = self.pattern
+        anchor = ''
+        if self.starts_a_line:
+            pattern = pattern[1:]
+            anchor = r'\n' if self.flags & re.MULTILINE else r'\n(?<=\A\n)'
+        if self.flags:
+            letters = ''.join(
+                letter for flag, letter in INLINE_FLAGS.items() if self.flags & flag
+            )
+            pattern = '(?%s:%s)' % (letters, pattern)
+        return anchor + pattern
+
+
+    def scan_alternatives(self):
+        return [self.scan_pattern()]
+
+
+
+class Literal(Rule):
+
+    def __init__(self, name, old, new):
+        super().__init__(name, re.escape(old), new)
+        self.old = old
+        self.new = new
+
+
+    def __call__(self, text):
+        return text.replace(self.old, self.new)
+
+
+
+class LiteralSet(Rule):
+    """
+    Several Literals, replaced in one pass. The strings they look for go
+    into a trie, written out as a regex, so a match costs one walk down it
+    however many literals there are.
+
+    Only for literals that can't get in each other's way (see
+    `independent`), so that one pass does the same as one after another.
+    """
+
+    def __init__(self, literals):
+        self.literals = list(literals)
+        self.new_for_old = {l.old: l.new for l in self.literals}
+        self.trie = make_trie(self.new_for_old)
+        super().__init__(
+            ' + '.join(l.name for l in self.literals), _node_pattern(self.trie), ''
+        )
+
+
+    def __call__(self, text):
+        return self.regex.sub(self._new, text)
+
+
+    def _new(self, match):
+        return self.new_for_old[match.group()]
+
+
+    def scan_alternatives(self):
+        # each first character separately: sre can only skip ahead to the
+        # likely starts of a match when every alternative starts with one
+        return [
+            re.escape(character) + _node_pattern(child)
+            for character, child in sorted(self.trie.items())
+        ]
+
+
+
+def make_trie(strings):
+    trie = {}
+    for string in strings:
+        node = trie
+        for character in string:
+            node = node.setdefault(character, {})
+        node[''] = {}
+    return trie
+
+
+def _node_pattern(node):
+    # no string is a prefix of another, so a string's end has no children
+    if '' in node:
+        return ''
+    branches = [
+        re.escape(character) + _node_pattern(child)
+        for character, child in sorted(node.items())
+    ]
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:%s)' % '|'.join(branches)
+
+
+def overlap(a, b):
+    # whether the two strings could share any characters in some text
+    if a in b or b in a:
+        return True
+    return any(
+        a.endswith(b[:n]) or b.endswith(a[:n])
+        for n in range(1, min(len(a), len(b)))
+    )
+
+
+def independent(literals):
+    """
+    Whether replacing all the literals in one pass gives the same as
+    replacing each in turn: none of the strings they look for overlap, and
+    nothing one puts back overlaps what a later one looks for.
+    """
+    for i, earlier in enumerate(literals):
+        for later in literals[i + 1:]:
+            if overlap(earlier.old, later.old) or overlap(earlier.new, later.old):
+                return False
+    return True
+
+
+def merge_literals(rules):
+    # runs of independent Literals become LiteralSets, everything else stays
+    merged = []
+    run = []
+    for rule in rules + [None]:
+        if type(rule) is Literal and independent(run + [rule]):
+            run.append(rule)
+            continue
+        if run:
+            merged.append(run[0] if len(run) == 1 else LiteralSet(run))
+        run = [rule] if type(rule) is Literal else []
+        if rule is not None and not run:
+            merged.append(rule)
+    return merged
+
+
+
+class RuleScan(object):
+    """
+    All of `rules`, with one pass to find where they apply.
+
+    The combined pattern tries each rule in order at every position, and
+    finds the lines with a match for any of them. Only those lines go
+    through the rules one at a time: a line with no match anywhere is one
+    none of them would have changed. Replaying whole lines, rather than
+    just what matched, keeps the result the same as one by one, even where
+    a rule's match runs into a later rule's, or what it puts back makes
+    one, which a single substitution pass would get wrong.
+
+    That relies on no rule matching a newline. A ^ or $ without
+    re.MULTILINE means the start or end of the whole text, so a rule
+    anchored like that only gets replayed over lines that reach it.
+
+    sre can only skip ahead to likely match starts if every alternative
+    begins with a literal character, so a rule anchored with ^ matches the
+    newline in front of it instead, and the text gets a newline stuck on
+    the front for the duration of the scan.
+
+    Runs of Literals that don't get in each other's way share a LiteralSet,
+    so adding another one costs next to nothing.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.units = merge_literals(self.rules)
+        self.claims_newlines = any(rule.starts_a_line for rule in self.units)
+        self.text_anchors = [
+            (False, False) if rule.flags & re.MULTILINE
+            else (rule.starts_a_line, rule.ends_a_line)
+            for rule in self.units
+        ]
+        alternatives = []
+        for rule in self.units:
+            alternatives.extend(rule.scan_alternatives())
+        self.regex = re.compile('|'.join(alternatives))
+
+
+    def _replay(self, lines, at_start, at_end):
+        for rule, (needs_start, needs_end) in zip(self.units, self.text_anchors):
+            if (needs_start and not at_start) or (needs_end and not at_end):
+                continue
+            lines = rule(lines)
+        return lines
+
+
+    def __call__(self, text):
+        if len(self.units) == 1:
+            return self.units[0](text)
+        if self.claims_newlines:
+            text = '\n' + text
+        first_line = int(self.claims_newlines)
+        pieces = []
+        position = 0
+        match = self.regex.search(text)
+        while match is not None:
+            # the whole lines the match is on, less the newline that an
+            # anchored rule matches in front of its line
+            start = match.start()
+            if text.startswith('\n', start):
+                start += 1
+            start = text.rfind('\n', 0, start) + 1
+            end = text.find('\n', match.end())
+            if end in (-1, len(text) - 1):
+                # a trailing newline comes too, since $ can match before it
+                end = len(text)
+            pieces.append(text[position:start])
+            pieces.append(self._replay(
+                text[start:end], start == first_line, end == len(text)
+            ))
+            position = end
+            match = self.regex.search(text, end)
+        pieces.append(text[position:])
+        fixed = ''.join(pieces)
+        return fixed[1:] if self.claims_newlines else fixed
+
+
+    def sequentially(self, text):
+        for rule in self.rules:
+            text = rule(text)
+        return text
+
+
+
+class Normaliser(object):
+    """
+    Applies each step in turn. A list of rules becomes a single RuleScan,
+    anything else is called with the text.
+    """
+
+    def __init__(self, *steps):
+        self.steps = [
+            RuleScan(step) if isinstance(step, (list, tuple)) else step
+            for step in steps
+        ]
+
+
+    def __call__(self, text):
+        for step in self.steps:
+            text = step(text)
+        return text
+
+
+    def sequentially(self, text):
+        # one pass per rule, for comparison
+        for step in self.steps:
+            if isinstance(step, RuleScan):
+                text = step.sequentially(text)
+            else:
+                text = step(text)
+        return text
+
+
+
+ACTUAL = 'actual'
+EXPECTED = 'expected'
+
+
+
+class RegisteredStep(object):
+
+    def __init__(self, step, sides, listing_types, starts_scan, ends_scan):
+        self.step = step
+        self.sides = sides
+        self.listing_types = listing_types
+        self.starts_scan = starts_scan
+        self.ends_scan = ends_scan
+
+
+    @property
+    def name(self):
+        if isinstance(self.step, Rule):
+            return self.step.name
+        return self.step.__name__
+
+
+    def applies_to(self, side, listing_type):
+        if side not in self.sides:
+            return False
+        if listing_type is None or self.listing_types is None:
+            return True
+        return listing_type in self.listing_types
+
+
+
+class RuleRegistry(object):
+    """
+    Every fixup, in the order they run, with which side of the comparison
+    each one applies to and, if it's only for some types of listing,
+    which ones (listing_type=None means any).
+
+    Consecutive rules share a RuleScan, unless a rule says it needs to
+    start or end one. Anything that isn't a Rule gets called on its own.
+
+    With `profiling` on, the steps run one at a time instead, and `stats`
+    records how often each one was run, how many of those runs changed
+    the text, and how long they took.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.profiling = False
+        self.stats = {}
+        self._normalisers = {}
+
+
+    def add(self, step, sides=(ACTUAL, EXPECTED), listing_types=None, starts_scan=False, ends_scan=False):
+        self.entries.append(RegisteredStep(step, sides, listing_types, starts_scan, ends_scan))
+        self._normalisers.clear()
+
+
+    def steps(self, side, listing_type=None):
+        return [e for e in self.entries if e.applies_to(side, listing_type)]
+
+
+    def normaliser(self, side, listing_type=None):
+        key = (side, listing_type)
+        if key not in self._normalisers:
+            grouped = []
+            scan = None
+            for entry in self.steps(side, listing_type):
+                if not isinstance(entry.step, Rule):
+                    grouped.append(entry.step)
+                    scan = None
+                    continue
+                if scan is None or entry.starts_scan:
+                    scan = []
+                    grouped.append(scan)
+                scan.append(entry.step)
+                if entry.ends_scan:
+                    scan = None
+            self._normalisers[key] = Normaliser(*grouped)
+        return self._normalisers[key]
+
+
+    def normalise(self, side, text, listing_type=None):
+        if not self.profiling:
+            return self.normaliser(side, listing_type)(text)
+        for entry in self.steps(side, listing_type):
+            start = time.perf_counter()
+            fixed = entry.step(text)
+            add_stats(self.stats, {entry.name: {
+                'runs': 1,
+                'changes': int(fixed != text),
+                'seconds': time.perf_counter() - start,
+            }})
+            text = fixed
+        return text
+
+
+    def save_stats(self, path):
+        # added to whatever is there already, so one file can collect a
+        # whole book's worth of chapter test runs
+        stats = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            pass
+        add_stats(stats, self.stats)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+
+
+    def report(self, stats):
+        names = []
+        for entry in self.entries:
+            if entry.name not in names:
+                names.append(entry.name)
+        never_run = {'runs': 0, 'changes': 0, 'seconds': 0}
+        names.sort(key=lambda name: stats.get(name, never_run)['seconds'], reverse=True)
+        lines = []
+        for name in names:
+            counts = stats.get(name, never_run)
+            lines.append('{:<32} {:>8} runs {:>8} changes {:>9.3f}s{}'.format(
+                name, counts['runs'], counts['changes'], counts['seconds'],
+                '  never changed anything' if not counts['changes'] else '',
+            ))
+        return lines
+
+
+
+def add_stats(stats, more_stats):
+    for name, counts in more_stats.items():
+        totals = stats.setdefault(name, {'runs': 0, 'changes': 0, 'seconds': 0})
+        for key, value in counts.items():
+            totals[key] += value
+
+
+
+WRAP_WIDTH = 79
+# textwrap turns each of these into a space, and splits words on runs of them
+WRAP_WHITESPACE = str.maketrans('\t\n\x0b\x0c\r', '     ')
+SPACES = re.compile('( +)')
+
+
+def wrap_long_lines(text):
+    return '\n'.join(wrap_paragraph(p) for p in text.split('\n'))
+
+
+def wrap_paragraph(paragraph):
+    """
+    '\\n'.join(textwrap.wrap(paragraph, 79, break_long_words=True,
+    break_on_hyphens=False)), but in linear time. textwrap slices the rest
+    of a long word off again for every line it fills, so the time for an
+    unbroken line of html goes up with the square of its length.
+    """
+    if '\t' in paragraph:
+        paragraph = paragraph.expandtabs(8)
+    paragraph = paragraph.translate(WRAP_WHITESPACE)
+    if len(paragraph) <= WRAP_WIDTH:
+        # it all fits on one line, less the last word if that's whitespace
+        stripped = paragraph.rstrip(' ')
+        if stripped != paragraph:
+            return stripped
+        last_word = paragraph[paragraph.rfind(' ') + 1:]
+        if last_word.isspace():
+            return paragraph[:-len(last_word)]
+        return paragraph
+    return '\n'.join(_wrap_chunks([c for c in SPACES.split(paragraph) if c]))
+
+
+def _wrap_chunks(chunks):
+    # textwrap.TextWrapper._wrap_chunks, keeping an offset into the chunk
+    # being broken up instead of slicing what's left of it every time
+    width = WRAP_WIDTH
+    # the rest of a chunk is whitespace (as far as str.strip goes) once the
+    # offset is past its last non-whitespace character
+    last_nonspace = [len(c.rstrip()) - 1 for c in chunks]
+    lines = []
+    i = 0
+    offset = 0
+    while i < len(chunks):
+        line = []
+        line_length = 0
+        if lines and offset > last_nonspace[i]:
+            i += 1
+            offset = 0
+        while i < len(chunks):
+            length = len(chunks[i]) - offset
+            if line_length + length > width:
+                break
+            line.append(chunks[i][offset:])
+            line_length += length
+            i += 1
+            offset = 0
+        if i < len(chunks) and len(chunks[i]) - offset > width:
+            end = offset + width - line_length
+            line.append(chunks[i][offset:end])
+            offset = end
+        if line and not line[-1].strip():
+            del line[-1]
+        if line:
+            lines.append(''.join(line))
+    return lines
+
+
+def apply_in_turn(rules, text):
+    for rule in rules:
+        text = rule(text)
+    return text
+
+
+
+LIBRARY_PATHS = Rule(
+    'library paths', r'(File ").+packages/', r'\1.../', flags=re.MULTILINE,
+)
+TEST_DASHES = Literal('test dashes', ' ' + '-' * 69, '-' * 70)
+MOCK_IDS = [
+    Rule(
+        'mock ids with names',
+        r"Mock name='(.+)' id='(\d+)'>",
+        r"Mock name='\1' id='XX'>",
+    ),
+    Rule('mock ids', r"Mock id='(\d+)'>", r"Mock id='XX'>"),
+]
+OBJECT_IDS = Rule('object ids', '0x([0-9a-f]+)>', '0xXX>')
+MIGRATION_TIMESTAMPS = Rule(
+    'migration timestamps',
+    r'00(\d\d)_auto_20\d{6}_\d{4}',
+    r'00\1_auto_20XXXXXX_XXXX',
+)
+LOCALHOST_PORT = Rule('localhost port', r'localhost:\d\d\d\d\d?', r'localhost:XXXX')
+SESSION_IDS = Rule('session ids', r'^[a-z0-9]{32}$', r'xxx_session_id_xxx')
+ASSERTIONERROR_NONE = Literal(
+    'AssertionError: None', "AssertionError: None", "AssertionError"
+)
+GIT_HASHES = [
+    Rule(
+        'git diff indexes',
+        r"index .......\.\........ 100644",
+        r"index XXXXXXX\.\.XXXXXXX 100644",
+    ),
+    Rule('git commit hashes', r"^[a-f0-9]{7} ", r"XXXXXXX ", flags=re.MULTILINE),
+]
+CALLOUTS = [
+    Rule('old callouts', r"^(.+)  <\d+>$", r"\1", flags=re.MULTILINE),
+    Rule('new callouts', r"^(.+)  \(\d+\)$", r"\1", flags=re.MULTILINE),
+]
+TEST_SPEED = Rule(
+    'test speed', r"Ran (\d+) tests? in \d+\.\d\d\ds", r"Ran \1 tests in X.Xs",
+)
+JS_TEST_SPEED = Rule(
+    'js test speed',
+    r"Took \d+ms to run (\d+) tests. (\d+) passed, (\d+) failed.",
+    r"Took XXms to run \1 tests. \2 passed, \3 failed.",
+)
+BDD_TEST_SPEED = Rule(
+    'bdd test speed',
+    r"features/steps/(\w+).py:(\d+) \d+.\d\d\ds",
+    r"features/steps/\1.py:\2 XX.XXXs",
+)
+SCREENSHOT_TIMESTAMPS = [
+    Rule(
+        'screenshot timestamps',
+        r"window0-(201\d-\d\d-\d\dT\d\d\.\d\d\.\d?\d?)",
+        r"window0-201X-XX-XXTXX.XX",
+    ),
+    # this last is very specific to one listing in 19...
+    Rule('screenshot html dumps', r"^\d\d\.html$", "XX.html", flags=re.MULTILINE),
+]
+
+SQLITE_MESSAGES = {
+    'django.db.utils.IntegrityError: lists_item.list_id may not be NULL':
+    'django.db.utils.IntegrityError: NOT NULL constraint failed: lists_item.list_id',
+
+    'django.db.utils.IntegrityError: columns list_id, text are not unique':
+    'django.db.utils.IntegrityError: UNIQUE constraint failed: lists_item.list_id,\nlists_item.text',
+
+    'sqlite3.IntegrityError: columns list_id, text are not unique':
+    'sqlite3.IntegrityError: UNIQUE constraint failed: lists_item.list_id,\nlists_item.text'
+}
+SQLITE = [
+    Literal('sqlite messages', old_version, new_version)
+    for old_version, new_version in SQLITE_MESSAGES.items()
+]
+# TODO: remove me when upgrading bootstrap
+JENKINS_PIXELSIZE = Literal('jenkins pixelsize', '107.0 != 512', '106.5 != 512')
+INTERACTIVE_MANAGEPY = [
+    Literal('interactive select an option', 'Select an option: ', 'Select an option:\n'),
+    Literal('interactive prompt', '>>> ', '>>>\n'),
+]
+NON_BREAKING_SPACES = Literal('non-breaking spaces', '\xa0', ' ')
+SQLITE_FIXES = RuleScan(SQLITE)
+INTERACTIVE_MANAGEPY_FIXES = RuleScan(INTERACTIVE_MANAGEPY)
+
+
+
+def fix_test_dashes(output):
+    return TEST_DASHES(output)
+
+
+def strip_mock_ids(output):
+    return apply_in_turn(MOCK_IDS, output)
+
+
+def strip_object_ids(output):
+    return OBJECT_IDS(output)
+
+
+def strip_migration_timestamps(output):
+    return MIGRATION_TIMESTAMPS(output)
+
+
+def strip_localhost_port(output):
+    return LOCALHOST_PORT(output)
+
+
+def strip_session_ids(output):
+    return SESSION_IDS(output)
+
+
+def standardise_assertionerror_none(output):
+    return ASSERTIONERROR_NONE(output)
+
+
+def strip_git_hashes(output):
+    return apply_in_turn(GIT_HASHES, output)
+
+
+def strip_callouts(output):
+    return apply_in_turn(CALLOUTS, output)
+
+
+def standardise_library_paths(output):
+    return LIBRARY_PATHS(output)
+
+
+def strip_test_speed(output):
+    return TEST_SPEED(output)
+
+
+def strip_js_test_speed(output):
+    return JS_TEST_SPEED(output)
+
+
+def strip_bdd_test_speed(output):
+    return BDD_TEST_SPEED(output)
+
+
+def strip_screenshot_timestamps(output):
+    return apply_in_turn(SCREENSHOT_TIMESTAMPS, output)
+
+
+def fix_sqlite_messages(actual_text):
+    return SQLITE_FIXES(actual_text)
+
+
+def fix_jenkins_pixelsize(actual_text):
+    return JENKINS_PIXELSIZE(actual_text)
+
+
+def fix_creating_database_line(actual_text):
+    creating_db = "Creating test database for alias 'default'..."
+    actual_lines = actual_text.split('\n')
+    if creating_db in actual_lines:
+        actual_lines.remove(creating_db)
+        actual_lines.insert(0, creating_db)
+        actual_text = '\n'.join(actual_lines)
+    return actual_text
+
+
+def fix_interactive_managepy_stuff(actual_text):
+    return INTERACTIVE_MANAGEPY_FIXES(actual_text)
+
+
+
+RULES = RuleRegistry()
+RULES.add(LIBRARY_PATHS, ends_scan=True)
+RULES.add(TEST_DASHES, sides=[EXPECTED])
+# the actual output gets wrapped, since the book's listings are
+RULES.add(wrap_long_lines, sides=[ACTUAL])
+# moved up from between the sqlite and interactive fixes: no rule can
+# touch that line, but the '>>> ' fix could create one
+RULES.add(fix_creating_database_line, sides=[ACTUAL])
+RULES.add(TEST_SPEED)
+RULES.add(JS_TEST_SPEED)
+RULES.add(BDD_TEST_SPEED)
+for rule in GIT_HASHES + MOCK_IDS:
+    RULES.add(rule)
+RULES.add(OBJECT_IDS)
+RULES.add(MIGRATION_TIMESTAMPS)
+RULES.add(SESSION_IDS)
+RULES.add(LOCALHOST_PORT)
+for rule in SCREENSHOT_TIMESTAMPS:
+    RULES.add(rule)
+for rule in SQLITE + [JENKINS_PIXELSIZE] + INTERACTIVE_MANAGEPY:
+    RULES.add(rule, sides=[ACTUAL])
+# whole-line matches: in a scan of their own, so the lines they match
+# don't all have to go through every earlier rule again
+RULES.add(CALLOUTS[0], sides=[EXPECTED], starts_scan=True)
+RULES.add(CALLOUTS[1], sides=[EXPECTED])
+RULES.add(ASSERTIONERROR_NONE)
+RULES.add(NON_BREAKING_SPACES)
+
+if os.environ.get('NORMALISATION_STATS'):
+    RULES.profiling = True
+    atexit.register(RULES.save_stats, os.environ['NORMALISATION_STATS'])
+
+normalise_actual = RULES.normaliser(ACTUAL)
+normalise_expected = RULES.normaliser(EXPECTED)
+
+
+
+def normalise_expected_output(output):
+    """
+    The expected side of the comparison for an Output listing. A book
+    build's listings never change, so it's worked out once per Output and
+    kept on it as `normalised`, which the listings cache saves along with
+    the rest. Profiling skips the memo, so the stats see every comparison.
+    """
+    if RULES.profiling:
+        return RULES.normalise(EXPECTED, output, output.type)
+    if getattr(output, 'normalised', None) is None:
+        output.normalised = RULES.normalise(EXPECTED, output, output.type)
+    return output.normalised
+
+
+
+def main(stats_paths):
+    stats = {}
+    for path in stats_paths:
+        with open(path, encoding='utf-8') as f:
+            add_stats(stats, json.load(f))
+    for line in RULES.report(stats):
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,4 +1,6 @@
+import codecs
 import getpass
+import locale
 import os
 import io
 import re
@@ -7,6 +9,11 @@ import shutil
 import subprocess
 import tempfile
 
+from checkout_snapshots import get_snapshot_key
+from commit_refs import read_commit_refs
+from git_objects import GitDiffReader, GitObjectReader, get_files_from_diff
+from unified_diff import apply_diff
+
 def strip_comments(line):
     match_python = re.match(r"^(.+\S) +#$", line)
     if match_python:
@@ -59,11 +66,18 @@ class ApplyCommitException(Exception):
 
 
 class SourceTree(object):
+    # borrow the source repo's objects rather than copying them all
+    share_objects = 'FULL_CHECKOUTS' not in os.environ
 
     def __init__(self):
         self.tempdir = tempfile.mkdtemp()
         self.processes = []
         self.dev_server_running = False
+        self.commit_refs = {}
+        self.snapshots = None
+        self.git_objects = GitObjectReader(self.tempdir)
+        self.git_diffs = GitDiffReader(self.tempdir)
+        self.commit_diffs = {}
 
 
     def get_contents(self, path):
@@ -72,6 +86,8 @@ class SourceTree(object):
 
 
     def cleanup(self):
+        self.git_objects.close()
+        self.git_diffs.close()
         for process in self.processes:
             try:
                 os.killpg(process.pid, signal.SIGTERM)
@@ -81,7 +97,7 @@ class SourceTree(object):
             shutil.rmtree(self.tempdir)
 
 
-    def run_command(self, command, cwd=None, user_input=None, ignore_errors=False, silent=False):
+    def run_command(self, command, cwd=None, user_input=None, ignore_errors=False, silent=False, watch=None):
         if cwd is None:
             cwd = self.tempdir
 
@@ -118,7 +134,13 @@ class SourceTree(object):
             user_input += '\n'
         if user_input:
             print('sending user input: {}'.format(user_input))
-        output, _ = process.communicate(user_input)
+        if watch is None:
+            output, _ = process.communicate(user_input)
+        else:
+            output, stopped = self._read_watched_output(process, user_input, watch)
+            if stopped:
+                print('stopped %s early, output so far:\n%s' % (command, output))
+                return output
         if process.returncode and not ignore_errors:
             if 'test' in command or 'diff' in command or 'migrate' in command:
                 return output
@@ -134,6 +156,36 @@ class SourceTree(object):
         return output
 
 
+    def _read_watched_output(self, process, user_input, watch):
+        # like communicate, but hands each chunk of output to watch as soon
+        # as it arrives, and kills the whole process group if it says to stop
+        if user_input:
+            process.stdin.write(user_input)
+        process.stdin.close()
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(locale.getpreferredencoding(False))(),
+            translate=True,
+        )
+        chunks = []
+        stopped = False
+        while not stopped:
+            data = os.read(process.stdout.fileno(), 65536)
+            chunk = decoder.decode(data, final=not data)
+            if chunk:
+                chunks.append(chunk)
+                if watch(chunk):
+                    try:
+                        os.killpg(process.pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+                    stopped = True
+            if not data:
+                break
+        process.stdout.close()
+        process.wait()
+        return ''.join(chunks), stopped
+
+
     def get_local_repo_path(self, chapter_name):
         return os.path.abspath(os.path.join(
             os.path.dirname(__file__),
@@ -141,51 +193,110 @@ class SourceTree(object):
         ))
 
 
-    def start_with_checkout(self, chapter, previous_chapter):
+    def start_with_checkout(self, chapter, previous_chapter, prepare=None):
+        repo_path = self.get_local_repo_path(chapter)
+        snapshot_key = None
+        if self.snapshots is not None:
+            snapshot_key = get_snapshot_key(
+                repo_path, chapter, previous_chapter, prepare, self.share_objects
+            )
+        if snapshot_key is not None:
+            commit_refs = self.snapshots.restore(snapshot_key, self.tempdir)
+            if commit_refs is not None:
+                print('starting with snapshot', snapshot_key)
+                self.chapter = chapter
+                self.commit_refs = commit_refs
+                return
+
         print('starting with checkout')
         self.run_command('git init .')
-        self.run_command('git remote add repo "{}"'.format(
-            self.get_local_repo_path(chapter)
-        ))
+        if self.share_objects:
+            self.borrow_objects(repo_path)
+        self.run_command('git remote add repo "{}"'.format(repo_path))
         self.run_command('git fetch repo')
         self.run_command('git reset --hard repo/{}'.format(previous_chapter))
         print(self.run_command('git status'))
         self.chapter = chapter
+        self.commit_refs = self.read_commit_refs(chapter)
+        if prepare:
+            self.run_command(prepare)
+        if snapshot_key is not None:
+            self.snapshots.save(snapshot_key, self.tempdir, self.commit_refs)
+
+
+    def borrow_objects(self, repo_path):
+        # with the repo's object database as an alternate, `git fetch` finds
+        # it already has every object, and only has to copy the refs
+        try:
+            objects_path = subprocess.check_output(
+                ['git', 'rev-parse', '--git-path', 'objects'],
+                cwd=repo_path, universal_newlines=True, stderr=subprocess.DEVNULL,
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return
+        info_path = os.path.join(self.tempdir, '.git', 'objects', 'info')
+        os.makedirs(info_path, exist_ok=True)
+        with open(os.path.join(info_path, 'alternates'), 'w') as f:
+            f.write(os.path.join(repo_path, objects_path) + '\n')
+
+
+    def read_commit_refs(self, chapter):
+        # one pass over the chapter's history, rather than one per listing
+        try:
+            return read_commit_refs(self.tempdir, 'repo/{}'.format(chapter))
+        except subprocess.CalledProcessError:
+            return {}
 
 
     def get_commit_spec(self, commit_ref):
+        if commit_ref in self.commit_refs:
+            return self.commit_refs[commit_ref][0]
         return 'repo/{chapter}^{{/--{commit_ref}--}}'.format(chapter=self.chapter, commit_ref=commit_ref)
 
 
+    def show_commit(self, commit_spec):
+        # the commit's message and diff, as `git show -M` gives them
+        sha = self.git_objects.resolve(commit_spec)
+        if sha is None:
+            # for git's own error message
+            return self.run_command('git show -M {}'.format(commit_spec))
+        if sha not in self.commit_diffs:
+            self.commit_diffs[sha] = self.git_diffs.show(sha)
+        return self.commit_diffs[sha]
+
+
     def get_files_from_commit_spec(self, commit_spec):
-        return self.run_command(
-            'git diff-tree --no-commit-id --name-only --find-renames -r {}'.format(
-                commit_spec
-            )
-        ).split()
+        return get_files_from_diff(self.show_commit(commit_spec))
 
 
     def show_future_version(self, commit_spec, path):
-        return self.run_command('git show {}:{}'.format(commit_spec, path), silent=True)
+        contents = self.git_objects.show('{}:{}'.format(commit_spec, path))
+        if contents is None:
+            raise Exception('{} is not in {}'.format(path, commit_spec))
+        return contents
+
+
+    def apply_diff(self, diff):
+        # as `patch -p1 --fuzz=3` would
+        result = apply_diff(diff, self.tempdir)
+        print(result)
+        if not result.ok:
+            raise Exception('patch failed:\n{}'.format(result))
 
 
     def patch_from_commit(self, commit_ref, path=None):
-        commit_spec = self.get_commit_spec(commit_ref)
-        self.run_command(
-            #'git diff {commit}^ {commit} | patch'.format(commit=commit_spec)
-            'git show -M {commit} | patch -p1 --fuzz=3 --no-backup-if-mismatch'.format(commit=commit_spec)
-        )
-        #self.run_command('git reset')
+        self.apply_diff(self.show_commit(self.get_commit_spec(commit_ref)))
 
 
     def apply_listing_from_commit(self, listing):
         commit_spec = self.get_commit_spec(listing.commit_ref)
-        commit_info = self.run_command('git show %s' % (commit_spec,))
+        commit_spec = self.git_objects.resolve(commit_spec) or commit_spec
+        commit_info = self.show_commit(commit_spec)
         print('Applying listing from commit.\nListing:\n' + listing.contents)
 
         commit = Commit.from_diff(commit_info)
 
-        files = self.get_files_from_commit_spec(commit_spec)
+        files = get_files_from_diff(commit_info)
         if files != [listing.filename]:
             raise ApplyCommitException(
                 'wrong files in listing: {0} should have been {1}'.format(
@@ -196,7 +307,7 @@ class SourceTree(object):
 
         check_listing_matches_commit(listing, commit, future_contents)
 
-        self.patch_from_commit(listing.commit_ref, listing.filename)
+        self.apply_diff(commit_info)
         listing.was_written = True
         print('applied commit.')
 
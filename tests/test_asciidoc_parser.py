@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from textwrap import dedent
+
+from lxml import html
+
+from asciidoc_parser import (
+    BASE_DIR,
+    apply_subs,
+    compare_with_html,
+    parse_asciidoc,
+    sub_callouts,
+    sub_quotes,
+)
+from book_parser import CodeListing, Command, Output, listing_to_dict, parse_listing
+import examples
+
+
+def parse_example(example_html):
+    return parse_listing(html.fromstring(example_html))
+
+
+
+class SameAsHtmlTest(unittest.TestCase):
+
+    def assert_same_listings(self, asciidoc, example_html):
+        self.assertEqual(
+            [listing_to_dict(l) for l in parse_asciidoc(asciidoc)],
+            [listing_to_dict(l) for l in parse_example(example_html)],
+        )
+
+
+    def test_code_listing_in_sourcecode_exampleblock(self):
+        self.assert_same_listings(dedent(
+            """
+            [role="sourcecode"]
+            .functional_tests.py
+            ====
+            [source,python]
+            ----
+            from selenium import webdriver
+
+            browser = webdriver.Firefox()
+            browser.get('http://localhost:8000')
+
+            assert 'Django' in browser.title
+            ----
+            ====
+            """),
+            examples.CODE_LISTING_WITH_CAPTION,
+        )
+
+
+    def test_commands_with_dofirst(self):
+        self.assert_same_listings(dedent(
+            """
+            [role="dofirst-ch09l058"]
+            [subs="specialcharacters,quotes"]
+            ----
+            $ *grep -r id_new_item lists/*
+
+            lists/static/base.css:#id_new_item {
+            lists/templates/list.html:        <input name="item_text" id="id_new_item"
+            placeholder="Enter a to-do item" />
+            ----
+            """),
+            examples.OUTPUTS_WITH_DOFIRST,
+        )
+
+
+    def test_server_commands(self):
+        self.assert_same_listings(dedent(
+            """
+            [role="server-commands"]
+            [subs="specialcharacters,quotes"]
+            ----
+            elspeth@server:$ *sudo do stuff*
+            ----
+            """),
+            examples.SERVER_COMMAND,
+        )
+
+
+    def test_qunit_output(self):
+        self.assert_same_listings(dedent(
+            """
+            [role="qunit-output"]
+            ----
+            2 assertions of 2 passed, 0 failed.
+            1. smoke test (2)
+            ----
+            """),
+            examples.OUTPUT_QUNIT,
+        )
+
+
+    def test_commands_in_pass_macros(self):
+        self.assert_same_listings(dedent(
+            """
+            [subs="specialcharacters,macros"]
+            ----
+            $ pass:quotes[*source ../virtualenv/bin/activate*]
+            (virtualenv)$ pass:quotes[*python manage.py test lists*]
+            [...]
+            ImportError: No module named django
+            ----
+            """),
+            examples.COMMANDS_WITH_VIRTUALENV,
+        )
+
+
+    def test_raw_html_with_empty_subs(self):
+        self.assert_same_listings(dedent(
+            """
+            [subs=""]
+            ----
+            $ <strong>grep id_new_item functional_tests/tests/test*</strong>
+            ----
+            """),
+            examples.COMMAND_MADE_WITH_ATS,
+        )
+
+
+    def test_skipme_and_currentcontents(self):
+        [skipped, current] = parse_asciidoc(dedent(
+            """
+            [role="sourcecode skipme"]
+            .lists/functional_tests/test_list_item_validation.py
+            ====
+            [source,python]
+            ----
+                def DONTtest_cannot_add_empty_list_items(self):
+            ----
+            ====
+
+            [role="sourcecode currentcontents"]
+            .superlists/urls.py
+            ====
+            [source,python]
+            ----
+            urlpatterns = []
+            ----
+            ====
+            """
+        ))
+        self.assertEqual(type(skipped), CodeListing)
+        self.assertTrue(skipped.skip)
+        self.assertEqual(current.type, 'code listing currentcontents')
+        self.assertEqual(current.filename, 'superlists/urls.py')
+
+
+    def test_git_ref_and_against_server(self):
+        [listing, command] = parse_asciidoc(dedent(
+            """
+            [role="sourcecode"]
+            .functional_tests/tests.py (ch06l001)
+            ====
+            [source,python]
+            ----
+            import time
+            ----
+            ====
+
+            [role="against-server small-code"]
+            [subs="specialcharacters,quotes"]
+            ----
+            $ *STAGING_SERVER=superlists-staging.ottg.eu python manage.py test functional_tests*
+            ----
+            """
+        ))
+        self.assertEqual(listing.commit_ref, 'ch06l001')
+        self.assertEqual(type(command), Command)
+        self.assertEqual(command.type, 'against staging')
+        self.assertTrue(command.against_server)
+
+
+    def test_ignores_comments_literals_and_section_underlines(self):
+        listings = parse_asciidoc(dedent(
+            """
+            A Section
+            ---------
+
+            ////
+            ----
+            $ *commented out*
+            ----
+            ////
+
+            // ----
+
+            ....
+            just a literal block
+            ....
+
+            ----
+            an output
+            ----
+            """
+        ))
+        self.assertEqual(listings, ['an output'])
+        self.assertEqual(type(listings[0]), Output)
+
+
+    def test_long_delimiters_only_closed_by_the_same_line(self):
+        [output] = parse_asciidoc(dedent(
+            """
+            ------
+            Ran 1 test
+            ----
+            OK
+            ------
+            """
+        ))
+        self.assertEqual(output, 'Ran 1 test\n----\nOK')
+
+
+
+class SubstitutionsTest(unittest.TestCase):
+
+    def test_callouts(self):
+        self.assertEqual(
+            sub_callouts('foo  #<1>'),
+            'foo  <i class="conum" data-value="1"></i><b>(1)</b>',
+        )
+        self.assertEqual(
+            sub_callouts('foo  //&lt;2&gt; &lt;3&gt;'),
+            'foo  <i class="conum" data-value="2"></i><b>(2)</b> '
+            '<i class="conum" data-value="3"></i><b>(3)</b>',
+        )
+        self.assertEqual(sub_callouts('foo <1> bar'), 'foo <1> bar')
+        self.assertEqual(sub_callouts('foo \\<1>'), 'foo <1>')
+
+
+    def test_quotes(self):
+        self.assertEqual(sub_quotes('$ *ls*'), '$ <strong>ls</strong>')
+        self.assertEqual(sub_quotes('a**b**c'), 'a<strong>b</strong>c')
+        self.assertEqual(sub_quotes('not*bold*'), 'not*bold*')
+        self.assertEqual(sub_quotes('test_my_lists_thing'), 'test_my_lists_thing')
+        self.assertEqual(sub_quotes('an _emphasised_ word'), 'an <em>emphasised</em> word')
+        self.assertEqual(sub_quotes('\\*not bold*'), '*not bold*')
+
+
+    def test_specialcharacters_before_quotes(self):
+        self.assertEqual(
+            apply_subs('$ *echo "<b>" > x*', ['specialcharacters', 'quotes']),
+            '$ <strong>echo "&lt;b&gt;" &gt; x</strong>',
+        )
+
+
+    def test_passthroughs(self):
+        self.assertEqual(
+            apply_subs('$ pass:quotes[*ls*] <x>', ['specialcharacters', 'macros']),
+            '$ <strong>ls</strong> &lt;x&gt;',
+        )
+        self.assertEqual(
+            apply_subs('pass:[<b>raw</b>]', ['specialcharacters', 'macros']),
+            '<b>raw</b>',
+        )
+
+
+
+CHAPTERS = [
+    f.replace('.asciidoc', '')
+    for f in json.load(open(os.path.join(BASE_DIR, 'atlas.json')))['files']
+    if f.endswith('.asciidoc')
+]
+
+
+class DifferentialTest(unittest.TestCase):
+    """
+    checks the asciidoc path against the html one for every chapter
+    that has been built
+    """
+
+    def test_compare_with_html_reports_differences(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        with open(os.path.join(tempdir, 'chapter_x.html'), 'w') as f:
+            f.write('<html><body><div>' + examples.SERVER_COMMAND + '</div></body></html>')
+        with open(os.path.join(tempdir, 'chapter_x.asciidoc'), 'w') as f:
+            f.write('[role="server-commands"]\n----\nelspeth@server:$ *sudo do stuff*\n----\n')
+
+        with patch('asciidoc_parser.BASE_DIR', tempdir):
+            [(pos, from_html, from_asciidoc)] = compare_with_html('chapter_x')
+        # no quotes subs by default, so the command isn't bold
+        self.assertEqual(pos, 0)
+        self.assertEqual(from_html['class'], 'Command')
+        self.assertEqual(from_asciidoc['class'], 'Output')
+
+
+    def test_compare_with_html_uses_listings_already_read(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        with open(os.path.join(tempdir, 'chapter_x.asciidoc'), 'w') as f:
+            f.write('[role="server-commands"]\n----\nelspeth@server:$ *sudo do stuff*\n----\n')
+        html_listings = parse_example(examples.SERVER_COMMAND)
+
+        with patch('asciidoc_parser.BASE_DIR', tempdir), \
+                patch('asciidoc_parser.parse_html_listings') as mock_parse_html:
+            [(pos, from_html, _)] = compare_with_html('chapter_x', html_listings)
+        self.assertFalse(mock_parse_html.called)
+        self.assertEqual(from_html['class'], 'Command')
+
+
+    def test_same_listings_as_html_for_every_built_chapter(self):
+        built = [
+            c for c in CHAPTERS
+            if os.path.exists(os.path.join(BASE_DIR, c + '.html'))
+        ]
+        if not built:
+            self.skipTest('no chapters have been built')
+        for chapter_name in built:
+            with self.subTest(chapter=chapter_name):
+                self.assertEqual(compare_with_html(chapter_name), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from book_listings import (
+    get_available_source,
+    get_chapter_names,
+    read_book_listings,
+    read_chapter_listings,
+)
+from book_parser import listing_to_dict
+from chapter_fixtures import make_synthetic_chapter
+
+
+CHAPTERS = {
+    'chapter_a': 3,
+    'chapter_b': 0,
+    'chapter_c': 10,
+}
+
+
+class ReadBookListingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        with open(os.path.join(self.base_dir, 'atlas.json'), 'w') as f:
+            json.dump({'files': ['cover.html'] + [c + '.asciidoc' for c in CHAPTERS]}, f)
+        for chapter_name, number_of_listings in CHAPTERS.items():
+            with open(os.path.join(self.base_dir, chapter_name + '.html'), 'w') as f:
+                f.write(make_synthetic_chapter(number_of_listings))
+        for patcher in [
+            patch('book_listings.BASE_DIR', self.base_dir),
+            patch('listings_cache.USE_LISTINGS_CACHE', False),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def test_chapter_names_from_atlas(self):
+        self.assertEqual(get_chapter_names(), list(CHAPTERS))
+
+
+    def test_available_source(self):
+        self.assertEqual(get_available_source('chapter_a'), 'html')
+        self.assertEqual(get_available_source('chapter_z'), 'asciidoc')
+
+
+    def test_same_listings_as_reading_each_chapter(self):
+        book = read_book_listings(processes=2)
+        self.assertEqual(book.chapter_names, list(CHAPTERS))
+        for chapter_name in CHAPTERS:
+            self.assertEqual(
+                [listing_to_dict(l) for l in book.chapter(chapter_name)],
+                [listing_to_dict(l) for l in read_chapter_listings(chapter_name)],
+            )
+        self.assertEqual(len(book), sum(len(book.chapter(c)) for c in CHAPTERS))
+        self.assertEqual(
+            [chapter_name for chapter_name, _ in book],
+            [book.chapter_of(pos) for pos in range(len(book))],
+        )
+        self.assertEqual(book.chapter('chapter_b'), [])
+
+
+    def test_only_some_chapters(self):
+        book = read_book_listings(['chapter_c'], source='stream', processes=1)
+        self.assertEqual(book.chapter_names, ['chapter_c'])
+        with self.assertRaises(IndexError):
+            book.chapter_of(len(book))
+
+
+    def test_picklable(self):
+        book = read_book_listings(processes=2)
+        book.table[0].skip = True
+        unpickled = pickle.loads(pickle.dumps(book))
+        self.assertEqual(unpickled.chapter_ranges, book.chapter_ranges)
+        self.assertEqual(
+            [listing_to_dict(l) for _, l in unpickled],
+            [listing_to_dict(l) for _, l in book],
+        )
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 from lxml import html
+import os
 import re
+import tempfile
 from textwrap import dedent
 import unittest
 
@@ -10,9 +12,13 @@ from book_parser import (
     Command,
     Output,
     get_commands,
+    get_listing_nodes,
+    iter_listings,
+    listing_to_dict,
     parse_listing,
     _strip_callouts,
 )
+from chapter_fixtures import get_listing_nodes_with_cssselect, make_synthetic_chapter
 import examples
 
 
@@ -418,6 +424,127 @@ class ParseCodeListingTest(unittest.TestCase):
 
 
 
+class GetListingNodesTest(unittest.TestCase):
+
+    def test_finds_exampleblocks_and_listingblocks_in_document_order(self):
+        parsed_html = html.fromstring(
+            '<html><body><div id="content">' +
+            examples.CODE_LISTING_WITH_CAPTION +
+            examples.COMMANDS_WITH_VIRTUALENV +
+            examples.CODE_LISTING_WITH_SKIPME +
+            '</div></body></html>'
+        )
+        nodes = get_listing_nodes(parsed_html)
+        self.assertEqual(
+            [n.get('class') for n in nodes],
+            ['exampleblock sourcecode', 'listingblock', 'listingblock sourcecode skipme'],
+        )
+
+
+    def test_drops_listingblock_nested_in_previous_node(self):
+        parsed_html = html.fromstring(
+            '<html><body><div>' + examples.CODE_LISTING_WITH_CAPTION + '</div></body></html>'
+        )
+        all_listingblocks = parsed_html.cssselect('div.listingblock')
+        self.assertEqual(len(all_listingblocks), 1)
+        nodes = get_listing_nodes(parsed_html)
+        self.assertEqual([n.get('class') for n in nodes], ['exampleblock sourcecode'])
+
+
+    def test_ignores_listingblocks_directly_under_sourcecode_divs(self):
+        parsed_html = html.fromstring(
+            '<html><body><div class="sourcecode">'
+            '<div class="listingblock"><div class="content"><pre>foo</pre></div></div>'
+            '</div></body></html>'
+        )
+        self.assertEqual(get_listing_nodes(parsed_html), [])
+
+
+    def test_matches_cssselect_implementation_on_synthetic_chapter(self):
+        parsed_html = html.fromstring(make_synthetic_chapter(400))
+        self.assertEqual(
+            get_listing_nodes(parsed_html),
+            get_listing_nodes_with_cssselect(parsed_html),
+        )
+
+
+    def test_same_nodes_as_cssselect_with_thousands_of_listings(self):
+        # how long each takes is for `benchmarks.py listing_selection`
+        parsed_html = html.fromstring(make_synthetic_chapter(3000))
+        new_nodes = get_listing_nodes(parsed_html)
+        self.assertEqual(len(new_nodes), 3000)
+        self.assertEqual(new_nodes, get_listing_nodes_with_cssselect(parsed_html))
+
+
+
+class IterListingsTest(unittest.TestCase):
+
+    def write_chapter(self, raw_html):
+        fd, path = tempfile.mkstemp(suffix='.html')
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(raw_html)
+        self.addCleanup(os.remove, path)
+        return path
+
+
+    def assert_same_as_parsing_whole_file(self, raw_html, chunk_size):
+        path = self.write_chapter(raw_html)
+        expected = [
+            p for n in get_listing_nodes(html.fromstring(raw_html))
+            for p in parse_listing(n)
+        ]
+        streamed = list(iter_listings(path, chunk_size=chunk_size))
+        self.assertEqual(
+            [listing_to_dict(l) for l in streamed],
+            [listing_to_dict(l) for l in expected],
+        )
+        self.assertEqual([type(l) for l in streamed], [type(l) for l in expected])
+        return streamed
+
+
+    def test_same_listings_as_parsing_whole_file(self):
+        self.assert_same_as_parsing_whole_file(make_synthetic_chapter(40), 64 * 1024)
+
+
+    def test_same_listings_with_tiny_chunks(self):
+        listings = self.assert_same_as_parsing_whole_file(make_synthetic_chapter(8), 7)
+        self.assertEqual(type(listings[0]), CodeListing)
+        self.assertEqual(listings[0].filename, 'functional_tests.py')
+
+
+    def test_keeps_flags(self):
+        raw_html = (
+            '<html><body><div id="content">' +
+            examples.OUTPUTS_WITH_DOFIRST +
+            examples.CODE_LISTING_WITH_SKIPME +
+            examples.SERVER_COMMAND +
+            examples.OUTPUT_QUNIT +
+            '</div></body></html>'
+        )
+        listings = self.assert_same_as_parsing_whole_file(raw_html, 100)
+        self.assertEqual(listings[0].dofirst, 'ch09l058')
+        self.assertTrue(listings[2].skip)
+        self.assertEqual(listings[3].type, 'server command')
+        self.assertEqual(listings[4].type, 'qunit output')
+
+
+    def test_nested_listings_come_out_in_document_order(self):
+        raw_html = (
+            '<html><body><div>'
+            '<div class="exampleblock sourcecode">'
+            '<div class="title">outer.py</div>'
+            '<div class="content">'
+            '<div class="listingblock"><div class="content"><pre>$ <strong>first</strong></pre></div></div>'
+            '<div class="listingblock"><div class="content"><pre>$ <strong>second</strong></pre></div></div>'
+            '</div></div>'
+            '</div></body></html>'
+        )
+        listings = self.assert_same_as_parsing_whole_file(raw_html, 50)
+        self.assertEqual(type(listings[0]), CodeListing)
+        self.assertEqual(listings[1], 'second')
+
+
+
 class GetCommandsTest(unittest.TestCase):
 
     def test_extracting_one_command(self):
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import unittest
+
+from lxml import html
+
+import book_selectors
+import examples
+
+
+PAGE = """
+<html>
+<head><title>a chapter</title></head>
+<body id="chapter_01">
+<div id="header"><h1>Chapter 1</h1><div id="toc"></div></div>
+<div id="content">
+<h2 id="_section">A section</h2>
+<h3 id="_sub">A subsection</h3>
+<p><a href="#_section">internal</a> <a href="http://example.com">external</a></p>
+{}
+</div>
+</body>
+</html>
+""".format(examples.CODE_LISTING_WITH_CAPTION + examples.OUTPUT_WITH_COMMANDS_INLINE)
+
+EXPRESSIONS = {
+    'TITLE': '.title',
+    'CONTENT': '.content',
+    'DIV_CONTENT': 'div.content',
+    'COMMANDS': 'pre strong',
+    'CODE_COMMANDS': 'pre code strong',
+}
+
+
+class SelectorsTest(unittest.TestCase):
+
+    def test_same_elements_as_cssselect(self):
+        parsed = html.fromstring(PAGE)
+        for name, expression in EXPRESSIONS.items():
+            with self.subTest(selector=name):
+                found = getattr(book_selectors, name)(parsed)
+                self.assertTrue(found)
+                self.assertEqual(found, parsed.cssselect(expression))
+
+
+    def test_listing_nodes_same_as_css_version(self):
+        parsed = html.fromstring(PAGE)
+        self.assertEqual(
+            book_selectors.LISTING_NODES(parsed),
+            parsed.cssselect('.exampleblock.sourcecode, div:not(.sourcecode) div.listingblock'),
+        )
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from book_listings import read_chapter_listings
+from book_parser import Output, listing_to_dict
+from book_state import (
+    BookState,
+    check_asciidoc_matches_html,
+    check_chapters,
+    get_chapter_hash,
+    read_book_listings_incrementally,
+)
+from chapter_fixtures import make_synthetic_chapter
+
+CHAPTERS = ['chapter_a', 'chapter_b']
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        for i, chapter_name in enumerate(CHAPTERS):
+            self.write_chapter(chapter_name, make_synthetic_chapter(3 + i))
+        for patcher in [
+            patch('book_listings.BASE_DIR', self.base_dir),
+            patch('book_state.BASE_DIR', self.base_dir),
+            patch('listings_cache.CACHE_DIR', os.path.join(self.base_dir, 'cache')),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def write_chapter(self, chapter_name, raw_html):
+        with open(os.path.join(self.base_dir, chapter_name + '.html'), 'w') as f:
+            f.write(raw_html)
+
+
+    def test_hash_changes_with_source(self):
+        old_hash = get_chapter_hash('chapter_a')
+        self.assertEqual(get_chapter_hash('chapter_a'), old_hash)
+        self.write_chapter('chapter_a', make_synthetic_chapter(4))
+        self.assertNotEqual(get_chapter_hash('chapter_a'), old_hash)
+        with patch('listings_cache.get_parser_version', return_value='new parser'):
+            self.assertNotEqual(get_chapter_hash('chapter_b'), old_hash)
+
+
+    def test_only_changed_chapters_are_parsed(self):
+        first, changed = read_book_listings_incrementally(CHAPTERS)
+        self.assertEqual(changed, CHAPTERS)
+
+        again, changed = read_book_listings_incrementally(CHAPTERS)
+        self.assertEqual(changed, [])
+        self.assertEqual(
+            [listing_to_dict(l) for _, l in again],
+            [listing_to_dict(l) for _, l in first],
+        )
+
+        self.write_chapter('chapter_b', make_synthetic_chapter(1))
+        book, changed = read_book_listings_incrementally(CHAPTERS)
+        self.assertEqual(changed, ['chapter_b'])
+        self.assertEqual(len(book.chapter('chapter_a')), len(first.chapter('chapter_a')))
+        self.assertEqual(len(book.chapter('chapter_b')), 1)
+
+
+    def test_check_results_reused_until_chapter_changes(self):
+        def counts():
+            return {c: len(read_chapter_listings(c)) for c in CHAPTERS}
+        check = Mock(side_effect=lambda chapter_name, listings: len(listings))
+        self.assertEqual(check_chapters('count', check, CHAPTERS), counts())
+        self.assertEqual(check.call_count, 2)
+
+        self.assertEqual(check_chapters('count', check, CHAPTERS), counts())
+        self.assertEqual(check.call_count, 2)
+
+        self.write_chapter('chapter_a', make_synthetic_chapter(5))
+        self.assertEqual(check_chapters('count', check, CHAPTERS), counts())
+        self.assertEqual(check.call_count, 3)
+        self.assertEqual(check.call_args[0][0], 'chapter_a')
+
+
+    def test_asciidoc_check_ignores_normalised_text_on_cached_outputs(self):
+        with open(os.path.join(self.base_dir, 'chapter_a.asciidoc'), 'w') as f:
+            f.write(
+                '[subs="specialcharacters,quotes"]\n----\n'
+                '$ *python manage.py test*\nRan 1 test in 0.001s\n----\n'
+            )
+        self.write_chapter('chapter_a', (
+            '<html><body><div id="content"><div class="sect1">\n'
+            '<div class="listingblock">\n<div class="content">\n'
+            '<pre>$ <strong>python manage.py test</strong>\nRan 1 test in 0.001s</pre>\n'
+            '</div>\n</div>\n</div></div></body></html>'
+        ))
+        with patch('asciidoc_parser.BASE_DIR', self.base_dir):
+            results = check_chapters(
+                'asciidoc_matches_html', check_asciidoc_matches_html, ['chapter_a']
+            )
+        self.assertEqual(results, {'chapter_a': []})
+        [output] = [l for l in read_chapter_listings('chapter_a') if isinstance(l, Output)]
+        self.assertEqual(output.normalised, 'Ran 1 tests in X.Xs')
+
+
+    def test_corrupt_state_starts_again(self):
+        os.makedirs(os.path.join(self.base_dir, 'cache'))
+        with open(BookState.get_path(), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(BookState.load().chapters, {})
+        _, changed = read_book_listings_incrementally(CHAPTERS)
+        self.assertEqual(changed, CHAPTERS)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from textwrap import dedent
 from book_tester import (
     ChapterTest,
     PHANTOMJS_RUNNER,
+    RULES,
     contains,
     wrap_long_lines,
     split_blocks,
@@ -121,11 +122,30 @@ class RunCommandTest(ChapterTest):
         output = self.run_command(cmd, cwd='bar', user_input='thing')
         assert output == self.sourcetree.run_command.return_value
         self.sourcetree.run_command.assert_called_with(
-            'foo', cwd='bar', user_input='thing', ignore_errors=False,
+            'foo', cwd='bar', user_input='thing', ignore_errors=False, watch=None,
         )
         assert cmd.was_run
 
 
+    def test_run_test_command_fails_early_on_wrong_progress_when_streaming(self):
+        self.stream_output_checks = True
+        cmd = Command('echo -n .; sleep 0.2; echo -n F; sleep 10; echo test')
+        with self.assertRaises(AssertionError) as cm:
+            self.run_test_command(cmd, Output('..\n\nOK'))
+        self.assertIn("expected the tests to go '..', but they went '.F'", str(cm.exception))
+        self.assertIn('output so far:\n.F', str(cm.exception))
+        assert cmd.was_run
+
+
+    def test_run_test_command_without_streaming_just_runs_it(self):
+        self.sourcetree.run_command = Mock()
+        output = self.run_test_command(Command('foo'), Output('F'), ignore_errors=True)
+        assert output == self.sourcetree.run_command.return_value
+        self.sourcetree.run_command.assert_called_with(
+            'foo', cwd=None, user_input=None, ignore_errors=True, watch=None,
+        )
+
+
     def test_raises_if_not_command(self):
         with self.assertRaises(AssertionError):
             self.run_command('foo')
@@ -278,6 +298,30 @@ class GetListingsTest(ChapterTest):
 
 
 
+class CheckCommitRefsTest(ChapterTest):
+    chapter_name = 'chapter_x'
+
+    def test_passes_when_checkout_has_every_ref(self):
+        self.sourcetree.commit_refs = {'ch01l001': ['abc123']}
+        listing = CodeListing(filename='a.py', contents='a')
+        listing.commit_ref = 'ch01l001'
+        self.listings = [listing, Command('ls')]
+        self.check_commit_refs()
+
+
+    def test_raises_for_refs_missing_from_checkout(self):
+        self.sourcetree.commit_refs = {'ch01l001': ['abc123']}
+        listing = CodeListing(filename='a.py', contents='a')
+        listing.commit_ref = 'ch01l002'
+        self.listings = [listing]
+        with self.assertRaises(Exception) as cm:
+            self.check_commit_refs()
+        self.assertIn('ch01l002', str(cm.exception))
+        self.assertIn('chapter_x', str(cm.exception))
+
+
+
+
 class AssertConsoleOutputCorrectTest(ChapterTest):
 
     def test_simple_case(self):
@@ -306,6 +350,35 @@ class AssertConsoleOutputCorrectTest(ChapterTest):
         self.assertTrue(expected.was_checked)
 
 
+    def test_normalises_each_expected_output_once(self):
+        expected = Output('Ran 1 test in 1.456s  <1>')
+        with patch('book_tester.RULES.normalise', wraps=RULES.normalise) as mock_normalise:
+            self.assert_console_output_correct('Ran 1 test in 1.343s', expected)
+            self.assert_console_output_correct('Ran 1 test in 0.002s', expected)
+        self.assertEqual(
+            [c[0][0] for c in mock_normalise.call_args_list],
+            ['actual', 'expected', 'actual'],
+        )
+        self.assertEqual(expected.normalised, 'Ran 1 tests in X.Xs')
+
+
+    def test_whole_output_trailing_whitespace_on_a_line_counts(self):
+        actual = 'one\ntwo\nthree\nfour\nfive'
+        expected = Output('one\ntwo\nthree\nfour\nfive  ')
+        with self.assertRaises(AssertionError) as cm:
+            self.assert_console_output_correct(actual, expected)
+        self.assertIn("'five  '", str(cm.exception))
+
+
+    def test_whole_output_first_line_indentation_counts(self):
+        actual = 'one\ntwo\nthree\nfour\nfive'
+        expected = Output('  one\ntwo\nthree\nfour\nfive')
+        with self.assertRaises(AssertionError) as cm:
+            self.assert_console_output_correct(actual, expected)
+        self.assertIn("'  one'", str(cm.exception))
+        self.assert_console_output_correct('  one\ntwo\nthree\nfour\nfive', expected)
+
+
     def test_handles_elipsis(self):
         actual = dedent("""
             bla
@@ -475,6 +548,17 @@ class AssertConsoleOutputCorrectTest(ChapterTest):
         self.assertTrue(expected.was_checked)
 
 
+    def test_reports_first_difference_in_long_outputs(self):
+        actual = '\n'.join('line {}'.format(i) for i in range(5000))
+        expected = Output(actual.replace('line 4321', 'line 4322', 1))
+        with self.assertRaises(AssertionError) as cm:
+            self.assert_console_output_correct(actual, expected)
+        message = str(cm.exception)
+        self.assertIn("expected line 4322 is different:\n    'line 4322'", message)
+        self.assertIn(">  4322 'line 4321'", message)
+        self.assertLess(len(message), 500)
+
+
     def test_ls(self):
         expected = Output('superlists          functional_tests.py')
         actual = 'functional_tests.py\nsuperlists\n'
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkout_snapshots import CheckoutSnapshots, get_snapshot_key
+from git_fixtures import SourceRepoTestCase, commit_files, git
+from sourcetree import SourceTree
+
+
+
+class CheckoutSnapshotsTest(SourceRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        self.snapshots = CheckoutSnapshots(snapshot_dir)
+
+
+    def start(self):
+        sourcetree = SourceTree()
+        self.addCleanup(sourcetree.cleanup)
+        sourcetree.get_local_repo_path = lambda c: self.repo
+        sourcetree.snapshots = self.snapshots
+        self.commands = []
+        run_command = sourcetree.run_command
+        def logging_run_command(command, *args, **kwargs):
+            self.commands.append(command)
+            return run_command(command, *args, **kwargs)
+        sourcetree.run_command = logging_run_command
+        sourcetree.start_with_checkout('chapter_x', 'chapter_w', prepare='mkdir -p virtualenv/bin')
+        return sourcetree
+
+
+    def test_restored_checkout_is_the_same_as_a_fresh_one(self):
+        fresh = self.start()
+        restored = self.start()
+        for sourcetree in [fresh, restored]:
+            self.assertEqual(sourcetree.get_contents('file.txt'), 'line 1\n')
+            self.assertTrue(os.path.isdir(os.path.join(sourcetree.tempdir, 'virtualenv', 'bin')))
+            self.assertEqual(sourcetree.get_commit_spec('ch02l001'), self.first)
+            self.assertEqual(sourcetree.run_command('git status --porcelain'), '')
+            self.assertEqual(
+                sourcetree.run_command('git show repo/chapter_x:file.txt'), 'line 4\n'
+            )
+
+
+    def test_second_start_runs_nothing(self):
+        self.start()
+        self.assertIn('git fetch repo', self.commands)
+        self.start()
+        self.assertEqual(self.commands, [])
+
+
+    def test_moving_the_repo_makes_a_new_snapshot(self):
+        key = get_snapshot_key(self.repo, 'chapter_x', 'chapter_w')
+        self.assertEqual(key, get_snapshot_key(self.repo, 'chapter_x', 'chapter_w'))
+        self.assertNotEqual(key, get_snapshot_key(self.repo, 'chapter_x', 'chapter_v'))
+        self.start()
+        git(self.repo, 'checkout', '-q', 'chapter_w')
+        commit_files(self.repo, 'changed', {'file.txt': 'line 1 changed\n'})
+        self.assertNotEqual(key, get_snapshot_key(self.repo, 'chapter_x', 'chapter_w'))
+        self.assertEqual(self.start().get_contents('file.txt'), 'line 1 changed\n')
+        self.assertEqual(len(os.listdir(self.snapshots.snapshot_dir)), 2)
+
+
+    def test_keeps_only_the_most_recently_used_snapshots(self):
+        snapshots = CheckoutSnapshots(self.snapshots.snapshot_dir, max_snapshots=2)
+        snapshots.save('a', self.repo, {})
+        snapshots.save('b', self.repo, {})
+        os.utime(snapshots.get_path('a'), (1000, 1000))
+        os.utime(snapshots.get_path('b'), (2000, 2000))
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        self.assertEqual(snapshots.restore('a', target), {})
+        snapshots.save('c', self.repo, {})
+        self.assertEqual(sorted(os.listdir(snapshots.snapshot_dir)), ['a', 'c'])
+
+
+    def test_no_snapshot_without_a_repo(self):
+        self.assertIsNone(get_snapshot_key('/no/such/repo', 'chapter_x'))
+        self.assertIsNone(self.snapshots.restore('nope', tempfile.gettempdir()))
+
+
+if __name__ == '__main__':
+    unittest.main()
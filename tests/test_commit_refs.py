@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from book_listings import BookListings
+from book_parser import CodeListing
+from commit_refs import (
+    CommitRefIndex,
+    build_commit_ref_index,
+    read_commit_refs,
+)
+from git_fixtures import SourceRepoTestCase, git
+
+
+
+class CommitRefIndexTest(SourceRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        get_repo_path = patch('commit_refs.get_repo_path', lambda chapter_name: self.repo)
+        get_repo_path.start()
+        self.addCleanup(get_repo_path.stop)
+
+
+    def test_read_commit_refs(self):
+        self.assertEqual(read_commit_refs(self.repo, 'chapter_x'), {
+            'ch02l001': [self.first, self.old],
+            'ch02l002-1': [self.second],
+        })
+
+
+    def test_resolves_refs_to_same_commit_as_git(self):
+        index = CommitRefIndex()
+        index.add_chapter('chapter_x', ['ch02l001', 'ch02l002-1'])
+        for ref in ['ch02l001', 'ch02l002-1']:
+            self.assertEqual(
+                index.resolve('chapter_x', ref),
+                git(self.repo, 'rev-parse', 'chapter_x^{/--%s--}' % (ref,)),
+            )
+        self.assertIsNone(index.resolve('chapter_y', 'ch02l001'))
+
+
+    def test_reports_duplicate_and_dangling_refs(self):
+        index = CommitRefIndex()
+        index.add_chapter('chapter_x', ['ch02l002-1', 'ch02l002-1', 'ch02l001', 'ch02l004'])
+        self.assertEqual(index.dangling_refs('chapter_x'), ['ch02l004'])
+        self.assertEqual(index.problems['chapter_x'], [
+            'ch02l002-1 is used by more than one listing',
+            'ch02l001 is claimed by commits {}, {}'.format(self.first, self.old),
+            'ch02l004 has no commit in {}'.format(self.repo),
+        ])
+
+
+    def test_build_skips_chapters_without_a_repo(self):
+        book = BookListings()
+        book.add_chapter('chapter_x', [
+            CodeListing(filename='lists/tests.py (ch02l001)', contents='x'),
+            CodeListing(filename='lists/tests.py', contents='y'),
+        ])
+        with patch('commit_refs.read_book_listings_incrementally', return_value=(book, [])):
+            index = build_commit_ref_index(['chapter_x'])
+        self.assertEqual(index.listing_refs, {'chapter_x': ['ch02l001']})
+        self.assertEqual(index.resolve('chapter_x', 'ch02l001'), self.first)
+
+        empty_submodule = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty_submodule)
+        with patch('commit_refs.get_repo_path', return_value=empty_submodule):
+            self.assertEqual(build_commit_ref_index(['chapter_x']).shas, {})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import unittest
+
+from book_parser import CodeListing
+from git_fixtures import SourceRepoTestCase, commit_files, git
+from git_objects import GitDiffReader, GitObjectReader, get_files_from_diff
+from sourcetree import ApplyCommitException, SourceTree
+
+
+
+class GitObjectReaderTest(SourceRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reader = GitObjectReader(self.repo)
+        self.addCleanup(self.reader.close)
+
+
+    def test_resolves_specs_like_rev_parse(self):
+        for spec in ['HEAD', 'chapter_x^{/--ch02l001--}', self.first[:10], 'HEAD:file.txt']:
+            self.assertEqual(self.reader.resolve(spec), git(self.repo, 'rev-parse', spec))
+
+
+    def test_shows_blobs_like_git_show(self):
+        self.assertEqual(self.reader.show('chapter_x^{/--ch02l001--}:file.txt'), 'line 3\n')
+        self.assertEqual(self.reader.show(self.second + ':file.txt'), 'line 4\n')
+
+
+    def test_missing_objects_are_none_and_dont_upset_later_reads(self):
+        self.assertIsNone(self.reader.read('HEAD:nope.txt'))
+        self.assertIsNone(self.reader.read('chapter_x^{/--ch09l999--}'))
+        self.assertIsNone(self.reader.show('HEAD'))
+        self.assertEqual(self.reader.resolve('HEAD'), self.second)
+
+
+    def test_one_git_process_for_many_reads(self):
+        for _ in range(50):
+            self.reader.show('HEAD:file.txt')
+        process = self.reader.process
+        self.reader.show('HEAD~1:file.txt')
+        self.assertIs(self.reader.process, process)
+        self.reader.close()
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(self.reader.show('HEAD:file.txt'), 'line 4\n')
+
+
+    def test_doesnt_start_git_until_needed(self):
+        reader = GitObjectReader('/no/such/dir')
+        reader.close()
+        self.assertIsNone(reader.process)
+
+
+
+class GitDiffReaderTest(SourceRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reader = GitDiffReader(self.repo)
+        self.addCleanup(self.reader.close)
+
+
+    def test_same_as_git_show_in_one_process(self):
+        commit_files(self.repo, 'moved', {'file.txt': None, 'moved.txt': 'line 4\n'})
+        commit_files(self.repo, 'nothing changed --ch02l003--', {})
+        commit_files(self.repo, 'unicode', {'caf\xe9.txt': 'caf\xe9\r\n-end--\n# end\n'})
+        shas = git(self.repo, 'rev-list', '--all').split('\n')
+        self.assertGreater(len(shas), 5)
+        for sha in shas:
+            self.assertEqual(self.reader.show(sha), git(self.repo, 'show', '-M', sha) + '\n')
+        process = self.reader.process
+        self.reader.show(shas[0])
+        self.assertIs(self.reader.process, process)
+
+
+
+class GetFilesFromDiffTest(SourceRepoTestCase):
+
+    def test_same_files_as_diff_tree(self):
+        repo = self.repo
+        commit_files(repo, 'start', {
+            'b/old.py': 'x = 1\n' * 20, 'gone.txt': 'bye\n', 'a.txt': 'a\n',
+        })
+        commit_files(repo, 'lots', {
+            'b/old.py': None, 'c/new.py': 'x = 1\n' * 19 + 'x = 2\n',
+            'gone.txt': None, 'a.txt': 'aa\n', 'z z.txt': 'spaces\n',
+        })
+        self.assertEqual(
+            get_files_from_diff(git(repo, 'show', '-M', 'HEAD')),
+            git(repo, 'diff-tree', '--no-commit-id', '--name-only', '--find-renames', '-r', 'HEAD').split('\n'),
+        )
+
+
+
+class ApplyListingFromCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sourcetree = SourceTree()
+        self.addCleanup(self.sourcetree.cleanup)
+        self.sourcetree.chapter = 'chapter_x'
+        repo = self.sourcetree.tempdir
+        git(repo, 'init', '-q')
+        git(repo, 'checkout', '-q', '-b', 'repo/chapter_x')
+        commit_files(repo, 'start', {'file.txt': 'line 1\nline 2\n'})
+        commit_files(repo, 'add a line --ch01l001--', {'file.txt': 'line 1\nline 2\nline 3\n'})
+        commit_files(repo, 'two files --ch01l002--', {'file.txt': 'line 0\n', 'other.txt': 'x\n'})
+        git(repo, 'checkout', '-q', 'HEAD~2')
+
+
+    def test_applies_listing_and_reuses_the_commits_diff(self):
+        listing = CodeListing(filename='file.txt', contents='line 2\nline 3\n')
+        listing.commit_ref = 'ch01l001'
+        self.sourcetree.apply_listing_from_commit(listing)
+        self.assertTrue(listing.was_written)
+        self.assertEqual(self.sourcetree.get_contents('file.txt'), 'line 1\nline 2\nline 3\n')
+        self.assertEqual(len(self.sourcetree.commit_diffs), 1)
+        self.assertEqual(self.sourcetree.get_files_from_commit_spec('repo/chapter_x^{/--ch01l001--}'), ['file.txt'])
+
+
+    def test_still_raises_for_wrong_files(self):
+        listing = CodeListing(filename='file.txt', contents='line 0\n')
+        listing.commit_ref = 'ch01l002'
+        with self.assertRaises(ApplyCommitException) as e:
+            self.sourcetree.apply_listing_from_commit(listing)
+        self.assertIn("should have been ['file.txt', 'other.txt']", str(e.exception))
+
+
+    def test_patch_from_commit(self):
+        self.sourcetree.patch_from_commit('ch01l001')
+        self.assertEqual(self.sourcetree.get_contents('file.txt'), 'line 1\nline 2\nline 3\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import unittest
+
+from lxml import html
+
+from book_parser import (
+    CodeListing,
+    Command,
+    Output,
+    get_listing_nodes,
+    listing_to_dict,
+    parse_listing,
+)
+from chapter_fixtures import make_synthetic_chapter
+from listing_table import ListingTable
+import examples
+
+
+def parse_chapter(raw_html):
+    nodes = get_listing_nodes(html.fromstring(raw_html))
+    return [p for n in nodes for p in parse_listing(n)]
+
+
+
+class ListingTableTest(unittest.TestCase):
+
+    def test_hands_out_the_same_listings(self):
+        listings = parse_chapter(make_synthetic_chapter(12))
+        listings[3].skip = True
+        table = ListingTable(listings)
+        self.assertEqual(len(table), len(listings))
+        for original, from_table in zip(listings, table):
+            self.assertEqual(type(from_table), type(original))
+            self.assertEqual(listing_to_dict(from_table), listing_to_dict(original))
+
+
+    def test_keeps_attributes_the_parser_added(self):
+        [listing] = parse_listing(html.fromstring(examples.CODE_LISTING_WITH_CAPTION))
+        listing.dofirst = 'ch01l001'
+        self.assertEqual(ListingTable([listing])[0].dofirst, 'ch01l001')
+        self.assertFalse(hasattr(ListingTable([Output('foo')])[0], 'was_run'))
+
+
+    def test_keeps_normalised_expected_outputs(self):
+        output = Output('foo  <1>')
+        output.normalised = 'foo'
+        table = ListingTable([output, Output('bar')])
+        self.assertEqual(table[0].normalised, 'foo')
+        self.assertFalse(hasattr(table[1], 'normalised'))
+
+
+    def test_changes_to_handed_out_listings_stick(self):
+        table = ListingTable([Command('ls'), Output('foo')])
+        table[0].was_run = True
+        self.assertTrue(table[0].was_run)
+        self.assertIs(table[0], table[0])
+        self.assertTrue(table.flag(0, 'was_run'))
+        self.assertFalse(table.flag(1, 'was_checked'))
+
+
+    def test_text_shared_between_kinds(self):
+        listing = CodeListing(filename='file.py', contents='print(1)')
+        table = ListingTable([Command('ls'), listing, Output('foo')])
+        self.assertEqual([table.text(i) for i in range(3)], ['ls', 'print(1)', 'foo'])
+        self.assertEqual(table.text(-1), 'foo')
+        with self.assertRaises(IndexError):
+            table.text(3)
+
+
+    def test_lookup_by_commit_ref_and_type(self):
+        table = ListingTable([
+            Command('git diff'),
+            CodeListing(filename='lists/tests.py (ch03l002)', contents='x'),
+            Output('foo'),
+            Command('python manage.py test'),
+        ])
+        self.assertEqual(table.position_of_commit_ref('ch03l002'), 1)
+        self.assertEqual(table.positions_of_type('test'), [3])
+        self.assertEqual(table.positions_of_type('git diff'), [0])
+        self.assertEqual(table.positions_by_kind[Command], [0, 3])
+        with self.assertRaises(KeyError):
+            table.position_of_commit_ref('ch03l003')
+
+
+    def test_replacing_a_listing_updates_indexes(self):
+        table = ListingTable([Command('git commit'), Output('foo')])
+        table[0] = Command('git commit -am "foo"')
+        self.assertEqual(table[0], 'git commit -am "foo"')
+        self.assertEqual(table.text(0), 'git commit -am "foo"')
+        self.assertEqual(table.positions_of_type('git commit'), [0])
+        table[1] = Command('ls')
+        self.assertEqual(table.positions_by_kind[Output], [])
+        self.assertEqual(table.positions_by_kind[Command], [0, 1])
+
+
+    def test_unfinished(self):
+        listings = [
+            Command('ls'),
+            Output('foo'),
+            CodeListing(filename='file.py', contents='x'),
+            Output('skipped'),
+        ]
+        listings[0].was_run = True
+        listings[3].skip = True
+        table = ListingTable(listings)
+        self.assertEqual(table.unfinished(), [1, 2])
+        table[2].was_written = True
+        self.assertEqual(table.unfinished(), [1])
+        self.assertEqual(table.unfinished(exceptions=[1]), [])
+        [output, code] = table[1:3]
+        self.assertEqual(output, 'foo')
+        self.assertEqual(code.contents, 'x')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
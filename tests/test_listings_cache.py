@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from lxml import html
+
+from book_parser import CodeListing, Command, Output, parse_listing
+import examples
+from listings_cache import (
+    get_cache_key,
+    get_cache_path,
+    load_cached_listings,
+    save_cached_listings,
+)
+
+
+RAW_HTML = examples.OUTPUTS_WITH_DOFIRST
+
+
+class ListingsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        patcher = patch('listings_cache.CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+
+    def test_cold_cache_returns_none(self):
+        assert load_cached_listings(RAW_HTML) is None
+
+
+    def test_roundtrips_listings_and_flags(self):
+        listings = parse_listing(html.fromstring(RAW_HTML))
+        listings[1].skip = True
+        save_cached_listings(RAW_HTML, listings)
+
+        cached = load_cached_listings(RAW_HTML)
+        self.assertEqual(cached, listings)
+        self.assertEqual(
+            [type(l) for l in cached],
+            [type(l) for l in listings],
+        )
+        self.assertEqual(cached[0].dofirst, 'ch09l058')
+        self.assertEqual(cached[0].type, 'other command')
+        self.assertTrue(cached[1].skip)
+        self.assertFalse(cached[0].was_run)
+
+
+    def test_roundtrips_code_listings(self):
+        code_html = examples.CODE_LISTING_WITH_CAPTION_AND_GIT_COMMIT_REF
+        listings = parse_listing(html.fromstring(code_html))
+        save_cached_listings(code_html, listings)
+
+        [cached] = load_cached_listings(code_html)
+        self.assertEqual(type(cached), CodeListing)
+        self.assertEqual(cached.filename, 'functional_tests/tests.py')
+        self.assertEqual(cached.commit_ref, 'ch06l001')
+        self.assertEqual(cached.contents, listings[0].contents)
+        self.assertEqual(cached.type, 'code listing with git ref')
+        self.assertFalse(cached.was_written)
+
+
+    def test_saves_outputs_with_their_normalised_text(self):
+        output = Output('Ran 1 test in 0.123s  <1>')
+        save_cached_listings(RAW_HTML, [Command('ls'), output])
+        self.assertEqual(output.normalised, 'Ran 1 tests in X.Xs')
+
+        [command, cached] = load_cached_listings(RAW_HTML)
+        self.assertEqual(cached.normalised, 'Ran 1 tests in X.Xs')
+        self.assertFalse(hasattr(command, 'normalised'))
+
+
+    def test_different_html_misses(self):
+        save_cached_listings(RAW_HTML, [Command('ls')])
+        assert load_cached_listings(RAW_HTML + ' ') is None
+
+
+    def test_parser_change_misses(self):
+        save_cached_listings(RAW_HTML, [Output('foo')])
+        with patch('listings_cache.get_parser_version') as mock_version:
+            mock_version.return_value = 'a new parser'
+            assert load_cached_listings(RAW_HTML) is None
+
+
+    def test_corrupt_cache_file_misses(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(get_cache_path(RAW_HTML), 'w') as f:
+            f.write('{not json')
+        assert load_cached_listings(RAW_HTML) is None
+
+
+    def test_can_be_disabled(self):
+        with patch('listings_cache.USE_LISTINGS_CACHE', False):
+            save_cached_listings(RAW_HTML, [Output('foo')])
+            assert load_cached_listings(RAW_HTML) is None
+        assert os.listdir(self.cache_dir) == []
+
+
+    def test_keeps_only_the_most_recently_used_chapters(self):
+        save_cached_listings('a', [Command('a')])
+        save_cached_listings('b', [Command('b')])
+        os.utime(get_cache_path('a'), (1000, 1000))
+        os.utime(get_cache_path('b'), (2000, 2000))
+        self.assertEqual(load_cached_listings('a'), ['a'])
+        with patch('listings_cache.MAX_CACHED_CHAPTERS', 2):
+            save_cached_listings('c', [Command('c')])
+        self.assertEqual(load_cached_listings('a'), ['a'])
+        assert load_cached_listings('b') is None
+        self.assertEqual(load_cached_listings('c'), ['c'])
+
+
+    def test_cache_key_is_stable(self):
+        assert get_cache_key(RAW_HTML) == get_cache_key(RAW_HTML)
+        assert get_cache_key(RAW_HTML) != get_cache_key('other')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from lxml import html
+
+from book_listings import read_chapter_listings
+from book_parser import Command, listing_to_dict, parse_listing
+from listings_manifest import (
+    StaleManifestException,
+    get_manifest_path,
+    read_listings_manifest,
+    write_listings_manifest,
+)
+import examples
+
+
+class ListingsManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        patcher = patch('listings_manifest.BASE_DIR', self.base_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.listings = (
+            parse_listing(html.fromstring(examples.CODE_LISTING_WITH_CAPTION)) +
+            parse_listing(html.fromstring(examples.OUTPUTS_WITH_DOFIRST))
+        )
+        self.listings[0].skip = True
+
+
+    def write_html(self, contents):
+        with open(os.path.join(self.base_dir, 'chapter_x.html'), 'w') as f:
+            f.write(contents)
+
+
+    def test_round_trip_without_html(self):
+        write_listings_manifest('chapter_x', self.listings)
+        self.assertEqual(
+            [listing_to_dict(l) for l in read_listings_manifest('chapter_x')],
+            [listing_to_dict(l) for l in self.listings],
+        )
+
+
+    def test_chapter_test_source(self):
+        write_listings_manifest('chapter_x', [Command('ls')])
+        self.assertEqual(read_chapter_listings('chapter_x', 'manifest'), ['ls'])
+
+
+    def test_chapter_test_reads_manifest_without_lxml(self):
+        write_listings_manifest('chapter_x', self.listings)
+        script = (
+            'import sys; sys.modules["lxml"] = None\n'
+            'import book_tester, listings_manifest\n'
+            'listings_manifest.BASE_DIR = sys.argv[1]\n'
+            'listings = book_tester.read_chapter_listings("chapter_x", "manifest")\n'
+            'print(len(listings), listings[0].filename)\n'
+        )
+        output = subprocess.check_output(
+            [sys.executable, '-c', script, self.base_dir],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines=True,
+        )
+        self.assertEqual(output.split(), [str(len(self.listings)), self.listings[0].filename])
+
+
+    def test_stale_html(self):
+        self.write_html('<html></html>')
+        write_listings_manifest('chapter_x', self.listings)
+        self.assertEqual(len(read_listings_manifest('chapter_x')), len(self.listings))
+        self.write_html('<html>changed</html>')
+        with self.assertRaises(StaleManifestException):
+            read_listings_manifest('chapter_x')
+
+
+    def test_stale_parser(self):
+        write_listings_manifest('chapter_x', self.listings)
+        with patch('listings_manifest.get_parser_version', return_value='different'):
+            with self.assertRaises(StaleManifestException):
+                read_listings_manifest('chapter_x')
+
+
+    def test_manifest_is_plain_json(self):
+        write_listings_manifest('chapter_x', [Command('ls')])
+        with open(get_manifest_path('chapter_x')) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['chapter'], 'chapter_x')
+        self.assertIsNone(manifest['html_sha1'])
+        self.assertEqual(manifest['listings'][0]['text'], 'ls')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
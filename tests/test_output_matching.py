@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from output_matching import LineIndex, ProgressWatcher, find_mismatch
+
+
+ACTUAL_LINES = [
+    'Traceback (most recent call last):',
+    '  File "...python-tdd-book/lists/tests.py", line 21, in test_home_page',
+    '    self.assertEqual(found.func, home_page)',
+    "AssertionError: <function home_page at 0xXX> != None",
+    '',
+    '    ',
+    'Ran 1 tests in X.Xs',
+]
+
+
+
+class LineIndexTest(unittest.TestCase):
+
+    def test_has_line_is_exact(self):
+        index = LineIndex(ACTUAL_LINES)
+        self.assertTrue(index.has_line('    self.assertEqual(found.func, home_page)'))
+        self.assertTrue(index.has_line(''))
+        self.assertFalse(index.has_line('self.assertEqual(found.func, home_page)'))
+        self.assertFalse(index.has_line('Ran 1 tests in X.Xs '))
+
+
+    def test_has_stripped_line_ignores_indentation(self):
+        index = LineIndex(ACTUAL_LINES)
+        self.assertTrue(index.has_stripped_line('self.assertEqual(found.func, home_page)'))
+        self.assertTrue(index.has_stripped_line(''))
+        self.assertFalse(index.has_stripped_line('    self.assertEqual(found.func, home_page)'))
+
+
+    def test_has_prefix(self):
+        index = LineIndex(ACTUAL_LINES)
+        self.assertTrue(index.has_prefix('AssertionError: <function'))
+        self.assertTrue(index.has_prefix('  File "...python-tdd-book/lists/tests.py"'))
+        self.assertTrue(index.has_prefix(''))
+        self.assertFalse(index.has_prefix('File "...python-tdd-book'))
+        self.assertFalse(index.has_prefix('Ran 1 tests in X.Xs and more'))
+
+
+    def test_same_answers_as_searching_the_lists(self):
+        rng = random.Random(0)
+        alphabet = ['a', 'b', ' ', 'ab', '  a']
+        actual_lines = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 5))) for _ in range(40)]
+        index = LineIndex(actual_lines)
+        for _ in range(2000):
+            line = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 4)))
+            self.assertEqual(index.has_line(line), line in actual_lines)
+            self.assertEqual(index.has_stripped_line(line), line in [l.strip() for l in actual_lines])
+            self.assertEqual(index.has_prefix(line), line in [l[:len(line)] for l in actual_lines])
+            start = rng.randint(0, 40)
+            later_lines = list(enumerate(actual_lines))[start:]
+            self.assertEqual(
+                index.next_stripped_line(line, start),
+                next((i for i, l in later_lines if l.strip() == line), None)
+            )
+            self.assertEqual(
+                index.next_prefix(line, start),
+                next((i for i, l in later_lines if l.startswith(line)), None)
+            )
+
+
+
+class FindMismatchTest(unittest.TestCase):
+
+    def test_finds_expected_lines_with_gaps(self):
+        self.assertIsNone(find_mismatch(ACTUAL_LINES, [
+            '[...]',
+            'File "...python-tdd-book/lists/tests.py", line 21, in test_home_page',
+            '    self.assertEqual(found.func, home_page)',
+            'AssertionError: <function [...]',
+            'Ran 1 tests in X.Xs',
+        ]))
+
+
+    def test_still_finds_lines_that_come_out_earlier(self):
+        self.assertIsNone(find_mismatch(ACTUAL_LINES, [
+            'Ran 1 tests in X.Xs',
+            'Traceback (most recent call last):',
+        ]))
+
+
+    def test_reports_first_missing_line_with_the_output_where_it_should_be(self):
+        mismatch = find_mismatch(ACTUAL_LINES, [
+            'Traceback (most recent call last):',
+            '[...]',
+            '    self.assertEqual(found.func, home_page)',
+            'AssertionError: None',
+        ])
+        self.assertEqual(mismatch.expected_number, 3)
+        self.assertEqual(mismatch.expected_line, 'AssertionError: None')
+        self.assertEqual(mismatch.actual_number, 3)
+        self.assertEqual(str(mismatch).split('\n'), [
+            'expected line 4 not found:',
+            "    'AssertionError: None'",
+            'actual output around line 4 (of 7):',
+            "      1 'Traceback (most recent call last):'",
+            '      2 \'  File "...python-tdd-book/lists/tests.py", line 21, in test_home_page\'',
+            "      3 '    self.assertEqual(found.func, home_page)'",
+            ">     4 'AssertionError: <function home_page at 0xXX> != None'",
+            "      5 ''",
+            "      6 '    '",
+            "      7 'Ran 1 tests in X.Xs'",
+        ])
+
+
+    def test_whole_output_has_to_be_the_same(self):
+        self.assertIsNone(find_mismatch(ACTUAL_LINES, ACTUAL_LINES, whole=True))
+        changed = ACTUAL_LINES[:4] + ['different'] + ACTUAL_LINES[5:]
+        self.assertEqual(find_mismatch(ACTUAL_LINES, changed, whole=True).actual_number, 4)
+        self.assertEqual(find_mismatch(ACTUAL_LINES, ACTUAL_LINES[:-1], whole=True).actual_number, 6)
+        self.assertEqual(find_mismatch(ACTUAL_LINES, ACTUAL_LINES + ['x'], whole=True).expected_number, 7)
+
+
+    def test_report_stays_small_for_huge_outputs(self):
+        actual_lines = ['line {}'.format(i) for i in range(200000)]
+        mismatch = find_mismatch(actual_lines, ['line 5', 'line 100000', 'nope', 'line 3'])
+        self.assertEqual(mismatch.actual_number, 100001)
+        self.assertLess(len(str(mismatch)), 500)
+
+
+    def test_many_lines_with_one_prefix(self):
+        actual_lines = ['  File "/x/y{}.py", line 1'.format(i) for i in range(50000)]
+        expected_lines = ['  File "/x/y[...]'] * 2000 + ['nope']
+        mismatch = find_mismatch(actual_lines, expected_lines)
+        self.assertEqual(mismatch.expected_number, 2000)
+        self.assertEqual(mismatch.actual_number, 2000)
+        self.assertIsNone(find_mismatch(actual_lines, expected_lines[:-1]))
+
+
+
+class ProgressWatcherTest(unittest.TestCase):
+
+    def watch(self, expected_lines, chunks):
+        watcher = ProgressWatcher(expected_lines)
+        stops = [watcher(chunk) for chunk in chunks]
+        return watcher, stops
+
+
+    def test_stops_as_soon_as_progress_goes_a_different_way(self):
+        watcher, stops = self.watch(
+            ["Creating test database for alias 'default'...", '..F', ''],
+            ["Creating test database for alias 'default'...\n", '.', 'E', '.'],
+        )
+        self.assertEqual(stops, [False, False, True, False])
+        self.assertEqual(watcher.mismatch, "expected the tests to go '..F', but they went '.E'")
+
+
+    def test_stops_when_progress_line_ends_too_soon_or_goes_on_too_long(self):
+        watcher, stops = self.watch(['..F'], ['.', '.\n'])
+        self.assertEqual(stops, [False, True])
+        watcher, stops = self.watch(['..'], ['..', '.'])
+        self.assertEqual(stops, [False, True])
+
+
+    def test_carries_on_when_progress_matches(self):
+        watcher, stops = self.watch(['.F', 'OK'], ['.', 'F', '\n=====\nFAIL: E\n', 'Ran 2 tests\n'])
+        self.assertFalse(any(stops))
+        self.assertIsNone(watcher.mismatch)
+
+
+    def test_ignores_lines_that_arent_only_progress(self):
+        watcher, stops = self.watch(['.'], ['Error: x\n', 'a.E\n', 'Ran 1 test\n.', '\n'])
+        self.assertFalse(any(stops))
+
+
+    def test_nothing_to_watch_for_without_a_progress_line(self):
+        watcher, stops = self.watch(['Ran 1 test in X.Xs', '', 'OK'], ['E\n'])
+        self.assertEqual(stops, [False])
+        self.assertIsNone(watcher.anchor)
+
+
+if __name__ == '__main__':
+    unittest.main()
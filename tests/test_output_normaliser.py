@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+import json
+import os
+import random
+import re
+import tempfile
+import textwrap
+import unittest
+
+from output_normaliser import (
+    ACTUAL,
+    EXPECTED,
+    INTERACTIVE_MANAGEPY,
+    RULES,
+    SQLITE,
+    Literal,
+    LiteralSet,
+    Rule,
+    RuleRegistry,
+    RuleScan,
+    apply_in_turn,
+    fix_creating_database_line,
+    fix_jenkins_pixelsize,
+    fix_test_dashes,
+    independent,
+    normalise_actual,
+    normalise_expected,
+    standardise_assertionerror_none,
+    standardise_library_paths,
+    strip_bdd_test_speed,
+    strip_callouts,
+    strip_git_hashes,
+    strip_js_test_speed,
+    strip_localhost_port,
+    strip_migration_timestamps,
+    strip_mock_ids,
+    strip_object_ids,
+    strip_screenshot_timestamps,
+    strip_session_ids,
+    strip_test_speed,
+    wrap_long_lines,
+    wrap_paragraph,
+)
+
+ACTUAL_MANAGE_PY_TEST_OUTPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'actual_manage_py_test.output'
+)
+
+
+def one_pass_per_fixup_actual(actual):
+    # the order assert_console_output_correct used to apply them in
+    actual_fixed = standardise_library_paths(actual)
+    actual_fixed = wrap_long_lines(actual_fixed)
+    actual_fixed = strip_test_speed(actual_fixed)
+    actual_fixed = strip_js_test_speed(actual_fixed)
+    actual_fixed = strip_bdd_test_speed(actual_fixed)
+    actual_fixed = strip_git_hashes(actual_fixed)
+    actual_fixed = strip_mock_ids(actual_fixed)
+    actual_fixed = strip_object_ids(actual_fixed)
+    actual_fixed = strip_migration_timestamps(actual_fixed)
+    actual_fixed = strip_session_ids(actual_fixed)
+    actual_fixed = strip_localhost_port(actual_fixed)
+    actual_fixed = strip_screenshot_timestamps(actual_fixed)
+    actual_fixed = apply_in_turn(SQLITE, actual_fixed)
+    actual_fixed = fix_jenkins_pixelsize(actual_fixed)
+    actual_fixed = fix_creating_database_line(actual_fixed)
+    actual_fixed = apply_in_turn(INTERACTIVE_MANAGEPY, actual_fixed)
+    actual_fixed = standardise_assertionerror_none(actual_fixed)
+    return actual_fixed.replace('\xa0', ' ')
+
+
+def one_pass_per_fixup_expected(expected):
+    expected_fixed = standardise_library_paths(expected)
+    expected_fixed = fix_test_dashes(expected_fixed)
+    expected_fixed = strip_test_speed(expected_fixed)
+    expected_fixed = strip_js_test_speed(expected_fixed)
+    expected_fixed = strip_bdd_test_speed(expected_fixed)
+    expected_fixed = strip_git_hashes(expected_fixed)
+    expected_fixed = strip_mock_ids(expected_fixed)
+    expected_fixed = strip_object_ids(expected_fixed)
+    expected_fixed = strip_migration_timestamps(expected_fixed)
+    expected_fixed = strip_session_ids(expected_fixed)
+    expected_fixed = strip_localhost_port(expected_fixed)
+    expected_fixed = strip_screenshot_timestamps(expected_fixed)
+    expected_fixed = strip_callouts(expected_fixed)
+    expected_fixed = standardise_assertionerror_none(expected_fixed)
+    return expected_fixed.replace('\xa0', ' ')
+
+
+def textwrap_wrap_long_lines(text):
+    # what wrap_long_lines used to do
+    return '\n'.join(
+        '\n'.join(textwrap.wrap(p, 79, break_long_words=True, break_on_hyphens=False))
+        for p in text.split('\n')
+    )
+
+
+# at least one line for every rule, plus some near misses
+FRAGMENTS = [
+    'Ran 1 test in 1.343s',
+    'Ran 12 tests in 0.021s',
+    'Took 13ms to run 4 tests. 3 passed, 1 failed.',
+    'features/steps/my_lists.py:19 0.123s',
+    'index d333591..1f55409 100644',
+    'a5a2b3c Add a list',
+    'a5a2b3 not quite a hash',
+    "<Mock name='mock().save' id='140265366006960'>",
+    "<Mock name='Item' id='12'> then <Mock id='13'> and <Mock name='x' id='14'>",
+    "<Mock id='140265366006960'>",
+    '<lists.models.List object at 0x7f3a9c>',
+    'lists/migrations/0003_auto_20140822_1432.py',
+    'ab93f7c90e6e2c6d1a0e4f8bd58a7e3c',
+    'http://localhost:8081/lists/',
+    'http://localhost:41293/',
+    'window0-2014-01-22T18.50.38.png',
+    '16.html',
+    'django.db.utils.IntegrityError: lists_item.list_id may not be NULL',
+    'sqlite3.IntegrityError: columns list_id, text are not unique',
+    'django.db.utils.IntegrityError: columns list_id, text are not unique',
+    'AssertionError: 107.0 != 512 within 3 delta',
+    "Creating test database for alias 'default'...",
+    'Select an option: 1',
+    '>>> from lists.models import Item',
+    'x = <object at 0x7f3a>>> y',
+    "<Mock id='1234'>>> z",
+    'AssertionError: None',
+    '  File "/usr/local/lib/python3.6/site-packages/django/test/utils.py", line 12',
+    'File "/workspace/virtualenv/lib/python3.6/dist-packages/x.py" (Mock id=\'2\'>)',
+    ' ' + '-' * 69,
+    'abcdef1 ' + '-' * 69,
+    '-' * 70,
+    'self.assertEqual(1, 2)  <1>',
+    'self.assertEqual(1, 2)  (2)',
+    'Ran 1 test in 0.001s  <3>',
+    "<Mock name='foo  <1>' id='3'>  (4)",
+    'non\xa0breaking\xa0spaces',
+    '\tindented with a tab',
+    'a' * 120,
+    'word ' * 30,
+    '',
+]
+
+
+class RuleScanTest(unittest.TestCase):
+
+    def test_applies_every_rule(self):
+        scan = RuleScan([
+            Rule('numbers', r'(\d+)', r'<\1>'),
+            Literal('dots', '...', '[...]'),
+        ])
+        self.assertEqual(scan('a 12 b ... 3'), 'a <12> b [...] <3>')
+
+
+    def test_keeps_group_numbers_of_later_rules(self):
+        scan = RuleScan([
+            Rule('pairs', r'(\w)=(\w)', r'\2=\1'),
+            Rule('triples', r'(\w)-(\w)-(\w)', r'\3\2\1'),
+        ])
+        self.assertEqual(scan('a=b x-y-z'), 'b=a zyx')
+
+
+    def test_leaves_other_backslashes_in_replacements_alone(self):
+        rule = Rule('index', r'i (\d+)\.\.(\d+)', r'i X\.\.\2')
+        self.assertEqual(RuleScan([rule])('i 1..2'), rule('i 1..2'))
+
+
+    def test_runs_later_rules_over_kept_groups(self):
+        scan = RuleScan([
+            Rule('brackets', r'\[(.+)\]', r'(\1)'),
+            Rule('numbers', r'\d+', r'N'),
+        ])
+        self.assertEqual(scan('[a 1 b 2]'), '(a N b N)')
+
+
+    def test_shares_one_literal_set_between_independent_literals(self):
+        scan = RuleScan([
+            Literal('a', 'cat', 'dog'),
+            Literal('b', 'bus', 'car'),
+            Rule('numbers', r'\d+', 'N'),
+            Literal('c', 'ham', 'egg'),
+            Literal('d', 'jam', 'tea'),
+        ])
+        self.assertEqual([type(u) for u in scan.units], [LiteralSet, Rule, LiteralSet])
+        text = 'cat 12 bus ham jam buses'
+        self.assertEqual(scan(text), 'dog N car egg tea cares')
+        self.assertEqual(scan(text), scan.sequentially(text))
+
+
+    def test_keeps_literals_that_get_in_each_others_way_apart(self):
+        overlapping = [Literal('a', 'abc', 'x'), Literal('b', 'cde', 'y')]
+        creating = [Literal('a', 'abc', 'c'), Literal('b', 'cd', 'y')]
+        containing = [Literal('a', 'abc', 'x'), Literal('b', 'b', 'y')]
+        for literals in [overlapping, creating, containing]:
+            self.assertFalse(independent(literals))
+            self.assertNotIn(LiteralSet, [type(u) for u in RuleScan(literals).units])
+        self.assertTrue(independent([Literal('b', 'xy', 'z'), Literal('a', 'abc', 'q')]))
+
+
+    def test_literal_set_matches_any_of_its_strings(self):
+        literals = LiteralSet([
+            Literal('1', 'IntegrityError: a', '1'),
+            Literal('2', 'IntegrityError: b', '2'),
+            Literal('3', 'Integer', '3'),
+            Literal('4', '.*', '4'),
+        ])
+        self.assertEqual(literals('IntegrityError: b, Integer, IntegrityError: a .*'), '2, 3, 1 4')
+
+
+    def test_multiline_flags_are_scoped_to_their_rule(self):
+        scan = RuleScan([
+            Rule('starts', r'^x', 'X', flags=re.MULTILINE),
+            Rule('whole', r'^y$', 'Y'),
+        ])
+        self.assertEqual(scan('x\nx\ny'), 'X\nX\ny')
+        self.assertEqual(scan('y'), 'Y')
+
+
+    def test_later_rule_can_match_across_the_end_of_an_earlier_replacement(self):
+        scan = RuleScan([
+            Rule('object ids', '0x([0-9a-f]+)>', '0xXX>'),
+            Literal('prompt', '>>> ', '>>>\n'),
+        ])
+        self.assertEqual(scan('x = <object at 0x7f3a>>> y'), 'x = <object at 0xXX>>>\ny')
+
+
+    def test_earlier_rule_can_start_inside_a_later_match(self):
+        scan = RuleScan([
+            Literal('dashes', ' ' + '-' * 69, '-' * 70),
+            Rule('hashes', r'^[a-f0-9]{7} ', 'XXXXXXX ', flags=re.MULTILINE),
+        ])
+        self.assertEqual(scan('abcdef1 ' + '-' * 69), 'abcdef1' + '-' * 70)
+
+
+    def test_same_as_sequentially_for_rules_that_get_in_each_others_way(self):
+        scan = RuleScan([
+            Rule('swap', 'ab', 'ba'),
+            Literal('split', 'ba', 'a\n'),
+            Rule('line starts', '^b+', 'B', flags=re.MULTILINE),
+            Rule('line ends', 'a+b$', 'b', flags=re.MULTILINE),
+            Rule('whole text', '^a$', 'b'),
+            Literal('join', 'aB', 'ab'),
+        ])
+        rng = random.Random(1234)
+        for _ in range(2000):
+            text = ''.join(rng.choice('ab\n') for _ in range(rng.randint(0, 12)))
+            self.assertEqual(scan(text), scan.sequentially(text), repr(text))
+
+
+
+class SameAsOnePassPerFixupTest(unittest.TestCase):
+
+    def assert_same(self, text):
+        self.assertEqual(normalise_actual(text), one_pass_per_fixup_actual(text))
+        self.assertEqual(normalise_expected(text), one_pass_per_fixup_expected(text))
+
+
+    def test_each_fragment(self):
+        for fragment in FRAGMENTS:
+            self.assert_same(fragment)
+
+
+    def test_all_fragments_together(self):
+        self.assert_same('\n'.join(FRAGMENTS))
+
+
+    def test_fragments_jumbled_up(self):
+        rng = random.Random(1234)
+        for _ in range(500):
+            pieces = rng.sample(FRAGMENTS, rng.randint(1, 8))
+            separators = [rng.choice(['\n', ' ', '', '\n\n']) for _ in pieces]
+            self.assert_same(''.join(p + s for p, s in zip(pieces, separators)))
+
+
+    def test_captured_manage_py_test_output(self):
+        with open(ACTUAL_MANAGE_PY_TEST_OUTPUT) as f:
+            self.assert_same(f.read())
+
+
+    def test_fixes_test_dashes_before_git_hashes(self):
+        self.assertEqual(normalise_expected('abcdef1 ' + '-' * 69), 'abcdef1' + '-' * 70)
+
+
+    def test_sequentially_is_one_pass_per_rule(self):
+        text = '\n'.join(FRAGMENTS)
+        self.assertEqual(normalise_expected.sequentially(text), normalise_expected(text))
+
+
+
+class WrapLongLinesTest(unittest.TestCase):
+
+    def assert_same_as_textwrap(self, text):
+        self.assertEqual(wrap_long_lines(text), textwrap_wrap_long_lines(text), repr(text))
+
+
+    def test_same_as_textwrap_for_random_paragraphs(self):
+        rng = random.Random(79)
+        pieces = [
+            'a', 'word', 'hyphen-ated', '-', ' ', '  ', '\t', '\r', '\x0b', '\x0c',
+            '\xa0', '\u3000', 'x' * 78, 'y' * 79, 'z' * 80, ' ' * 85, '.' * 200,
+        ]
+        for _ in range(3000):
+            self.assert_same_as_textwrap(''.join(
+                rng.choice(pieces) for _ in range(rng.randint(0, 40))
+            ))
+
+
+    def test_same_as_textwrap_around_the_line_length(self):
+        for length in range(70, 170):
+            for text in [
+                'a' * length,
+                'a' * length + ' b',
+                'b ' + 'a' * length,
+                ' ' * length + 'a',
+                'a ' * (length // 2) + ' ' * length,
+                'a' * 40 + ' ' * length + 'b' * length,
+                '\t' + 'a' * length + '\xa0',
+            ]:
+                self.assert_same_as_textwrap(text)
+
+
+    def test_same_as_textwrap_for_fragments_and_captured_output(self):
+        self.assert_same_as_textwrap('\n'.join(FRAGMENTS))
+        with open(ACTUAL_MANAGE_PY_TEST_OUTPUT) as f:
+            self.assert_same_as_textwrap(f.read())
+
+
+    def test_takes_linear_time_on_long_unbroken_lines(self):
+        text = '<div>' * 200000
+        wrapped = wrap_paragraph(text)
+        self.assertEqual(wrapped.replace('\n', ''), text)
+        self.assertEqual({len(l) for l in wrapped.split('\n')[:-1]}, {79})
+
+
+
+class RuleRegistryTest(unittest.TestCase):
+
+    def make_registry(self):
+        registry = RuleRegistry()
+        registry.add(Rule('numbers', r'\d+', 'N'))
+        registry.add(str.strip, sides=[ACTUAL])
+        registry.add(Literal('dashes', '--', '-'), sides=[EXPECTED])
+        registry.add(Literal('stars', '*', '+'), listing_types=['qunit output'])
+        registry.add(Literal('dots', '...', '.'), starts_scan=True)
+        return registry
+
+
+    def test_groups_rules_into_scans_for_each_side(self):
+        registry = self.make_registry()
+        actual_steps = registry.normaliser(ACTUAL).steps
+        self.assertEqual([s.rules for s in actual_steps if isinstance(s, RuleScan)], [
+            [registry.entries[0].step],
+            [registry.entries[3].step],
+            [registry.entries[4].step],
+        ])
+        self.assertIn(str.strip, actual_steps)
+        expected_steps = registry.normaliser(EXPECTED).steps
+        self.assertEqual([[r.name for r in s.rules] for s in expected_steps], [
+            ['numbers', 'dashes', 'stars'], ['dots'],
+        ])
+
+
+    def test_leaves_out_rules_for_other_listing_types(self):
+        registry = self.make_registry()
+        self.assertEqual(registry.normalise(EXPECTED, '1 * -- ...', 'output'), 'N * - .')
+        self.assertEqual(registry.normalise(EXPECTED, '1 * -- ...', 'qunit output'), 'N + - .')
+        self.assertEqual(registry.normalise(EXPECTED, '1 * -- ...'), 'N + - .')
+
+
+    def test_profiling_gives_the_same_results_and_counts_changes(self):
+        text = '\n'.join(FRAGMENTS)
+        RULES.profiling = True
+        try:
+            self.assertEqual(RULES.normalise(ACTUAL, text), normalise_actual(text))
+            self.assertEqual(RULES.normalise(EXPECTED, text), normalise_expected(text))
+            RULES.normalise(ACTUAL, 'nothing to see here')
+            stats = RULES.stats
+        finally:
+            RULES.profiling = False
+            RULES.stats = {}
+        self.assertEqual(stats['test speed']['runs'], 3)
+        self.assertEqual(stats['test speed']['changes'], 2)
+        self.assertEqual(stats['old callouts'], dict(stats['old callouts'], runs=1, changes=1))
+        self.assertNotIn('test dashes', [
+            e.name for e in RULES.steps(ACTUAL)
+        ])
+
+
+    def test_save_stats_adds_to_existing_file(self):
+        registry = self.make_registry()
+        registry.profiling = True
+        registry.normalise(ACTUAL, ' 12 ')
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'stats.json')
+            registry.save_stats(path)
+            registry.save_stats(path)
+            with open(path) as f:
+                stats = json.load(f)
+        self.assertEqual(stats['numbers']['runs'], 2)
+        self.assertEqual(stats['numbers']['changes'], 2)
+        self.assertEqual(stats['strip']['changes'], 2)
+        self.assertEqual(stats['dots']['changes'], 0)
+
+
+    def test_report_flags_rules_that_never_changed_anything(self):
+        registry = self.make_registry()
+        report = registry.report({
+            'numbers': {'runs': 3, 'changes': 1, 'seconds': 0.5},
+            'dots': {'runs': 3, 'changes': 0, 'seconds': 1.5},
+        })
+        self.assertTrue(report[0].startswith('dots'))
+        self.assertIn('never changed anything', report[0])
+        self.assertNotIn('never changed anything', report[1])
+        self.assertEqual(len(report), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
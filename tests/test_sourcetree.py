@@ -1,10 +1,12 @@
 import unittest
 from unittest.mock import patch
 import subprocess
+import time
 from textwrap import dedent
 import os
 
 from book_parser import CodeListing
+from git_fixtures import SourceRepoTestCase, git
 from sourcetree import (
     BOOTSTRAP_WGET,
     ApplyCommitException,
@@ -68,6 +70,64 @@ class StartWithCheckoutTest(unittest.TestCase):
 
 
 
+class CommitRefTableTest(SourceRepoTestCase):
+
+    def test_refs_resolve_to_the_same_commits_as_git(self):
+        self.sourcetree.start_with_checkout('chapter_x', 'chapter_w')
+        for ref, sha in [('ch02l001', self.first), ('ch02l002-1', self.second)]:
+            self.assertEqual(self.sourcetree.get_commit_spec(ref), sha)
+            self.assertEqual(
+                git(self.sourcetree.tempdir, 'rev-parse', 'repo/chapter_x^{{/--{}--}}'.format(ref)),
+                sha
+            )
+
+
+    def test_unknown_refs_fall_back_to_asking_git(self):
+        self.sourcetree.start_with_checkout('chapter_x', 'chapter_w')
+        self.assertEqual(
+            self.sourcetree.get_commit_spec('ch09l009'), 'repo/chapter_x^{/--ch09l009--}'
+        )
+
+
+    def test_no_refs_for_a_chapter_the_repo_doesnt_have(self):
+        self.sourcetree.start_with_checkout('chapter_y', 'chapter_w')
+        self.assertEqual(self.sourcetree.commit_refs, {})
+
+
+
+class SharedObjectsCheckoutTest(SourceRepoTestCase):
+
+    def count_local_objects(self):
+        counts = git(self.sourcetree.tempdir, 'count-objects', '-v')
+        counts = dict(line.split(': ') for line in counts.split('\n'))
+        return int(counts['count']) + int(counts['in-pack'])
+
+
+    def test_borrows_objects_from_the_source_repo(self):
+        self.sourcetree.start_with_checkout('chapter_x', 'chapter_w')
+        self.assertEqual(self.count_local_objects(), 0)
+        self.assertEqual(self.sourcetree.get_contents('file.txt'), 'line 1\n')
+        self.assertEqual(
+            self.sourcetree.run_command('git show {}:file.txt'.format(self.second)), 'line 4\n'
+        )
+
+
+    def test_can_still_copy_everything(self):
+        self.sourcetree.share_objects = False
+        self.sourcetree.start_with_checkout('chapter_x', 'chapter_w')
+        self.assertGreater(self.count_local_objects(), 0)
+        self.assertEqual(self.sourcetree.get_commit_spec('ch02l001'), self.first)
+
+
+    def test_just_copies_when_repo_is_missing(self):
+        self.sourcetree.borrow_objects('/no/such/repo')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.sourcetree.tempdir, '.git', 'objects', 'info', 'alternates')
+        ))
+
+
+
+
 class ApplyFromGitRefTest(unittest.TestCase):
 
     def setUp(self):
@@ -546,6 +606,29 @@ class SourceTreeRunCommandTest(unittest.TestCase):
         sourcetree.run_command('python test.py', cwd=sourcetree.tempdir)
 
 
+    def test_watch_sees_output_as_it_arrives(self):
+        sourcetree = SourceTree()
+        chunks = []
+        def watch(chunk):
+            chunks.append(chunk)
+            return False
+        output = sourcetree.run_command(
+            'echo -n one; sleep 0.2; echo two; cat', user_input='three', watch=watch
+        )
+        self.assertEqual(output, 'onetwo\nthree\n')
+        self.assertEqual(chunks[0], 'one')
+
+
+    def test_watch_can_stop_the_command_early(self):
+        sourcetree = SourceTree()
+        start = time.time()
+        output = sourcetree.run_command(
+            'echo -n .; sleep 0.2; echo -n E; sleep 10; echo never', watch=lambda chunk: chunk == 'E'
+        )
+        self.assertEqual(output, '.E')
+        self.assertLess(time.time() - start, 5)
+
+
     def test_cleanup_kills_backgrounded_processes_and_rmdirs(self):
         sourcetree = SourceTree()
         sourcetree.run_command('python -c"import time; time.sleep(5)" & #runserver', cwd=sourcetree.tempdir)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+from textwrap import dedent
+
+from unified_diff import apply_diff, parse_diff
+
+GIT_DIFF = dedent("""\
+    commit 55a9c0e2234f4a7c6be92f995803749c87cf0edd
+    Author: a <b>
+
+        a listing --ch01l001--
+
+    diff --git a/gone.txt b/gone.txt
+    deleted file mode 100644
+    --- a/gone.txt
+    +++ /dev/null
+    @@ -1 +0,0 @@
+    -bye
+    diff --git a/keep.txt b/keep.txt
+    --- a/keep.txt
+    +++ b/keep.txt
+    @@ -1,3 +1,3 @@
+     a
+    -b
+    -c
+    +B
+    +c
+    \\ No newline at end of file
+    diff --git a/old.py b/new.py
+    similarity index 90%
+    rename from old.py
+    rename to new.py
+    --- a/old.py
+    +++ b/new.py
+    @@ -2,3 +2,3 @@
+     2
+    -3
+    +three
+     4
+    diff --git a/sub/made.txt b/sub/made.txt
+    new file mode 100755
+    --- /dev/null
+    +++ b/sub/made.txt
+    @@ -0,0 +1 @@
+    +hi
+    """)
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(l + '\n' for l in lines))
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+
+class ParseDiffTest(unittest.TestCase):
+
+    def test_parses_git_diffs_skipping_the_commit_message(self):
+        patches = parse_diff(GIT_DIFF)
+        self.assertEqual(
+            [(p.old_path, p.new_path) for p in patches],
+            [('gone.txt', '/dev/null'), ('keep.txt', 'keep.txt'), ('old.py', 'new.py'), ('/dev/null', 'sub/made.txt')]
+        )
+        self.assertTrue(patches[0].deleted)
+        self.assertTrue(patches[2].renamed)
+        self.assertTrue(patches[3].created)
+        self.assertEqual(patches[3].new_mode, 0o100755)
+        keep = patches[1].hunks[0]
+        self.assertEqual(keep.old_lines, ['a', 'b', 'c'])
+        self.assertEqual(keep.new_lines, ['a', 'B', 'c'])
+        self.assertTrue(keep.new_missing_newline)
+        self.assertFalse(keep.old_missing_newline)
+
+
+    def test_hunks_on_their_own(self):
+        [patch] = parse_diff('@@ -3,2 +3,2 @@ def foo():\n     x = 1\n-    y = 2\n+    y = 3\n')
+        self.assertIsNone(patch.old_path)
+        self.assertEqual(patch.hunks[0].first, 2)
+        self.assertEqual(patch.hunks[0].lines, [(' ', '    x = 1'), ('-', '    y = 2'), ('+', '    y = 3')])
+
+
+    def test_blank_lines_are_context(self):
+        [patch] = parse_diff('@@ -1,3 +1,2 @@\n a\n\n-b\n')
+        self.assertEqual(patch.hunks[0].lines, [(' ', 'a'), (' ', ''), ('-', 'b')])
+
+
+    def test_short_hunks_are_malformed(self):
+        [patch] = parse_diff('@@ -1,3 +1,3 @@\n a\n-b\n+c\n@@ -8,1 +8,1 @@\n-x\n+y\n')
+        self.assertIn('should be part of it', patch.hunks[0].malformed)
+        self.assertIsNone(patch.hunks[1].malformed)
+        [patch] = parse_diff('@@ -1,3 +1,3 @@\n a\n-b\n')
+        self.assertEqual(patch.hunks[0].malformed, 'the diff ends in the middle of it')
+
+
+
+class ApplyDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+
+    def path(self, name):
+        return os.path.join(self.tempdir, name)
+
+
+    def test_applies_a_git_diff(self):
+        write_lines(self.path('gone.txt'), ['bye'])
+        write_lines(self.path('keep.txt'), ['a', 'b', 'c'])
+        write_lines(self.path('old.py'), ['1', '2', '3', '4', '5'])
+        result = apply_diff(GIT_DIFF, self.tempdir)
+        self.assertTrue(result.ok)
+        self.assertFalse(os.path.exists(self.path('gone.txt')))
+        self.assertEqual(read(self.path('keep.txt')), 'a\nB\nc')
+        self.assertFalse(os.path.exists(self.path('old.py')))
+        self.assertEqual(read(self.path('new.py')), '1\n2\nthree\n4\n5\n')
+        self.assertEqual(read(self.path('sub/made.txt')), 'hi\n')
+        self.assertTrue(os.access(self.path('sub/made.txt'), os.X_OK))
+        self.assertEqual(str(result).split('\n'), [
+            'patching file gone.txt',
+            'patching file keep.txt',
+            'patching file new.py (renamed from old.py)',
+            'patching file sub/made.txt',
+        ])
+
+
+    def test_offset_and_fuzz(self):
+        write_lines(self.path('f.py'), ['new'] * 5 + ['a', 'B', 'c', 'd', 'e', 'f', 'g'])
+        result = apply_diff('@@ -1,7 +1,7 @@\n a\n b\n c\n-d\n+D\n e\n f\n g\n', self.tempdir, path='f.py')
+        self.assertTrue(result.ok)
+        [hunk] = result.hunks
+        self.assertEqual((hunk.position, hunk.offset, hunk.fuzz), (5, 5, 2))
+        self.assertEqual(str(hunk), 'Hunk #1 succeeded at 6 with fuzz 2 (offset 5 lines).')
+        self.assertEqual(read(self.path('f.py')).split('\n')[5:], ['a', 'B', 'c', 'D', 'e', 'f', 'g', ''])
+
+
+    def test_failed_hunks_are_reported_and_the_rest_still_go_in(self):
+        write_lines(self.path('f.py'), ['a', 'b', 'c', 'x', 'y', 'z'])
+        result = apply_diff(
+            '@@ -1,2 +1,2 @@\n-a\n+A\n b\n@@ -4,3 +4,3 @@\n x\n-nope\n+Y\n z\n',
+            self.tempdir, path='f.py'
+        )
+        self.assertFalse(result.ok)
+        self.assertEqual([h.number for h in result.failed], [2])
+        self.assertEqual(result.malformed, [])
+        self.assertIn('Hunk #2 FAILED at 4.', str(result))
+        self.assertEqual(read(self.path('f.py')), 'A\nb\nc\nx\ny\nz\n')
+
+
+    def test_malformed_hunks_are_reported(self):
+        write_lines(self.path('f.py'), ['a', 'b'])
+        result = apply_diff('@@ -1,3 +1,3 @@\n a\n-b\n', self.tempdir, path='f.py')
+        self.assertFalse(result.ok)
+        self.assertEqual([h.number for h in result.malformed], [1])
+
+
+    def test_patch_thats_already_applied_is_skipped(self):
+        write_lines(self.path('f.py'), ['a', 'B', 'c'])
+        result = apply_diff('@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n', self.tempdir, path='f.py')
+        self.assertFalse(result.ok)
+        self.assertIn('reversed', result.hunks[0].problem)
+        self.assertEqual(read(self.path('f.py')), 'a\nB\nc\n')
+
+
+    def test_nothing_to_apply(self):
+        self.assertFalse(apply_diff('just some text\n', self.tempdir).ok)
+
+
+    @unittest.skipUnless(shutil.which('patch') and shutil.which('diff'), 'needs GNU patch and diff')
+    def test_same_results_as_gnu_patch(self):
+        rng = random.Random(0)
+        words = ['a', 'b', 'c', 'd', '', 'x']
+        for case in range(200):
+            old = [rng.choice(words) for _ in range(rng.randint(0, 40))]
+            new = list(old)
+            for _ in range(rng.randint(1, 6)):
+                i = rng.randint(0, len(new))
+                change = rng.random()
+                if change < 0.4:
+                    new[i:i] = [rng.choice(words) + 'new'] * rng.randint(1, 3)
+                elif change < 0.8:
+                    del new[i:i + rng.randint(1, 3)]
+                else:
+                    new[i:i + 1] = ['changed']
+            write_lines(self.path('old'), old)
+            write_lines(self.path('new'), new)
+            diff = subprocess.run(
+                ['diff', '-U{}'.format(rng.randint(0, 4)), 'old', 'new'],
+                cwd=self.tempdir, stdout=subprocess.PIPE, universal_newlines=True,
+            ).stdout
+            # the file being patched has moved on from the one diffed
+            target = list(old)
+            for _ in range(rng.randint(0, 5)):
+                i = rng.randint(0, len(target))
+                change = rng.random()
+                if change < 0.5:
+                    target[i:i] = ['drift{}'.format(rng.randint(0, 9))] * rng.randint(1, 4)
+                elif change < 0.8:
+                    del target[i:i + 1]
+                else:
+                    target[i:i + 1] = ['zz']
+            write_lines(self.path('gnu'), target)
+            write_lines(self.path('ours'), target)
+            gnu = subprocess.run(
+                ['patch', '--fuzz=3', '--no-backup-if-mismatch', '-r', '-', 'gnu'],
+                input=diff, cwd=self.tempdir, stdout=subprocess.PIPE, universal_newlines=True,
+            )
+            result = apply_diff(diff, self.tempdir, path='ours')
+            with self.subTest(case=case, diff=diff, target=target):
+                self.assertEqual(read(self.path('ours')), read(self.path('gnu')))
+                self.assertEqual(result.ok, gnu.returncode == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Parsing unified diffs (git's, or hunks on their own, like the book's diff
+listings) and applying them to the files in a tree the way
+`patch -p1 --fuzz=3` would: each hunk goes where its lines are found,
+as near as possible to where the diff says, and if they can't be found
+as they are, up to `fuzz` lines of context at either end are ignored.
+
+Instead of patch's output, applying gives a PatchResult, with a
+HunkResult saying where each hunk went, or that it failed or was
+malformed.
+"""
+import os
+import re
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+GIT_HEADER = re.compile(r'^diff --git a/(.+) b/(.+)$')
+DEV_NULL = '/dev/null'
+
+
+
+class Hunk(object):
+
+    def __init__(self, old_start, new_start, lines, number):
+        self.old_start = old_start
+        self.new_start = new_start
+        # (' ' or '-' or '+', text) pairs
+        self.lines = lines
+        self.number = number
+        self.old_missing_newline = False
+        self.new_missing_newline = False
+        self.malformed = None
+
+
+    @property
+    def old_lines(self):
+        return [text for tag, text in self.lines if tag != '+']
+
+
+    @property
+    def new_lines(self):
+        return [text for tag, text in self.lines if tag != '-']
+
+
+    @property
+    def first(self):
+        # where the old lines start, counting from 0: a hunk with no old
+        # lines says which line it goes after
+        return self.old_start if not self.old_lines else self.old_start - 1
+
+
+    def reversed(self):
+        swapped = {' ': ' ', '-': '+', '+': '-'}
+        return Hunk(
+            self.new_start, self.old_start,
+            [(swapped[tag], text) for tag, text in self.lines], self.number
+        )
+
+
+    @property
+    def prefix_context(self):
+        return _leading_context(self.lines)
+
+
+    @property
+    def suffix_context(self):
+        return _leading_context(reversed(self.lines))
+
+
+
+def _leading_context(lines):
+    count = 0
+    for tag, _ in lines:
+        if tag != ' ':
+            break
+        count += 1
+    return count
+
+
+
+class FilePatch(object):
+    """the changes a diff makes to one file"""
+
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+        self.git = False
+        self.new_mode = None
+        self.renamed = False
+        self.binary = False
+
+
+    @property
+    def deleted(self):
+        return self.new_path == DEV_NULL
+
+
+    @property
+    def created(self):
+        return self.old_path == DEV_NULL
+
+
+
+def parse_diff(text):
+    """
+    the FilePatches in a diff. Anything that isn't part of one, like a
+    commit message, is skipped, as patch does. Hunks with no file header
+    at all are put in a FilePatch with no paths.
+    """
+    lines = text.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    patches = []
+    current = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        git_header = GIT_HEADER.match(line)
+        hunk_header = HUNK_HEADER.match(line)
+        if git_header:
+            current = FilePatch(git_header.group(1), git_header.group(2))
+            current.git = True
+            patches.append(current)
+        elif line.startswith('--- ') and i + 1 < len(lines) and lines[i + 1].startswith('+++ '):
+            old_path, new_path = _diff_path(line), _diff_path(lines[i + 1])
+            if current is None or current.hunks or not current.git:
+                current = FilePatch()
+                patches.append(current)
+            current.old_path, current.new_path = old_path, new_path
+            i += 1
+        elif hunk_header:
+            if current is None:
+                current = FilePatch()
+                patches.append(current)
+            i = _parse_hunk(lines, i, hunk_header, current)
+            continue
+        elif current is not None and current.git and not current.hunks:
+            _parse_git_header_line(line, current)
+        i += 1
+    return patches
+
+
+def _diff_path(line):
+    path = line[4:].split('\t')[0]
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1]
+    if path != DEV_NULL and path.startswith(('a/', 'b/')):
+        path = path[2:]
+    return path
+
+
+def _parse_git_header_line(line, patch):
+    if line.startswith('rename from '):
+        patch.old_path, patch.renamed = line[len('rename from '):], True
+    elif line.startswith('rename to '):
+        patch.new_path, patch.renamed = line[len('rename to '):], True
+    elif line.startswith('new file mode '):
+        patch.old_path, patch.new_mode = DEV_NULL, int(line.split()[-1], 8)
+    elif line.startswith('new mode '):
+        patch.new_mode = int(line.split()[-1], 8)
+    elif line.startswith('deleted file mode '):
+        patch.new_path = DEV_NULL
+    elif line.startswith(('Binary files ', 'GIT binary patch')):
+        patch.binary = True
+
+
+def _parse_hunk(lines, i, header, patch):
+    old_start, old_count, new_start, new_count = (
+        int(n) if n is not None else 1 for n in header.groups()
+    )
+    hunk = Hunk(old_start, new_start, [], len(patch.hunks) + 1)
+    patch.hunks.append(hunk)
+    i += 1
+    while old_count > 0 or new_count > 0:
+        if i == len(lines):
+            hunk.malformed = 'the diff ends in the middle of it'
+            return i
+        line = lines[i]
+        tag, text = (line[0], line[1:]) if line else (' ', '')
+        if tag == '\\':
+            _mark_missing_newline(hunk)
+            i += 1
+            continue
+        if tag not in ' -+':
+            hunk.malformed = 'line {} should be part of it: {!r}'.format(i + 1, line)
+            return i
+        if tag != '+':
+            old_count -= 1
+        if tag != '-':
+            new_count -= 1
+        if old_count < 0 or new_count < 0:
+            hunk.malformed = 'line {} is one more than its header says: {!r}'.format(i + 1, line)
+            return i
+        hunk.lines.append((tag, text))
+        i += 1
+    if i < len(lines) and lines[i].startswith('\\'):
+        _mark_missing_newline(hunk)
+        i += 1
+    return i
+
+
+def _mark_missing_newline(hunk):
+    if not hunk.lines:
+        return
+    tag = hunk.lines[-1][0]
+    if tag != '+':
+        hunk.old_missing_newline = True
+    if tag != '-':
+        hunk.new_missing_newline = True
+
+
+
+def locate_hunk(lines, hunk, first_guess, frozen, fuzz):
+    """
+    where, counting from 0, the hunk's old lines are in the file lines,
+    ignoring `fuzz` lines of context at the start and the end, or None.
+    It looks either side of the first guess in turn, no earlier than the
+    first line that isn't frozen. A hunk with less context at one end than
+    the other has to be right up against that end of the file.
+
+    This follows patch's own locate_hunk closely, down to letting context
+    it ignores at the end hang off the end of the file.
+    """
+    pattern = hunk.old_lines
+    if not pattern:
+        return first_guess
+    prefix_context, suffix_context = hunk.prefix_context, hunk.suffix_context
+    context = max(prefix_context, suffix_context)
+    prefix_fuzz = fuzz + prefix_context - context
+    suffix_fuzz = fuzz + suffix_context - context
+    max_where = len(lines) - (len(pattern) - suffix_fuzz)
+    max_pos_offset = max_where - first_guess
+    max_neg_offset = first_guess - frozen
+
+    def matches(where, prefix_fuzz, suffix_fuzz):
+        return all(
+            where + i < len(lines) and lines[where + i] == pattern[i]
+            for i in range(prefix_fuzz, len(pattern) - suffix_fuzz)
+        )
+
+    if prefix_fuzz < 0 and hunk.first == 0:
+        # can only go at the start of the file
+        if suffix_fuzz < 0 and (len(pattern) != len(lines) or prefix_context < frozen):
+            return None
+        if frozen <= prefix_context and max_where >= 0 and matches(0, 0, suffix_fuzz):
+            return 0
+        return None
+    prefix_fuzz = max(prefix_fuzz, 0)
+    if suffix_fuzz < 0:
+        # can only go at the end
+        offset = first_guess - (len(lines) - len(pattern))
+        if offset <= max_neg_offset and matches(first_guess - offset, prefix_fuzz, 0):
+            return first_guess - offset
+        return None
+
+    for offset in range(max(max_pos_offset, max_neg_offset) + 1):
+        if offset <= max_pos_offset and matches(first_guess + offset, prefix_fuzz, suffix_fuzz):
+            return first_guess + offset
+        where = first_guess - offset
+        if 0 < offset <= max_neg_offset and where <= max_where and matches(where, prefix_fuzz, suffix_fuzz):
+            return where
+    return None
+
+
+
+class HunkResult(object):
+
+    def __init__(self, path, hunk, position=None, offset=0, fuzz=0, problem=None):
+        self.path = path
+        self.number = hunk.number
+        self.hunk = hunk
+        self.position = position
+        self.offset = offset
+        self.fuzz = fuzz
+        self.problem = problem
+
+
+    @property
+    def failed(self):
+        return self.problem == 'failed'
+
+
+    @property
+    def malformed(self):
+        return self.problem is not None and self.problem.startswith('malformed')
+
+
+    def __str__(self):
+        if self.problem == 'failed':
+            return 'Hunk #{} FAILED at {}.'.format(self.number, self.hunk.first + 1)
+        if self.problem:
+            return 'Hunk #{} is {}'.format(self.number, self.problem)
+        details = []
+        if self.fuzz:
+            details.append('with fuzz {}'.format(self.fuzz))
+        if self.offset:
+            details.append('(offset {} line{})'.format(self.offset, '' if abs(self.offset) == 1 else 's'))
+        return ' '.join(['Hunk #{} succeeded at {}'.format(self.number, self.position + 1)] + details) + '.'
+
+
+
+class PatchResult(object):
+
+    def __init__(self):
+        self.files = []
+        self.hunks = []
+        self.problems = []
+
+
+    @property
+    def failed(self):
+        return [h for h in self.hunks if h.failed]
+
+
+    @property
+    def malformed(self):
+        return [h for h in self.hunks if h.malformed]
+
+
+    @property
+    def ok(self):
+        return not self.problems and all(h.problem is None for h in self.hunks)
+
+
+    def __str__(self):
+        report = []
+        for path, renamed_from in self.files:
+            renamed = ' (renamed from {})'.format(renamed_from) if renamed_from else ''
+            report.append('patching file {}{}'.format(path, renamed))
+            report.extend(str(h) for h in self.hunks if h.path == path and (h.problem or h.offset or h.fuzz))
+        report.extend(self.problems)
+        return '\n'.join(report)
+
+
+
+def apply_hunks(lines, hunks, path, result, fuzz=3):
+    """
+    the file lines with the hunks applied, adding a HunkResult for each one
+    to the result. Hunks that fail are left out, and the rest still go in.
+    """
+    if hunks and not hunks[0].malformed and _already_applied(lines, hunks[0], fuzz):
+        # where patch would ask whether to assume -R, and then skip the file
+        for hunk in hunks:
+            result.hunks.append(HunkResult(path, hunk, problem='ignored: reversed (or previously applied)'))
+        return lines
+    output = []
+    # lines before this one are in the output already. Like patch, context
+    # only gets copied across when there's a change after it, so the next
+    # hunk's context can overlap this one's
+    frozen = 0
+    in_offset = 0
+    for hunk in hunks:
+        if hunk.malformed:
+            result.hunks.append(HunkResult(path, hunk, problem='malformed: ' + hunk.malformed))
+            continue
+        first_guess = hunk.first + in_offset
+        max_fuzz = min(fuzz, max(hunk.prefix_context, hunk.suffix_context))
+        for hunk_fuzz in range(max_fuzz + 1):
+            where = locate_hunk(lines, hunk, first_guess, frozen, hunk_fuzz)
+            if where is not None:
+                break
+        if where is None:
+            result.hunks.append(HunkResult(path, hunk, problem='failed'))
+            continue
+        in_offset = where - hunk.first
+        result.hunks.append(HunkResult(path, hunk, where, in_offset, hunk_fuzz))
+        old_line = where
+        for tag, text in hunk.lines:
+            if tag != ' ':
+                output.extend(lines[frozen:old_line])
+                frozen = max(frozen, old_line)
+            if tag == '+':
+                output.append(text)
+            else:
+                old_line += 1
+            if tag == '-':
+                frozen = old_line
+    output.extend(lines[frozen:])
+    return output
+
+
+def _already_applied(lines, hunk, fuzz):
+    # only if the first hunk can't go in as it is, at each amount of fuzz
+    reverse = hunk.reversed()
+    max_fuzz = min(fuzz, max(hunk.prefix_context, hunk.suffix_context))
+    for hunk_fuzz in range(max_fuzz + 1):
+        if locate_hunk(lines, hunk, hunk.first, 0, hunk_fuzz) is not None:
+            return False
+        if locate_hunk(lines, reverse, reverse.first, 0, hunk_fuzz) is not None:
+            return True
+    return False
+
+
+def read_lines(path):
+    with open(path, encoding='utf8', errors='surrogateescape', newline='') as f:
+        contents = f.read()
+    lines = contents.split('\n')
+    ends_with_newline = lines[-1] == ''
+    if ends_with_newline:
+        lines.pop()
+    return lines, ends_with_newline
+
+
+def write_lines(path, lines, ends_with_newline):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf8', errors='surrogateescape', newline='') as f:
+        f.write('\n'.join(lines) + ('\n' if ends_with_newline and lines else ''))
+
+
+def apply_diff(diff, root, path=None, fuzz=3):
+    """
+    applies a diff to the files under root, with the a/ and b/ git puts on
+    paths taken off. With a path, every hunk goes to that file, whatever the
+    diff says (like `patch <path> <diff>`).
+    """
+    result = PatchResult()
+    patches = parse_diff(diff)
+    if not patches:
+        result.problems.append('Only garbage was found in the patch input.')
+    for patch in patches:
+        _apply_file_patch(patch, root, path, fuzz, result)
+    return result
+
+
+def _apply_file_patch(patch, root, path, fuzz, result):
+    old_path = path or patch.old_path
+    new_path = path or patch.new_path
+    if old_path is None:
+        result.problems.append("can't tell which file {} hunks are for".format(len(patch.hunks)))
+        return
+    target = new_path if not patch.deleted else old_path
+    result.files.append((target, old_path if patch.renamed else None))
+    if patch.binary:
+        result.problems.append('File {}: git binary diffs are not supported.'.format(target))
+        return
+
+    full_old_path = os.path.join(root, old_path)
+    if patch.created:
+        lines, ends_with_newline = [], True
+    elif os.path.exists(full_old_path):
+        lines, ends_with_newline = read_lines(full_old_path)
+    else:
+        result.problems.append("can't find file to patch: {}".format(old_path))
+        return
+
+    first_result = len(result.hunks)
+    lines = apply_hunks(lines, patch.hunks, target, result, fuzz)
+    for hunk_result in result.hunks[first_result:]:
+        if hunk_result.problem is None and hunk_result.hunk.new_missing_newline:
+            ends_with_newline = False
+        elif hunk_result.problem is None and hunk_result.hunk.old_missing_newline:
+            ends_with_newline = True
+
+    if patch.deleted:
+        if lines:
+            write_lines(full_old_path, lines, ends_with_newline)
+        else:
+            os.remove(full_old_path)
+        return
+    full_new_path = os.path.join(root, new_path)
+    write_lines(full_new_path, lines, ends_with_newline)
+    if patch.renamed and full_new_path != full_old_path and os.path.exists(full_old_path):
+        os.remove(full_old_path)
+    if patch.new_mode is not None:
+        os.chmod(full_new_path, patch.new_mode & 0o777)